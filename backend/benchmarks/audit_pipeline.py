@@ -0,0 +1,378 @@
+"""
+Benchmark de ingesta y consulta del registro de auditoría.
+
+Genera datos sintéticos con COPY en una base de PostgreSQL local (solo si
+tiene menos filas de las pedidas, para reutilizarlos entre ejecuciones) y
+mide:
+
+- ingesta: log_action con commit por evento frente al escritor por lotes
+- get_logs: latencia por desplazamiento, por cursor y con distintos filtros
+- /stats: latencia del resumen para varios rangos de fechas
+- /export: throughput de exportación por formato y compresión
+
+El resultado se imprime como un único objeto JSON para poder compararlo en
+el tiempo. No usar contra una base de datos con datos reales.
+
+Uso (desde backend/):
+    python -m benchmarks.audit_pipeline --database-url postgresql://localhost/audit_bench --rows 10000000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from models.audit_log import AuditLog, AuditStatsDaily, Base
+from utils.audit_export import build_export
+from utils.audit_partitions import ensure_future_partitions
+from utils.audit_writer import AuditWriter
+
+# Distribución aproximada de acciones en producción (las lecturas dominan)
+ACTIONS = [
+    ('view_document', 45), ('list_documents', 20), ('list_logs', 8), ('download_document', 8),
+    ('sign_document', 6), ('upload_document', 5), ('login', 4), ('logout', 2),
+    ('update_config', 1), ('update_role_permissions', 1)
+]
+ROLES = ['admin', 'sub_admin', 'employer', 'management', 'operative']
+STATUSES = [('success', 95), ('warning', 3), ('error', 2)]
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/124.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64) Firefox/125.0'
+]
+COPY_COLUMNS = (
+    'id', 'user_id', 'user_email', 'user_role', 'action', 'details', 'details_json',
+    'ip_address', 'user_agent', 'status', 'created_at'
+)
+COPY_CHUNK_ROWS = 100000
+
+
+class SyntheticData:
+    """Generador reproducible de eventos de auditoría (salvo los ids, siempre únicos)."""
+
+    def __init__(self, users, days, seed=42):
+        self.random = random.Random(seed)
+        self.end = datetime.utcnow().replace(microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        self.span = (self.end - self.start).total_seconds()
+        self.users = [
+            SimpleNamespace(
+                id=str(uuid.UUID(int=self.random.getrandbits(128))),
+                email=f"usuario{index}@casamonarca.com",
+                role=self.random.choice(ROLES)
+            )
+            for index in range(users)
+        ]
+        # Pocos usuarios generan la mayor parte de la actividad
+        self.user_weights = [1.0 / (index + 1) for index in range(users)]
+        self.documents = [str(uuid.UUID(int=self.random.getrandbits(128))) for _ in range(5000)]
+        self.actions, self.action_weights = zip(*ACTIONS)
+        self.statuses, self.status_weights = zip(*STATUSES)
+
+    def user(self):
+        return self.random.choices(self.users, self.user_weights)[0]
+
+    def event(self, created_at=None):
+        user = self.user()
+        action = self.random.choices(self.actions, self.action_weights)[0]
+        details = {'document_id': self.random.choice(self.documents), 'source': 'web'}
+        return {
+            # El id no sale de la semilla: al completar una base ya cargada (o al medir la
+            # ingesta) la misma secuencia generaría ids y fechas ya existentes
+            'id': str(uuid.uuid4()),
+            'user_id': user.id,
+            'user_email': user.email,
+            'user_role': user.role,
+            'action': action,
+            'details': json.dumps(details),
+            'details_json': json.dumps(details),
+            'ip_address': f"10.{self.random.randint(0, 3)}.{self.random.randint(0, 255)}.{self.random.randint(1, 254)}",
+            'user_agent': self.random.choice(USER_AGENTS),
+            'status': self.random.choices(self.statuses, self.status_weights)[0],
+            'created_at': created_at or self.start + timedelta(seconds=self.random.random() * self.span)
+        }
+
+
+def timed(function, repeat):
+    """Ejecuta ``function`` ``repeat`` veces y devuelve p50/p95/max en milisegundos."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 2),
+        'p95_ms': round(samples[max(int(len(samples) * 0.95) - 1, 0)], 2),
+        'max_ms': round(samples[-1], 2)
+    }
+
+
+def prepare(engine, session_factory, data, rows):
+    """Crea el esquema y carga datos hasta tener ``rows`` filas."""
+    # Los índices gin_trgm_ops del modelo requieren la extensión
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    Base.metadata.create_all(engine)
+    months = (data.end.year - data.start.year) * 12 + data.end.month - data.start.month
+    ensure_future_partitions(engine, months + 1, today=data.start.date())
+
+    with engine.connect() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM audit_logs")).scalar()
+
+    missing = rows - existing
+    elapsed = 0.0
+    if missing > 0:
+        start = time.perf_counter()
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            while missing > 0:
+                size = min(missing, COPY_CHUNK_ROWS)
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for _ in range(size):
+                    event = data.event()
+                    writer.writerow([event[column] for column in COPY_COLUMNS])
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f"COPY audit_logs ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+                )
+                raw.commit()
+                missing -= size
+            cursor.execute("ANALYZE audit_logs")
+            raw.commit()
+            cursor.close()
+        finally:
+            raw.close()
+
+        session = session_factory()
+        try:
+            AuditStatsDaily.rebuild(session, data.start.date(), data.end.date())
+        finally:
+            session.close()
+        elapsed = time.perf_counter() - start
+
+    return {
+        'existing_rows': existing,
+        'loaded_rows': max(rows - existing, 0),
+        'load_seconds': round(elapsed, 2),
+        'load_rows_per_second': round((rows - existing) / elapsed, 0) if elapsed else None
+    }
+
+
+def bench_ingestion(engine, session_factory, data, events, batch_size):
+    """Compara log_action con commit por evento frente al escritor por lotes."""
+    results = {}
+    now = datetime.utcnow()
+
+    session = session_factory()
+    try:
+        AuditLog.set_writer(None)
+        start = time.perf_counter()
+        for _ in range(events):
+            event = data.event(now)
+            AuditLog.log_action(session, event['action'], data.user(), json.loads(event['details']),
+                                event['ip_address'], event['user_agent'], event['status'])
+        elapsed = time.perf_counter() - start
+        results['direct'] = {
+            'events': events,
+            'seconds': round(elapsed, 3),
+            'events_per_second': round(events / elapsed, 1)
+        }
+
+        writer = AuditWriter(engine, max_queue_size=events + 1, batch_size=batch_size).start()
+        AuditLog.set_writer(writer)
+        enqueue_samples = []
+        start = time.perf_counter()
+        for _ in range(events):
+            event = data.event(now)
+            call_start = time.perf_counter()
+            AuditLog.log_action(session, event['action'], data.user(), json.loads(event['details']),
+                                event['ip_address'], event['user_agent'], event['status'])
+            enqueue_samples.append((time.perf_counter() - call_start) * 1000)
+        writer.flush()
+        elapsed = time.perf_counter() - start
+        writer.stop()
+        AuditLog.set_writer(None)
+
+        enqueue_samples.sort()
+        results['batched'] = {
+            'events': events,
+            'batch_size': batch_size,
+            'seconds': round(elapsed, 3),
+            'events_per_second': round(events / elapsed, 1),
+            'enqueue_p50_ms': round(statistics.median(enqueue_samples), 4),
+            'enqueue_p99_ms': round(enqueue_samples[max(int(len(enqueue_samples) * 0.99) - 1, 0)], 4),
+            'written': writer.written,
+            'dropped': writer.dropped
+        }
+    finally:
+        session.close()
+
+    return results
+
+
+def bench_queries(session_factory, data, repeat, offsets):
+    """Latencia de get_logs por desplazamiento, cursor y filtros."""
+    results = {'offset': {}, 'cursor': {}, 'filters': {}}
+    session = session_factory()
+    try:
+        for offset in offsets:
+            results['offset'][str(offset)] = timed(
+                lambda: AuditLog.get_logs(session, limit=50, offset=offset, count_mode='none'), repeat
+            )
+
+        # Recorrer páginas consecutivas por keyset hasta la profundidad máxima medida
+        logs, _, _, cursor = AuditLog.get_logs(session, limit=50, count_mode='none')
+        page = 1
+        deepest = max(offsets) // 50 if offsets else 0
+        samples = []
+        while cursor and page <= deepest:
+            start = time.perf_counter()
+            logs, _, _, cursor = AuditLog.get_logs(session, limit=50, cursor=cursor, count_mode='none')
+            samples.append((time.perf_counter() - start) * 1000)
+            page += 1
+        if samples:
+            samples.sort()
+            results['cursor'] = {
+                'pages': len(samples),
+                'p50_ms': round(statistics.median(samples), 2),
+                'max_ms': round(samples[-1], 2)
+            }
+
+        user = data.users[len(data.users) // 2]
+        last_week = data.end - timedelta(days=7)
+        variants = {
+            'none': {},
+            'action': {'action': 'sign_document'},
+            'user_email': {'user_email': user.email.split('@')[0]},
+            'date_range': {'start_date': last_week, 'end_date': data.end},
+            'ip_prefix': {'ip_address': '10.1.'},
+            'details_fields': {'details_fields': {'document_id': data.documents[0]}},
+            'details_search': {'details': data.documents[1][:8]}
+        }
+        for name, filters in variants.items():
+            results['filters'][name] = {
+                count_mode: timed(
+                    lambda: AuditLog.get_logs(session, filters, limit=50, count_mode=count_mode), repeat
+                )
+                for count_mode in ('none', 'estimated', 'exact')
+            }
+    finally:
+        session.close()
+
+    return results
+
+
+def bench_stats(session_factory, data, repeat):
+    """Latencia del resumen de /stats para distintos rangos."""
+    session = session_factory()
+    try:
+        end = data.end.date()
+        ranges = {
+            '1d': (end, end),
+            '30d': (end - timedelta(days=30), end),
+            'all': (None, None)
+        }
+        return {
+            name: timed(lambda: AuditStatsDaily.summarize(session, start, stop), repeat)
+            for name, (start, stop) in ranges.items()
+        }
+    finally:
+        session.close()
+
+
+def bench_export(session_factory, data, export_days):
+    """Throughput de la exportación en streaming por formato y compresión."""
+    results = {}
+    filters = {'start_date': data.end - timedelta(days=export_days), 'end_date': data.end}
+    variants = [('csv', 'none'), ('csv', 'gzip'), ('ndjson', 'gzip'), ('ndjson', 'zstd'), ('parquet', 'zstd')]
+
+    for export_format, compression in variants:
+        session = session_factory()
+        counted = []
+
+        def rows():
+            for row in AuditLog.iter_logs(session, filters, chunk_size=2000):
+                counted.append(1)
+                yield row
+
+        try:
+            start = time.perf_counter()
+            chunks, _, _ = build_export(rows(), AuditLog.EXPORT_COLUMNS, export_format, compression)
+            size = sum(len(chunk) for chunk in chunks)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            # Dependencias opcionales (zstandard, pyarrow) no instaladas
+            results[f"{export_format}+{compression}"] = {'error': str(e)}
+            continue
+        finally:
+            session.close()
+
+        results[f"{export_format}+{compression}"] = {
+            'rows': len(counted),
+            'bytes': size,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(len(counted) / elapsed, 0) if elapsed else None,
+            'mb_per_second': round(size / elapsed / 1024 / 1024, 2) if elapsed else None
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database-url', default=os.environ.get('AUDIT_BENCH_DATABASE_URL'),
+                        help='Base de datos de pruebas (no usar la de producción)')
+    parser.add_argument('--rows', type=int, default=1000000, help='Filas sintéticas en audit_logs')
+    parser.add_argument('--days', type=int, default=180, help='Días cubiertos por los datos')
+    parser.add_argument('--users', type=int, default=500, help='Usuarios sintéticos')
+    parser.add_argument('--events', type=int, default=5000, help='Eventos por modo de ingesta')
+    parser.add_argument('--batch-size', type=int, default=500, help='Lote del escritor por lotes')
+    parser.add_argument('--repeat', type=int, default=10, help='Repeticiones por consulta')
+    parser.add_argument('--offsets', default='0,1000,10000,100000', help='Desplazamientos de get_logs')
+    parser.add_argument('--export-days', type=int, default=7, help='Días exportados por variante')
+    parser.add_argument('--skip', default='', help='Etapas a omitir: ingestion,queries,stats,export')
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error('Se requiere --database-url o AUDIT_BENCH_DATABASE_URL')
+
+    engine = create_engine(args.database_url)
+    session_factory = sessionmaker(bind=engine)
+    data = SyntheticData(args.users, args.days)
+    skip = set(filter(None, args.skip.split(',')))
+    offsets = [int(offset) for offset in args.offsets.split(',') if offset]
+
+    report = {
+        'benchmark': 'audit_pipeline',
+        'timestamp': datetime.utcnow().isoformat(),
+        'rows': args.rows,
+        'days': args.days,
+        'setup': prepare(engine, session_factory, data, args.rows)
+    }
+    if 'ingestion' not in skip:
+        report['ingestion'] = bench_ingestion(engine, session_factory, data, args.events, args.batch_size)
+    if 'queries' not in skip:
+        report['get_logs'] = bench_queries(session_factory, data, args.repeat, offsets)
+    if 'stats' not in skip:
+        report['stats'] = bench_stats(session_factory, data, args.repeat)
+    if 'export' not in skip:
+        report['export'] = bench_export(session_factory, data, args.export_days)
+
+    engine.dispose()
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark de contención para SignatureFlow.record_signature.
+
+Crea un documento con un flujo de dos etapas y lanza muchos firmantes
+simulados en paralelo contra la primera etapa. Al terminar verifica que
+exactamente ``required_count`` firmas hayan sido aceptadas y que los
+contadores coincidan con ``signature_status``, y reporta el throughput.
+
+Uso:
+    python -m backend.benchmarks.signature_contention --signers 50 --required 10
+"""
+import argparse
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.db import get_db_connection
+from backend.models.signature_flow import SignatureFlow
+
+SIGNER_ROLE = 'employer'
+NEXT_ROLE = 'management'
+
+
+def setup_document(required_count):
+    """Crea un flujo de prueba y devuelve el ID del documento."""
+    document_id = str(uuid.uuid4())
+    created = SignatureFlow.create_flow(document_id, [
+        {"role": SIGNER_ROLE, "count": required_count, "order": 1},
+        # La segunda etapa evita que el documento pase a 'signed' durante la prueba
+        {"role": NEXT_ROLE, "count": 1, "order": 2},
+    ])
+    if not created:
+        raise RuntimeError("No se pudo crear el flujo de firmas de prueba")
+    return document_id
+
+
+def cleanup_document(document_id):
+    """
+    Elimina el flujo de prueba y descuenta su aporte a signature_stage_latency_daily.
+
+    record_signature suma cada etapa completada al agregado diario; sin este
+    descuento cada ejecución dejaría datos falsos en /api/flows/analytics. Las
+    filas del agregado que solo contenían etapas del benchmark se eliminan.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT role, flow_order, COALESCE(ready_at, created_at), completed_at,
+                   COALESCE((SELECT area FROM documents WHERE id = %s), '')
+            FROM signature_flows
+            WHERE document_id = %s AND completed_at IS NOT NULL
+            """,
+            (document_id, document_id)
+        )
+        for role, stage_order, waiting_since, completed_at, area in cursor.fetchall():
+            wait_seconds = max((completed_at - waiting_since).total_seconds(), 0.0)
+            key = (
+                completed_at.date(), area, role, stage_order,
+                SignatureFlow._wait_bucket(wait_seconds)
+            )
+            cursor.execute(
+                """
+                UPDATE signature_stage_latency_daily
+                SET stage_count = stage_count - 1,
+                    total_wait_seconds = GREATEST(total_wait_seconds - %s, 0)
+                WHERE day = %s AND area = %s AND role = %s AND stage_order = %s AND bucket = %s
+                """,
+                (wait_seconds,) + key
+            )
+            cursor.execute(
+                """
+                DELETE FROM signature_stage_latency_daily
+                WHERE day = %s AND area = %s AND role = %s AND stage_order = %s AND bucket = %s
+                AND stage_count <= 0
+                """,
+                key
+            )
+
+        cursor.execute("DELETE FROM signature_status WHERE document_id = %s", (document_id,))
+        cursor.execute("DELETE FROM signature_flows WHERE document_id = %s", (document_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def read_counters(document_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT current_count FROM signature_flows WHERE document_id = %s AND role = %s",
+            (document_id, SIGNER_ROLE)
+        )
+        current_count = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT COUNT(*) FROM signature_status WHERE document_id = %s AND role = %s",
+            (document_id, SIGNER_ROLE)
+        )
+        recorded = cursor.fetchone()[0]
+        return current_count, recorded
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def run(signers, required_count, workers):
+    document_id = setup_document(required_count)
+    user_ids = [str(uuid.uuid4()) for _ in range(signers)]
+    latencies = []
+
+    def sign(user_id):
+        start = time.perf_counter()
+        result = SignatureFlow.record_signature(document_id, user_id, SIGNER_ROLE)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(sign, user_ids))
+        elapsed = time.perf_counter() - start
+
+        accepted = sum(1 for r in results if r["success"])
+        current_count, recorded = read_counters(document_id)
+        latencies.sort()
+
+        report = {
+            "benchmark": "signature_contention",
+            "signers": signers,
+            "workers": workers,
+            "required_count": required_count,
+            "accepted": accepted,
+            "rejected": signers - accepted,
+            "current_count": current_count,
+            "recorded_signatures": recorded,
+            "correct": accepted == required_count == current_count == recorded,
+            "elapsed_seconds": round(elapsed, 4),
+            "throughput_per_second": round(signers / elapsed, 2) if elapsed else None,
+            "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "latency_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        }
+        return report
+    finally:
+        cleanup_document(document_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--signers', type=int, default=50, help='Firmantes simulados')
+    parser.add_argument('--required', type=int, default=10, help='Firmas requeridas en la etapa')
+    parser.add_argument('--workers', type=int, default=16, help='Hilos concurrentes')
+    args = parser.parse_args()
+
+    report = run(args.signers, args.required, args.workers)
+    print(json.dumps(report))
+    if not report["correct"]:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,47 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or 'noreply@casamonarca.com'
+    # Pool de conexiones SMTP persistentes
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE') or 4)
+    MAIL_POOL_MAX_IDLE = int(os.environ.get('MAIL_POOL_MAX_IDLE') or 240)  # segundos
+    MAIL_POOL_MAX_MESSAGES = int(os.environ.get('MAIL_POOL_MAX_MESSAGES') or 100)
+    # Bandeja de salida: las peticiones encolan y los workers entregan con reintentos.
+    # Al activarla hay que llamar a utils.email_service.init_email(app) al arrancar
+    # la aplicación, que inicia los workers (sin ellos los correos, incluidos los
+    # códigos 2FA, se quedan en la cola)
+    MAIL_USE_OUTBOX = (os.environ.get('MAIL_USE_OUTBOX') or 'false').lower() == 'true'
+    EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS') or 4)
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE') or 10)
+    EMAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL') or 5.0)
+    EMAIL_OUTBOX_RETRY_DELAY = int(os.environ.get('EMAIL_OUTBOX_RETRY_DELAY') or 30)  # segundos
+    EMAIL_OUTBOX_MAX_RETRY_DELAY = int(os.environ.get('EMAIL_OUTBOX_MAX_RETRY_DELAY') or 3600)
+    # Plantillas de templates/email (compiladas por init_email): CSS aplicado en línea al
+    # compilarlas (si no, se embebe en <style>)
+    MAIL_INLINE_CSS = (os.environ.get('MAIL_INLINE_CSS') or 'true').lower() == 'true'
+    
+    # Configuración del escritor de auditoría con búfer
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE') or 10000)
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE') or 500)
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL') or 1.0)
+    AUDIT_OVERFLOW_POLICY = os.environ.get('AUDIT_OVERFLOW_POLICY') or 'block'  # block, drop, sync, spool
+    AUDIT_BLOCK_TIMEOUT = float(os.environ.get('AUDIT_BLOCK_TIMEOUT') or 1.0)
+    # Checkpoints de Merkle encadenados por lote y firma con la clave de PDFSigner
+    AUDIT_TAMPER_EVIDENT = (os.environ.get('AUDIT_TAMPER_EVIDENT') or 'false').lower() == 'true'
+    AUDIT_SIGN_CHECKPOINTS = (os.environ.get('AUDIT_SIGN_CHECKPOINTS') or 'false').lower() == 'true'
+    # Spool en disco para eventos que no se pueden escribir en la base de datos
+    AUDIT_SPOOL_DIR = os.environ.get('AUDIT_SPOOL_DIR') or '/var/lib/casamonarca/audit_spool'
+    AUDIT_SPOOL_SEGMENT_BYTES = int(os.environ.get('AUDIT_SPOOL_SEGMENT_BYTES') or 16 * 1024 * 1024)
+    AUDIT_SPOOL_FSYNC_BATCH = int(os.environ.get('AUDIT_SPOOL_FSYNC_BATCH') or 100)
+    AUDIT_SPOOL_FSYNC_INTERVAL = float(os.environ.get('AUDIT_SPOOL_FSYNC_INTERVAL') or 0.2)
+    AUDIT_SPOOL_REPLAY_INTERVAL = float(os.environ.get('AUDIT_SPOOL_REPLAY_INTERVAL') or 5.0)
+    # Política de muestreo y agregación (se lee de system_config: audit/policy)
+    AUDIT_POLICY_RELOAD_INTERVAL = float(os.environ.get('AUDIT_POLICY_RELOAD_INTERVAL') or 30.0)
+    AUDIT_AGGREGATE_WINDOW = int(os.environ.get('AUDIT_AGGREGATE_WINDOW') or 60)  # segundos
+    
+    # Particionado, retención y archivo de audit_logs
+    AUDIT_PARTITIONS_AHEAD = int(os.environ.get('AUDIT_PARTITIONS_AHEAD') or 3)  # meses
+    AUDIT_RETENTION_MONTHS = int(os.environ.get('AUDIT_RETENTION_MONTHS') or 24)
+    AUDIT_ARCHIVE_DIR = os.environ.get('AUDIT_ARCHIVE_DIR') or '/var/lib/casamonarca/audit_archive'
 
 class DevelopmentConfig(Config):
     DEBUG = True
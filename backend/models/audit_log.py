@@ -1,11 +1,35 @@
-from sqlalchemy import Column, String, DateTime, Text
+from sqlalchemy import Column, String, DateTime, Date, BigInteger, Integer, Float, Text, Index, cast, func, text, tuple_
+from sqlalchemy.dialects.postgresql import INET, JSONB, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from collections import Counter
+from datetime import datetime, timedelta
+import atexit
+import base64
+import ipaddress
+import logging
 import uuid
 import json
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) de una consulta, con sus parámetros ya procesados."""
+    inherit_cache = False
+    
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain)
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
 class AuditLog(Base):
     """
     Modelo para almacenar registros de auditoría del sistema.
@@ -14,6 +38,24 @@ class AuditLog(Base):
     para fines de auditoría y seguridad.
     """
     __tablename__ = 'audit_logs'
+    __table_args__ = (
+        # Soporta el orden estable y la paginación por keyset (created_at, id)
+        Index('ix_audit_logs_created_at_id', 'created_at', 'id'),
+        # Búsqueda por subcadena (ILIKE '%...%') con pg_trgm
+        Index('ix_audit_logs_details_trgm', 'details',
+              postgresql_using='gin', postgresql_ops={'details': 'gin_trgm_ops'}),
+        Index('ix_audit_logs_user_email_trgm', 'user_email',
+              postgresql_using='gin', postgresql_ops={'user_email': 'gin_trgm_ops'}),
+        # Consultas de contención (@>) sobre los detalles estructurados
+        Index('ix_audit_logs_details_json', 'details_json',
+              postgresql_using='gin', postgresql_ops={'details_json': 'jsonb_path_ops'}),
+        # Búsqueda por dirección exacta o prefijo CIDR (<<=)
+        Index('ix_audit_logs_ip_address', 'ip_address',
+              postgresql_using='gist', postgresql_ops={'ip_address': 'inet_ops'}),
+        # Particionada por mes (ver utils/audit_partitions.py); la clave de
+        # partición debe formar parte de la clave primaria
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String(36), nullable=True)
@@ -21,10 +63,77 @@ class AuditLog(Base):
     user_role = Column(String(20), nullable=True)
     action = Column(String(50), nullable=False, index=True)
     details = Column(Text, nullable=True)
-    ip_address = Column(String(50), nullable=True)
+    details_json = Column(JSONB, nullable=True)  # detalles estructurados cuando se registran como diccionario
+    ip_address = Column(INET, nullable=True)
     user_agent = Column(String(255), nullable=True)
     status = Column(String(20), nullable=False, default='success')  # success, warning, error
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow, index=True)
+    checkpoint_seq = Column(BigInteger, nullable=True, index=True)  # checkpoint de integridad que sella la fila
+    
+    # Columnas devueltas por iter_logs (en este orden)
+    EXPORT_COLUMNS = (
+        'id', 'user_id', 'user_email', 'user_role', 'action', 'details',
+        'ip_address', 'user_agent', 'status', 'created_at'
+    )
+    
+    # Escritor con búfer opcional (utils.audit_writer.AuditWriter)
+    _writer = None
+    # Sellado de integridad opcional (utils.audit_integrity.AuditIntegrity)
+    _integrity = None
+    # Política de muestreo y agregación opcional (utils.audit_policy.AuditPolicy)
+    _policy = None
+    
+    @classmethod
+    def set_writer(cls, writer):
+        """
+        Configura el escritor con búfer usado por log_action (None para desactivarlo).
+        """
+        cls._writer = writer
+        if writer is not None:
+            writer.policy = cls._policy
+    
+    @classmethod
+    def set_integrity(cls, integrity):
+        """
+        Activa el modo a prueba de manipulaciones para las escrituras directas
+        de log_action (None para desactivarlo).
+        """
+        cls._integrity = integrity
+    
+    @classmethod
+    def set_policy(cls, policy, session_factory=None):
+        """
+        Configura la política de muestreo y agregación de log_action (None para
+        registrar todos los eventos completos).
+        
+        Con un escritor con búfer, su hilo emite las ventanas de agregación
+        cerradas aunque no lleguen más eventos y las pendientes al detenerse.
+        Con ``session_factory`` además se escriben los contadores pendientes al
+        terminar el proceso (necesario sin escritor con búfer).
+        """
+        cls._policy = policy
+        if cls._writer is not None:
+            cls._writer.policy = policy
+        if policy is not None and session_factory is not None:
+            atexit.register(cls._flush_policy_at_exit, session_factory)
+    
+    @classmethod
+    def flush_policy(cls, session):
+        """
+        Escribe los contadores de agregación pendientes (llamar al detener la aplicación).
+        """
+        if cls._policy is not None:
+            cls._store_rows(session, cls._policy.flush(force=True))
+    
+    @classmethod
+    def _flush_policy_at_exit(cls, session_factory):
+        session = session_factory()
+        try:
+            cls.flush_policy(session)
+        except Exception as e:
+            logger.error(f"Error al escribir los contadores de auditoría pendientes: {e}")
+        finally:
+            session.close()
     
     @classmethod
     def log_action(cls, session, action, user=None, details=None, ip_address=None, 
@@ -41,36 +150,81 @@ class AuditLog(Base):
             user_agent: User-Agent del navegador
             status: Estado de la acción (success, warning, error)
             
+        Si hay un escritor con búfer configurado, el evento solo se encola y se
+        escribe por lotes en segundo plano; la sesión no se usa ni se confirma.
+        Con una política configurada el evento puede omitirse por muestreo o
+        sumarse a un contador por usuario y minuto.
+        
         Returns:
             La instancia del log de auditoría creada
         """
-        # Convertir detalles a formato JSON si es un diccionario
+        # Los diccionarios se guardan como JSONB para consultas por campo y como
+        # texto para la visualización y la búsqueda libre
+        details_json = None
         if isinstance(details, dict):
+            details_json = details
             details = json.dumps(details)
         
-        # Crear registro de auditoría
-        audit_log = cls(
-            id=str(uuid.uuid4()),
-            user_id=user.id if user else None,
-            user_email=user.email if user else None,
-            user_role=user.role if user else None,
-            action=action,
-            details=details,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            status=status
-        )
+        row = {
+            'id': str(uuid.uuid4()),
+            'user_id': user.id if user else None,
+            'user_email': user.email if user else None,
+            'user_role': user.role if user else None,
+            'action': action,
+            'details': details,
+            'details_json': details_json,
+            'ip_address': cls._normalize_ip(ip_address),
+            'user_agent': user_agent,
+            'status': status,
+            # La fecha se fija al registrar el evento, no al escribir el lote
+            'created_at': datetime.utcnow()
+        }
         
-        session.add(audit_log)
-        session.commit()
+        rows = [row] if cls._policy is None else cls._policy.apply(session, row)
+        cls._store_rows(session, rows)
         
-        return audit_log
+        return cls(**row)
     
     @classmethod
-    def get_logs(cls, session, filters=None, limit=100, offset=0, order_by='created_at', order='desc'):
+    def _store_rows(cls, session, rows):
+        """
+        Escribe eventos con el escritor con búfer o, si no lo hay, directamente
+        en la sesión.
+        
+        Los eventos que el escritor no acepta solo se escriben en la sesión con
+        la política sync; con las demás ya quedaron descartados y contabilizados
+        por el escritor, y la petición no espera a la base de datos saturada.
+        """
+        if cls._writer is not None:
+            rows = [row for row in rows if not cls._writer.enqueue(row)]
+            if not cls._writer.sync_fallback:
+                return
+        if not rows:
+            return
+        
+        checkpoint = None
+        if cls._integrity is not None:
+            checkpoint = cls._integrity.begin(session.connection())
+            for row in rows:
+                row['checkpoint_seq'] = checkpoint.seq
+        
+        # Crear registros de auditoría
+        session.add_all([cls(**row) for row in rows])
+        AuditStatsDaily.increment(session, rows)
+        if checkpoint is not None:
+            cls._integrity.commit(session.connection(), checkpoint, rows)
+        session.commit()
+    
+    @classmethod
+    def get_logs(cls, session, filters=None, limit=100, offset=0, order_by='created_at', order='desc',
+                 cursor=None, count_mode='exact'):
         """
         Obtiene registros de auditoría con filtros opcionales.
         
+        Con ``cursor`` la página se obtiene por keyset sobre (created_at, id), de
+        modo que el costo no depende de la profundidad; solo es válido ordenando
+        por created_at y en ese caso se ignora ``offset``.
+        
         Args:
             session: Sesión de SQLAlchemy
             filters: Diccionario con filtros a aplicar
@@ -78,49 +232,425 @@ class AuditLog(Base):
             offset: Desplazamiento para paginación
             order_by: Campo por el cual ordenar
             order: Dirección de ordenamiento (asc, desc)
+            cursor: Cursor opaco devuelto como next_cursor por la página anterior
+            count_mode: Cómo calcular el total (exact, estimated, none)
             
         Returns:
-            Lista de registros de auditoría y conteo total
+            Tupla (registros, total, has_more, next_cursor); total es None con
+            count_mode='none' (o si no se pudo estimar) y next_cursor es None si
+            no hay más páginas o no se ordena por created_at
         """
-        query = session.query(cls)
+        query = cls._apply_filters(session.query(cls), filters)
         
-        # Aplicar filtros si se proporcionan
-        if filters:
-            if 'user_id' in filters:
-                query = query.filter(cls.user_id == filters['user_id'])
-            
-            if 'user_email' in filters:
-                query = query.filter(cls.user_email.like(f"%{filters['user_email']}%"))
-            
-            if 'action' in filters:
-                query = query.filter(cls.action == filters['action'])
-            
-            if 'status' in filters:
-                query = query.filter(cls.status == filters['status'])
-            
-            if 'start_date' in filters and 'end_date' in filters:
-                query = query.filter(cls.created_at.between(filters['start_date'], filters['end_date']))
-            elif 'start_date' in filters:
-                query = query.filter(cls.created_at >= filters['start_date'])
-            elif 'end_date' in filters:
-                query = query.filter(cls.created_at <= filters['end_date'])
-            
-            if 'ip_address' in filters:
-                query = query.filter(cls.ip_address.like(f"%{filters['ip_address']}%"))
+        # Obtener conteo total
+        if count_mode == 'exact':
+            total = query.count()
+        elif count_mode == 'estimated':
+            total = cls._estimate_count(session, query, filters)
+        else:
+            total = None
+        
+        column = getattr(cls, order_by)
+        descending = order != 'asc'
+        
+        # Aplicar ordenamiento (id como desempate para un orden estable)
+        if descending:
+            query = query.order_by(column.desc(), cls.id.desc())
+        else:
+            query = query.order_by(column.asc(), cls.id.asc())
+        
+        if cursor is not None:
+            if order_by != 'created_at':
+                raise ValueError("La paginación por cursor solo admite ordenar por created_at")
             
-            if 'details' in filters:
-                query = query.filter(cls.details.like(f"%{filters['details']}%"))
+            cursor_created_at, cursor_id = cls.decode_cursor(cursor)
+            # La cota simple sobre created_at permite descartar particiones;
+            # la comparación de tuplas fija la posición exacta
+            position = tuple_(cls.created_at, cls.id)
+            if descending:
+                query = query.filter(cls.created_at <= cursor_created_at,
+                                     position < tuple_(cursor_created_at, cursor_id))
+            else:
+                query = query.filter(cls.created_at >= cursor_created_at,
+                                     position > tuple_(cursor_created_at, cursor_id))
+        elif offset:
+            query = query.offset(offset)
         
-        # Obtener conteo total
-        total = query.count()
+        # Se pide una fila extra para saber si hay más páginas sin contar
+        logs = query.limit(limit + 1).all()
+        has_more = len(logs) > limit
+        logs = logs[:limit]
+        
+        next_cursor = None
+        if has_more and order_by == 'created_at':
+            next_cursor = cls.encode_cursor(logs[-1].created_at, logs[-1].id)
+        
+        return logs, total, has_more, next_cursor
+    
+    @staticmethod
+    def encode_cursor(created_at, log_id):
+        """
+        Codifica la posición (created_at, id) de un registro como cursor opaco.
+        """
+        payload = json.dumps({'t': created_at.isoformat(), 'id': log_id})
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Decodifica un cursor de paginación.
+        
+        Raises:
+            ValueError: si el cursor no es válido
+        """
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return datetime.fromisoformat(payload['t']), str(payload['id'])
+        except Exception:
+            raise ValueError("Cursor de paginación inválido")
+    
+    @classmethod
+    def _estimate_count(cls, session, query, filters):
+        """
+        Estima el total sin recorrer la tabla.
+        
+        Sin filtros usa las estadísticas del catálogo (reltuples); con filtros usa
+        el número de filas estimado por el planificador para la consulta. Si el
+        planificador falla devuelve None en lugar de propagar el error.
+        """
+        if not filters:
+            # La tabla padre particionada no tiene filas propias: se suman sus particiones
+            estimate = session.execute(
+                text("""
+                    SELECT SUM(GREATEST(c.reltuples, 0))::BIGINT
+                    FROM pg_class c
+                    WHERE c.oid = CAST(:table AS regclass)
+                    OR c.oid IN (
+                        SELECT inhrelid FROM pg_inherits
+                        WHERE inhparent = CAST(:table AS regclass)
+                    )
+                """),
+                {'table': cls.__tablename__}
+            ).scalar()
+            return int(estimate or 0)
+        
+        # El EXPLAIN se ejecuta como sentencia de SQLAlchemy para que los parámetros
+        # pasen por el procesamiento de tipos (p. ej. el dict de un filtro JSONB)
+        try:
+            with session.begin_nested():
+                plan = session.execute(_Explain(query.statement)).scalar()
+        except SQLAlchemyError as e:
+            logger.warning(f"No se pudo estimar el total de registros de auditoría: {e}")
+            return None
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    
+    @classmethod
+    def _apply_filters(cls, query, filters):
+        """
+        Aplica a una consulta los filtros aceptados por get_logs.
+        """
+        if not filters:
+            return query
+        
+        if 'user_id' in filters:
+            query = query.filter(cls.user_id == filters['user_id'])
+        
+        if 'user_email' in filters:
+            query = query.filter(cls._contains(cls.user_email, filters['user_email']))
+        
+        if 'action' in filters:
+            query = query.filter(cls.action == filters['action'])
+        
+        if 'status' in filters:
+            query = query.filter(cls.status == filters['status'])
+        
+        if 'start_date' in filters and 'end_date' in filters:
+            query = query.filter(cls.created_at.between(filters['start_date'], filters['end_date']))
+        elif 'start_date' in filters:
+            query = query.filter(cls.created_at >= filters['start_date'])
+        elif 'end_date' in filters:
+            query = query.filter(cls.created_at <= filters['end_date'])
+        
+        if 'ip_address' in filters:
+            query = query.filter(cls._ip_condition(filters['ip_address']))
+        
+        if 'details' in filters:
+            query = query.filter(cls._contains(cls.details, filters['details']))
+        
+        if 'details_fields' in filters:
+            query = query.filter(cls.details_json.contains(cls._details_document(filters['details_fields'])))
+        
+        return query
+    
+    @staticmethod
+    def _details_document(fields):
+        """
+        Convierte {"document.id": 5, "status": "ok"} en el documento anidado
+        {"document": {"id": 5}, "status": "ok"} usado en la consulta de contención.
+        """
+        document = {}
+        for path, value in fields.items():
+            keys = path.split('.')
+            node = document
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+            node[keys[-1]] = value
+        return document
+    
+    @staticmethod
+    def _contains(column, term):
+        """
+        Búsqueda de subcadena sin distinguir mayúsculas, resuelta con el índice
+        trigram de la columna (requiere al menos 3 caracteres para usarlo).
+        """
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return column.ilike(f"%{escaped}%", escape='\\')
+    
+    @classmethod
+    def _ip_condition(cls, term):
+        """
+        Traduce el filtro de IP al operador indexable adecuado:
+        dirección exacta (=), red CIDR (<<=) o prefijo de octetos completos
+        terminado en punto ("192.168." -> 192.168.0.0/16). Un octeto parcial
+        ("10.1") se compara como prefijo de texto y también encuentra 10.10.x
+        y 10.100.x.
+        """
+        term = term.strip()
+        
+        try:
+            return cls.ip_address == str(ipaddress.ip_address(term))
+        except ValueError:
+            pass
+        
+        network = None
+        if '/' in term:
+            try:
+                network = ipaddress.ip_network(term, strict=False)
+            except ValueError:
+                pass
+        elif term.endswith('.'):
+            octets = [octet for octet in term.rstrip('.').split('.') if octet]
+            if 0 < len(octets) < 4 and all(octet.isdigit() and int(octet) < 256 for octet in octets):
+                padded = octets + ['0'] * (4 - len(octets))
+                network = ipaddress.ip_network(f"{'.'.join(padded)}/{8 * len(octets)}")
+        
+        if network is not None:
+            return cls.ip_address.op('<<=')(cast(str(network), INET))
+        
+        # Texto arbitrario: comparar contra la representación de la dirección
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return func.host(cls.ip_address).like(f"{escaped}%", escape='\\')
+    
+    @staticmethod
+    def _normalize_ip(ip_address):
+        """
+        Normaliza la IP recibida para la columna inet (primera de X-Forwarded-For);
+        devuelve None si no es una dirección válida.
+        """
+        if not ip_address:
+            return None
+        try:
+            return str(ipaddress.ip_address(ip_address.split(',')[0].strip()))
+        except ValueError:
+            return None
+    
+    @classmethod
+    def iter_logs(cls, session, filters=None, chunk_size=1000, order='desc'):
+        """
+        Recorre los registros que cumplen los filtros sin cargarlos todos en memoria.
+        
+        Usa un cursor del lado del servidor (cursor con nombre de psycopg2) y lee
+        ``chunk_size`` filas por viaje; devuelve tuplas con las columnas de
+        EXPORT_COLUMNS en lugar de instancias ORM.
+        
+        Args:
+            session: Sesión de SQLAlchemy
+            filters: Diccionario con filtros a aplicar (los mismos que get_logs)
+            chunk_size: Filas leídas del servidor por cada viaje
+            order: Dirección de ordenamiento por fecha (asc, desc)
+            
+        Yields:
+            Tuplas (id, user_id, user_email, user_role, action, details,
+            ip_address, user_agent, status, created_at)
+        """
+        columns = [getattr(cls, name) for name in cls.EXPORT_COLUMNS]
+        query = cls._apply_filters(session.query(*columns), filters)
         
-        # Aplicar ordenamiento
         if order == 'asc':
-            query = query.order_by(getattr(cls, order_by).asc())
+            query = query.order_by(cls.created_at.asc(), cls.id.asc())
         else:
-            query = query.order_by(getattr(cls, order_by).desc())
+            query = query.order_by(cls.created_at.desc(), cls.id.desc())
+        
+        for row in query.yield_per(chunk_size):
+            yield tuple(row)
+
+
+class AuditStatsDaily(Base):
+    """
+    Conteos diarios de auditoría por acción, estado y usuario.
+    
+    Se actualiza de forma incremental en la misma transacción que inserta los
+    eventos (escritor con búfer o log_action directo), de modo que /stats nunca
+    recorre audit_logs. ``rebuild`` recalcula un rango a partir de los eventos.
+    """
+    __tablename__ = 'audit_stats_daily'
+    
+    day = Column(Date, primary_key=True)
+    action = Column(String(50), primary_key=True)
+    status = Column(String(20), primary_key=True)
+    user_email = Column(String(100), primary_key=True, default='')  # '' para eventos sin usuario
+    count = Column(BigInteger, nullable=False, default=0)
+    
+    @classmethod
+    def increment(cls, connection, rows):
+        """
+        Suma a los contadores diarios los eventos indicados.
         
-        # Aplicar paginación
-        query = query.limit(limit).offset(offset)
+        Args:
+            connection: Sesión o conexión de SQLAlchemy (dentro de la transacción del insert)
+            rows: Eventos como diccionarios con las columnas de audit_logs
+        """
+        counts = Counter()
+        for row in rows:
+            key = (row['created_at'].date(), row['action'], row['status'], row['user_email'] or '')
+            counts[key] += cls._event_weight(row)
+        if not counts:
+            return
+        
+        statement = insert(cls.__table__).values([
+            {'day': day, 'action': action, 'status': status, 'user_email': email, 'count': count}
+            for (day, action, status, email), count in counts.items()
+        ])
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['day', 'action', 'status', 'user_email'],
+            set_={'count': cls.__table__.c.count + statement.excluded.count}
+        ))
+    
+    @staticmethod
+    def _event_weight(row):
+        """
+        Número de eventos que representa una fila (filas agregadas o muestreadas
+        por utils.audit_policy).
+        """
+        details = row.get('details_json') or {}
+        if details.get('event_count'):
+            return int(details['event_count'])
+        if details.get('sample_rate'):
+            return max(int(round(1 / float(details['sample_rate']))), 1)
+        return 1
+    
+    @classmethod
+    def rebuild(cls, session, start_date, end_date):
+        """
+        Recalcula los contadores de un rango de días a partir de audit_logs
+        (carga inicial o corrección de datos insertados por otras vías).
+        
+        Args:
+            session: Sesión de SQLAlchemy
+            start_date: Primer día (date, inclusive)
+            end_date: Último día (date, inclusive)
+        """
+        session.query(cls).filter(cls.day.between(start_date, end_date)).delete(synchronize_session=False)
+        
+        day = cast(AuditLog.created_at, Date)
+        aggregated = session.query(
+            day,
+            AuditLog.action,
+            AuditLog.status,
+            func.coalesce(AuditLog.user_email, ''),
+            # Las filas agregadas o muestreadas cuentan por los eventos que representan
+            func.sum(func.coalesce(
+                cast(AuditLog.details_json['event_count'].astext, BigInteger),
+                cast(func.round(1.0 / cast(AuditLog.details_json['sample_rate'].astext, Float)), BigInteger),
+                1
+            ))
+        ).filter(
+            AuditLog.created_at >= datetime.combine(start_date, datetime.min.time()),
+            AuditLog.created_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+        ).group_by(day, AuditLog.action, AuditLog.status, func.coalesce(AuditLog.user_email, ''))
+        
+        session.execute(
+            insert(cls.__table__).from_select(
+                ['day', 'action', 'status', 'user_email', 'count'],
+                aggregated.statement
+            )
+        )
+        session.commit()
+    
+    @classmethod
+    def summarize(cls, session, start_date=None, end_date=None, top_users=10):
+        """
+        Obtiene las estadísticas de auditoría desde los contadores diarios.
+        
+        Args:
+            session: Sesión de SQLAlchemy
+            start_date: Primer día (date) o None para no acotar
+            end_date: Último día (date) o None para no acotar
+            top_users: Número de usuarios con más eventos a devolver
+            
+        Returns:
+            Diccionario con action_stats, status_stats, user_stats y date_stats;
+            sin rango, date_stats cubre los últimos 30 días
+        """
+        def in_range(query, start, end):
+            if start is not None:
+                query = query.filter(cls.day >= start)
+            if end is not None:
+                query = query.filter(cls.day <= end)
+            return query
+        
+        total = func.sum(cls.count)
+        
+        action_stats = in_range(
+            session.query(cls.action, total).group_by(cls.action), start_date, end_date
+        ).all()
+        
+        status_stats = in_range(
+            session.query(cls.status, total).group_by(cls.status), start_date, end_date
+        ).all()
         
-        return query.all(), total
+        user_stats = in_range(
+            session.query(cls.user_email, total).filter(cls.user_email != ''),
+            start_date, end_date
+        ).group_by(cls.user_email).order_by(total.desc()).limit(top_users).all()
+        
+        if start_date is None and end_date is None:
+            date_start = datetime.utcnow().date() - timedelta(days=30)
+        else:
+            date_start = start_date
+        date_stats = in_range(
+            session.query(cls.day, total).group_by(cls.day).order_by(cls.day),
+            date_start, end_date
+        ).all()
+        
+        return {
+            'action_stats': {action: int(count) for action, count in action_stats},
+            'status_stats': {status: int(count) for status, count in status_stats},
+            'user_stats': {email: int(count) for email, count in user_stats},
+            'date_stats': {day.isoformat(): int(count) for day, count in date_stats}
+        }
+
+
+class AuditCheckpoint(Base):
+    """
+    Checkpoint de integridad de un lote de registros de auditoría.
+    
+    Guarda la raíz del árbol de Merkle de las filas del lote y un hash
+    encadenado con el checkpoint anterior, de modo que modificar o eliminar
+    filas (o checkpoints completos) rompe la cadena. Ver utils/audit_integrity.py.
+    """
+    __tablename__ = 'audit_checkpoints'
+    
+    seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    merkle_root = Column(String(64), nullable=False)
+    prev_hash = Column(String(64), nullable=False)
+    chain_hash = Column(String(64), nullable=False)
+    row_count = Column(Integer, nullable=False)
+    first_created_at = Column(DateTime, nullable=False)
+    last_created_at = Column(DateTime, nullable=False)
+    signature = Column(Text, nullable=True)  # firma en base64 de chain_hash
+    created_at = Column(DateTime, default=datetime.utcnow)
+    verified_at = Column(DateTime, nullable=True)
@@ -1,9 +1,62 @@
-from sqlalchemy import Column, String, Integer, Boolean, Text, DateTime
+from sqlalchemy import Column, String, BigInteger, Text, DateTime, UniqueConstraint, func, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Caché en proceso de las configuraciones ya convertidas a su tipo, por categoría.
+# Cada categoría guarda la versión de system_config_versions con la que se
+# cargó; las escrituras de este proceso la invalidan de inmediato y los cambios
+# hechos por otros procesos se detectan al revalidar las versiones cada
+# CONFIG_CACHE_REVALIDATE_SECONDS.
+CONFIG_CACHE_REVALIDATE_SECONDS = float(os.environ.get('CONFIG_CACHE_REVALIDATE_SECONDS') or 5)
+
+_cache_lock = threading.Lock()
+_config_cache = {
+    "categories": {},  # categoría -> {"version": int, "values": {clave: valor}}
+    "checked_at": 0.0,
+    "generation": 0
+}
+
+# Secuencia global de versiones: cada transacción de escritura toma un valor
+# que se asigna a las filas modificadas, a sus tombstones y a sus categorías
+CONFIG_VERSION_SEQUENCE = 'system_config_version_seq'
+# Serializa las escrituras para que las versiones se confirmen en orden
+CONFIG_WRITE_LOCK_KEY = 0x43464756  # 'CFGV'
+
+
+class SystemConfigVersion(Base):
+    """
+    Versión de cada categoría de configuración: la versión global de su última escritura.
+    """
+    __tablename__ = 'system_config_versions'
+    
+    category = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SystemConfigDeletion(Base):
+    """
+    Tombstone de una configuración eliminada, para el feed de cambios.
+    """
+    __tablename__ = 'system_config_deletions'
+    
+    category = Column(String(50), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    version = Column(BigInteger, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+
 class SystemConfig(Base):
     """
     Modelo para almacenar la configuración del sistema.
@@ -12,6 +65,10 @@ class SystemConfig(Base):
     agrupadas por categorías para facilitar su gestión.
     """
     __tablename__ = 'system_config'
+    __table_args__ = (
+        # Una sola fila por clave; permite las escrituras con INSERT ... ON CONFLICT
+        UniqueConstraint('category', 'key', name='uq_system_config_category_key'),
+    )
     
     id = Column(String(36), primary_key=True)
     category = Column(String(50), nullable=False, index=True)
@@ -19,6 +76,7 @@ class SystemConfig(Base):
     value = Column(Text, nullable=True)
     value_type = Column(String(20), nullable=False)  # string, integer, boolean, json
     description = Column(String(255), nullable=True)
+    version = Column(BigInteger, nullable=False, default=0, index=True)  # versión global de la última escritura
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -27,6 +85,9 @@ class SystemConfig(Base):
         """
         Obtiene el valor de una configuración específica.
         
+        El valor se lee de la caché en proceso; la categoría completa se carga
+        con una sola consulta la primera vez o cuando cambia su versión.
+        
         Args:
             session: Sesión de SQLAlchemy
             category: Categoría de la configuración
@@ -36,24 +97,45 @@ class SystemConfig(Base):
         Returns:
             El valor de la configuración convertido al tipo adecuado
         """
-        config = session.query(cls).filter_by(category=category, key=key).first()
+        value = cls._cached_category(session, category)["values"].get(key)
         
-        if not config:
+        if value is None:
             return default
+        return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+    
+    @staticmethod
+    def decode_value(value, value_type):
+        """
+        Convierte el valor almacenado como texto al tipo indicado (None si no es válido).
+        """
+        if value is None:
+            return None
         
-        # Convertir el valor al tipo adecuado
-        if config.value_type == 'integer':
-            return int(config.value) if config.value is not None else default
-        elif config.value_type == 'boolean':
-            return config.value.lower() == 'true' if config.value is not None else default
-        elif config.value_type == 'json':
-            import json
-            try:
-                return json.loads(config.value) if config.value is not None else default
-            except:
-                return default
-        else:
-            return config.value if config.value is not None else default
+        try:
+            if value_type == 'integer':
+                return int(value)
+            elif value_type == 'boolean':
+                return value.lower() == 'true'
+            elif value_type == 'json':
+                return json.loads(value)
+        except (TypeError, ValueError):
+            logger.warning(f"Valor de configuración inválido para el tipo {value_type}: {value!r}")
+            return None
+        
+        return value
+    
+    @staticmethod
+    def encode_value(value, value_type):
+        """
+        Convierte un valor al formato de cadena usado para almacenarlo.
+        """
+        if value is None:
+            return None
+        if value_type == 'json':
+            return json.dumps(value)
+        if value_type == 'boolean':
+            return str(value).lower()
+        return str(value)
     
     @classmethod
     def set_value(cls, session, category, key, value, value_type='string', description=None):
@@ -74,13 +156,9 @@ class SystemConfig(Base):
         import uuid
         
         # Convertir el valor al formato de cadena para almacenamiento
-        if value_type == 'json':
-            import json
-            value_str = json.dumps(value) if value is not None else None
-        elif value_type == 'boolean':
-            value_str = str(value).lower() if value is not None else None
-        else:
-            value_str = str(value) if value is not None else None
+        value_str = cls.encode_value(value, value_type)
+        
+        version = cls._next_version(session)
         
         # Buscar configuración existente
         config = session.query(cls).filter_by(category=category, key=key).first()
@@ -91,6 +169,7 @@ class SystemConfig(Base):
             config.value_type = value_type
             if description:
                 config.description = description
+            config.version = version
             config.updated_at = datetime.utcnow()
         else:
             # Crear nueva configuración
@@ -100,13 +179,123 @@ class SystemConfig(Base):
                 key=key,
                 value=value_str,
                 value_type=value_type,
-                description=description
+                description=description,
+                version=version
             )
             session.add(config)
         
+        cls._bump_versions(session, [category], version)
         session.commit()
+        invalidate_config_cache(category)
         return config
     
+    @classmethod
+    def set_many(cls, session, category, items):
+        """
+        Establece varias configuraciones de una categoría en una sola escritura.
+        
+        Args:
+            session: Sesión de SQLAlchemy
+            category: Categoría de las configuraciones
+            items: Diccionario {clave: {'value', 'value_type', 'description'}}
+            
+        Returns:
+            Diccionario {clave: {'value': valor convertido, 'value_type': tipo}}
+        """
+        return cls.set_categories(session, {category: items})[category]
+    
+    @classmethod
+    def set_categories(cls, session, categories):
+        """
+        Establece configuraciones de varias categorías con un único
+        INSERT ... ON CONFLICT y un solo commit.
+        
+        Args:
+            session: Sesión de SQLAlchemy
+            categories: Diccionario {categoría: {clave: {'value', 'value_type', 'description'}}}
+            
+        Returns:
+            Diccionario {categoría: {clave: {'value': valor convertido, 'value_type': tipo}}}
+        """
+        import uuid
+        
+        if not any(categories.values()):
+            return {category: {} for category in categories}
+        
+        version = cls._next_version(session)
+        now = datetime.utcnow()
+        rows = []
+        results = {}
+        
+        for category, items in categories.items():
+            results[category] = {}
+            for key, item in items.items():
+                value_type = item.get('value_type', 'string')
+                value_str = cls.encode_value(item.get('value'), value_type)
+                rows.append({
+                    'id': str(uuid.uuid4()),
+                    'category': category,
+                    'key': key,
+                    'value': value_str,
+                    'value_type': value_type,
+                    'description': item.get('description'),
+                    'version': version,
+                    'created_at': now,
+                    'updated_at': now
+                })
+                # El valor devuelto es el mismo que se leería de la base de datos
+                results[category][key] = {
+                    'value': cls.decode_value(value_str, value_type),
+                    'value_type': value_type
+                }
+        
+        table = cls.__table__
+        statement = insert(table).values(rows)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['category', 'key'],
+            set_={
+                'value': statement.excluded.value,
+                'value_type': statement.excluded.value_type,
+                # Igual que set_value: la descripción solo se reemplaza si se indica
+                'description': func.coalesce(statement.excluded.description, table.c.description),
+                'version': statement.excluded.version,
+                'updated_at': statement.excluded.updated_at
+            }
+        ))
+        cls._bump_versions(session, [category for category, items in categories.items() if items], version)
+        session.commit()
+        
+        for category in categories:
+            invalidate_config_cache(category)
+        return results
+    
+    @classmethod
+    def delete_value(cls, session, category, key):
+        """
+        Elimina una configuración.
+        
+        Returns:
+            True si la configuración existía y se eliminó
+        """
+        version = cls._next_version(session)
+        deleted = session.query(cls).filter_by(category=category, key=key).delete(synchronize_session=False)
+        if not deleted:
+            session.rollback()
+            return False
+        
+        # Tombstone para que el feed de cambios informe la eliminación
+        statement = insert(SystemConfigDeletion.__table__).values(
+            category=category, key=key, version=version, deleted_at=datetime.utcnow()
+        )
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['category', 'key'],
+            set_={'version': statement.excluded.version, 'deleted_at': statement.excluded.deleted_at}
+        ))
+        cls._bump_versions(session, [category], version)
+        session.commit()
+        invalidate_config_cache(category)
+        return True
+    
     @classmethod
     def get_category(cls, session, category):
         """
@@ -119,10 +308,194 @@ class SystemConfig(Base):
         Returns:
             Diccionario con las configuraciones de la categoría
         """
-        configs = session.query(cls).filter_by(category=category).all()
+        return copy.deepcopy(cls._cached_category(session, category)["values"])
+    
+    @classmethod
+    def get_category_snapshot(cls, session, category):
+        """
+        Obtiene la versión de una categoría junto con sus configuraciones.
+        
+        Returns:
+            Tupla (versión, diccionario con las configuraciones)
+        """
+        entry = cls._cached_category(session, category)
+        return entry["version"], copy.deepcopy(entry["values"])
+    
+    @staticmethod
+    def get_global_version(session):
+        """
+        Versión de la última escritura de configuración (0 si no hay ninguna).
+        """
+        return session.query(func.max(SystemConfigVersion.version)).scalar() or 0
+    
+    @classmethod
+    def get_changes(cls, session, since, limit=500):
+        """
+        Obtiene las configuraciones modificadas o eliminadas después de una versión.
+        
+        Una versión nunca se divide entre dos páginas: si los primeros ``limit``
+        cambios pertenecen todos a la misma versión (p. ej. /initialize), se
+        devuelven todos los de esa versión aunque superen el límite.
+        
+        Args:
+            session: Sesión de SQLAlchemy
+            since: Última versión conocida por el cliente
+            limit: Número máximo de cambios devueltos
+            
+        Returns:
+            Tupla (cambios ordenados por versión, hay más cambios)
+        """
+        updated = session.query(cls).filter(cls.version > since).order_by(cls.version).limit(limit + 1).all()
+        deleted = session.query(SystemConfigDeletion).filter(
+            SystemConfigDeletion.version > since
+        ).order_by(SystemConfigDeletion.version).limit(limit + 1).all()
+        changes = cls._changes(updated, deleted)
+        
+        has_more = len(changes) > limit
+        if has_more:
+            # No cortar a mitad de una versión: el cliente continúa desde la última completa
+            last_version = changes[limit]['version']
+            changes = [change for change in changes[:limit] if change['version'] < last_version]
+            if not changes:
+                changes = cls._changes(
+                    session.query(cls).filter(cls.version == last_version).all(),
+                    session.query(SystemConfigDeletion).filter(SystemConfigDeletion.version == last_version).all()
+                )
+        return changes, has_more
+    
+    @classmethod
+    def _changes(cls, updated, deleted):
+        changes = [
+            {
+                'category': config.category,
+                'key': config.key,
+                'value': cls.decode_value(config.value, config.value_type),
+                'value_type': config.value_type,
+                'version': config.version,
+                'deleted': False
+            }
+            for config in updated
+        ] + [
+            {
+                'category': deletion.category,
+                'key': deletion.key,
+                'version': deletion.version,
+                'deleted': True
+            }
+            for deletion in deleted
+        ]
+        changes.sort(key=lambda change: change['version'])
+        return changes
+    
+    @classmethod
+    def warm_cache(cls, session):
+        """
+        Carga todas las categorías en la caché (al iniciar la aplicación).
+        """
+        versions = dict(session.query(SystemConfigVersion.category, SystemConfigVersion.version).all())
+        
+        with _cache_lock:
+            generation = _config_cache["generation"]
+        
+        loaded = {}
+        for config in session.query(cls).all():
+            entry = loaded.setdefault(config.category, {"version": versions.get(config.category, 0), "values": {}})
+            entry["values"][config.key] = cls.decode_value(config.value, config.value_type)
         
-        result = {}
-        for config in configs:
-            result[config.key] = cls.get_value(session, category, config.key)
+        with _cache_lock:
+            if _config_cache["generation"] == generation:
+                _config_cache["categories"] = loaded
+                _config_cache["checked_at"] = time.monotonic()
         
-        return result
+        return len(loaded)
+    
+    @classmethod
+    def _cached_category(cls, session, category):
+        """
+        Entrada de la caché de una categoría: {"version", "values"} (no modificar).
+        """
+        _revalidate_config_cache(session)
+        
+        with _cache_lock:
+            entry = _config_cache["categories"].get(category)
+            generation = _config_cache["generation"]
+        if entry is not None:
+            return entry
+        
+        # Leer la versión antes que las filas: si cambian entre ambas lecturas,
+        # la siguiente revalidación detecta la versión nueva y recarga
+        version = session.query(SystemConfigVersion.version).filter_by(category=category).scalar() or 0
+        values = {
+            config.key: cls.decode_value(config.value, config.value_type)
+            for config in session.query(cls).filter_by(category=category).all()
+        }
+        
+        entry = {"version": version, "values": values}
+        with _cache_lock:
+            if _config_cache["generation"] == generation:
+                _config_cache["categories"][category] = entry
+        return entry
+    
+    @staticmethod
+    def _next_version(session):
+        """
+        Toma la versión de la transacción de escritura actual.
+        
+        El bloqueo asesor se mantiene hasta el commit, de modo que las versiones
+        se hacen visibles en orden y el feed de cambios no omite ninguna.
+        """
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': CONFIG_WRITE_LOCK_KEY})
+        return session.execute(text(f"SELECT nextval('{CONFIG_VERSION_SEQUENCE}')")).scalar()
+    
+    @staticmethod
+    def _bump_versions(session, categories, version):
+        """
+        Asigna la versión de la escritura a las categorías modificadas (en la transacción actual).
+        """
+        statement = insert(SystemConfigVersion.__table__).values([
+            {'category': category, 'version': version, 'updated_at': datetime.utcnow()}
+            for category in set(categories)
+        ])
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['category'],
+            set_={
+                'version': statement.excluded.version,
+                'updated_at': statement.excluded.updated_at
+            }
+        ))
+
+
+def invalidate_config_cache(category=None):
+    """
+    Descarta de la caché una categoría (o todas).
+    """
+    with _cache_lock:
+        if category is None:
+            _config_cache["categories"] = {}
+        else:
+            _config_cache["categories"].pop(category, None)
+        _config_cache["generation"] += 1
+
+
+def _revalidate_config_cache(session):
+    """
+    Descarta las categorías cuya versión cambió en otro proceso. Se consulta
+    como máximo una vez cada CONFIG_CACHE_REVALIDATE_SECONDS.
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        if now - _config_cache["checked_at"] < CONFIG_CACHE_REVALIDATE_SECONDS:
+            return
+        _config_cache["checked_at"] = now
+    
+    versions = dict(session.query(SystemConfigVersion.category, SystemConfigVersion.version).all())
+    
+    with _cache_lock:
+        stale = [
+            category for category, entry in _config_cache["categories"].items()
+            if versions.get(category, 0) != entry["version"]
+        ]
+        for category in stale:
+            del _config_cache["categories"][category]
+        if stale:
+            _config_cache["generation"] += 1
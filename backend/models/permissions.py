@@ -1,12 +1,42 @@
 import psycopg2
+from psycopg2.extras import execute_values
 from config import DATABASE_URL
 import logging
+import select
+import threading
+import time
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import String, cast, func, literal, union_all
+from sqlalchemy import select as sa_select
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Caché en proceso de los códigos de permiso por rol. Se invalida cuando cambia
+# la versión global de permisos (tabla permission_version), ya sea al detectarlo
+# en la revalidación periódica o al recibir un NOTIFY en PERMISSIONS_CHANNEL.
+PERMISSION_CACHE_REVALIDATE_SECONDS = 30
+PERMISSIONS_CHANNEL = 'permissions_changed'
+# Prefijo de las notificaciones del canal que invalidan las credenciales de un
+# usuario (utils.auth_cache) en lugar de la caché de permisos
+USER_CHANGED_PREFIX = 'user:'
+
+# Las máscaras se guardan en BIGINT con signo: 1 << 63 ya no cabe
+MAX_PERMISSION_BIT = 62
+
+_cache_lock = threading.Lock()
+_permission_cache = {
+    "version": None,
+    "roles": {},   # rol -> frozenset de códigos
+    "masks": {},   # rol -> máscara de bits (int)
+    "bits": {},    # código -> índice de bit
+    "checked_at": 0.0,
+    "generation": 0
+}
+_listener_thread = None
+
 # Este modelo se inicializará con la instancia de db en app.py
 db = None
 
@@ -28,6 +58,9 @@ class RolePermission(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     permission = db.relationship('Permission', backref=db.backref('role_permissions', lazy=True))
+    
+    # Requerida por el ON CONFLICT (role, permission_id) de initialize_default_permissions
+    __table_args__ = (db.UniqueConstraint('role', 'permission_id'),)
 
 # Definición de permisos predeterminados
 DEFAULT_PERMISSIONS = [
@@ -102,9 +135,14 @@ def initialize_permissions():
             id SERIAL PRIMARY KEY,
             name VARCHAR(100) NOT NULL,
             description TEXT,
-            code VARCHAR(50) UNIQUE NOT NULL
+            code VARCHAR(50) UNIQUE NOT NULL,
+            bit_index SMALLINT UNIQUE CHECK (bit_index BETWEEN 0 AND 62)
         )
         """)
+        cursor.execute("""
+        ALTER TABLE permissions
+        ADD COLUMN IF NOT EXISTS bit_index SMALLINT UNIQUE CHECK (bit_index BETWEEN 0 AND 62)
+        """)
         
         # Crear tabla de permisos por rol si no existe
         cursor.execute("""
@@ -116,29 +154,52 @@ def initialize_permissions():
         )
         """)
         
-        # Insertar permisos predeterminados si no existen
-        for permission in DEFAULT_PERMISSIONS:
-            cursor.execute("""
-            INSERT INTO permissions (name, description, code)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (code) DO NOTHING
-            """, (permission["name"], permission["description"], permission["code"]))
+        # Crear tabla con la máscara de bits precalculada de cada rol
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS role_permission_masks (
+            role VARCHAR(50) PRIMARY KEY,
+            mask BIGINT NOT NULL DEFAULT 0
+        )
+        """)
+        
+        # Crear tabla con la versión global de permisos (una sola fila)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS permission_version (
+            id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            version BIGINT NOT NULL
+        )
+        """)
+        
+        # Insertar permisos predeterminados si no existen; el bit lo asigna la base de datos
+        execute_values(cursor, """
+        INSERT INTO permissions (name, description, code)
+        VALUES %s
+        ON CONFLICT (code) DO NOTHING
+        """, [
+            (permission["name"], permission["description"], permission["code"])
+            for permission in DEFAULT_PERMISSIONS
+        ], page_size=len(DEFAULT_PERMISSIONS))
         
-        # Obtener todos los permisos para mapear códigos a IDs
-        cursor.execute("SELECT id, code FROM permissions")
-        permission_map = {code: id for id, code in cursor.fetchall()}
+        _assign_missing_bit_indexes(cursor)
         
-        # Insertar permisos por rol predeterminados
-        for role, permission_codes in DEFAULT_ROLE_PERMISSIONS.items():
-            for code in permission_codes:
-                if code in permission_map:
-                    cursor.execute("""
-                    INSERT INTO role_permissions (role, permission_id)
-                    VALUES (%s, %s)
-                    ON CONFLICT (role, permission_id) DO NOTHING
-                    """, (role, permission_map[code]))
+        # Insertar permisos por rol predeterminados resolviendo los códigos en la misma sentencia
+        role_codes = [
+            (role, code)
+            for role, permission_codes in DEFAULT_ROLE_PERMISSIONS.items()
+            for code in permission_codes
+        ]
+        execute_values(cursor, """
+        INSERT INTO role_permissions (role, permission_id)
+        SELECT v.role, p.id
+        FROM (VALUES %s) AS v(role, code)
+        JOIN permissions p ON p.code = v.code
+        ON CONFLICT (role, permission_id) DO NOTHING
+        """, role_codes, page_size=len(role_codes))
         
+        _refresh_role_masks(cursor)
+        _bump_permission_version(cursor)
         conn.commit()
+        invalidate_permission_cache()
         logger.info("Permisos inicializados correctamente")
     except Exception as e:
         logger.error(f"Error al inicializar permisos: {e}")
@@ -158,10 +219,10 @@ def get_all_permissions():
         conn = psycopg2.connect(DATABASE_URL)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT id, name, description, code FROM permissions")
+        cursor.execute("SELECT id, name, description, code, bit_index FROM permissions")
         permissions = [
-            {"id": str(id), "name": name, "description": desc, "code": code}
-            for id, name, desc, code in cursor.fetchall()
+            {"id": str(id), "name": name, "description": desc, "code": code, "bit_index": bit_index}
+            for id, name, desc, code, bit_index in cursor.fetchall()
         ]
         
         return permissions
@@ -251,17 +312,35 @@ def update_role_permissions(role, permission_ids):
         conn = psycopg2.connect(DATABASE_URL)
         cursor = conn.cursor()
         
-        # Eliminar permisos actuales del rol
-        cursor.execute("DELETE FROM role_permissions WHERE role = %s", (role,))
-        
-        # Insertar nuevos permisos
-        for permission_id in permission_ids:
-            cursor.execute("""
+        # Aplicar solo la diferencia con la asignación actual en una única sentencia
+        cursor.execute("""
+        WITH desired AS (
+            SELECT DISTINCT unnest(%s::INTEGER[]) AS permission_id
+        ),
+        removed AS (
+            DELETE FROM role_permissions rp
+            WHERE rp.role = %s
+            AND rp.permission_id NOT IN (SELECT permission_id FROM desired)
+            RETURNING 1
+        ),
+        added AS (
             INSERT INTO role_permissions (role, permission_id)
-            VALUES (%s, %s)
-            """, (role, permission_id))
+            SELECT %s, permission_id FROM desired
+            ON CONFLICT (role, permission_id) DO NOTHING
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM removed), (SELECT COUNT(*) FROM added)
+        """, (list(permission_ids), role, role))
         
+        removed, added = cursor.fetchone()
+        if not removed and not added:
+            conn.rollback()
+            return True
+        
+        _refresh_role_masks(cursor, [role])
+        _bump_permission_version(cursor)
         conn.commit()
+        invalidate_permission_cache()
         return True
     except Exception as e:
         logger.error(f"Error al actualizar permisos para el rol {role}: {e}")
@@ -277,29 +356,312 @@ def update_role_permissions(role, permission_ids):
 def has_permission(user_role, permission_code):
     """
     Verifica si un rol tiene un permiso específico.
+    
+    La consulta se resuelve contra la caché en proceso; solo se accede a la base
+    de datos cuando la caché está vacía o su versión quedó obsoleta.
     """
+    try:
+        return permission_code in get_role_permission_codes(user_role)
+    except Exception as e:
+        logger.error(f"Error al verificar permiso {permission_code} para el rol {user_role}: {e}")
+        return False
+
+def get_role_permission_codes(role):
+    """
+    Obtiene el conjunto de códigos de permiso de un rol desde la caché en proceso.
+    """
+    return _get_permission_snapshot()["roles"].get(role, frozenset())
+
+def get_role_mask(role):
+    """
+    Obtiene la máscara de bits precalculada de un rol desde la caché en proceso.
+    """
+    return _get_permission_snapshot()["masks"].get(role, 0)
+
+def get_permission_bit(permission_code):
+    """
+    Devuelve el valor del bit (1 << bit_index) de un permiso, o 0 si no existe.
+    """
+    bit_index = _get_permission_snapshot()["bits"].get(permission_code)
+    return 1 << bit_index if bit_index is not None else 0
+
+def get_permission_version():
+    """
+    Devuelve la versión de permisos con la que se cargó la caché del proceso.
+    """
+    return _get_permission_snapshot()["version"]
+
+def permission_token_claims(role):
+    """
+    Claims de permisos a incluir en el JWT emitido al iniciar sesión.
+    
+    ``perm_version`` permite detectar máscaras obsoletas en tokens emitidos
+    antes de un cambio de permisos y ``perm_role`` las emitidas para un rol
+    que el usuario ya no tiene (cambiar el rol no cambia la versión).
+    """
+    snapshot = _get_permission_snapshot()
+    return {
+        "perm_mask": snapshot["masks"].get(role, 0),
+        "perm_role": role,
+        "perm_version": snapshot["version"]
+    }
+
+def decode_permission_mask(mask):
+    """
+    Convierte una máscara de bits en la lista de códigos de permiso que contiene.
+    """
+    bits = _get_permission_snapshot()["bits"]
+    return sorted(code for code, bit_index in bits.items() if mask & (1 << bit_index))
+
+def _get_permission_snapshot():
+    """
+    Devuelve el estado actual de la caché, recargándolo si está vacío u obsoleto.
+    """
+    now = time.monotonic()
+    
+    with _cache_lock:
+        version = _permission_cache["version"]
+        checked_at = _permission_cache["checked_at"]
+    
+    if version is None:
+        return _reload_permission_cache()
+    
+    if not _listener_active() and now - checked_at > PERMISSION_CACHE_REVALIDATE_SECONDS:
+        # Revalidación barata: solo se lee el número de versión
+        try:
+            current_version = _fetch_permission_version()
+        except Exception as e:
+            # Si la base de datos no responde se sigue usando la caché existente
+            logger.warning(f"No se pudo revalidar la caché de permisos: {e}")
+            current_version = version
+        
+        if current_version != version:
+            return _reload_permission_cache()
+        
+        with _cache_lock:
+            _permission_cache["checked_at"] = now
+    
+    with _cache_lock:
+        return dict(_permission_cache)
+
+def invalidate_permission_cache():
+    """
+    Descarta la caché de permisos del proceso; se recarga en la siguiente consulta.
+    """
+    with _cache_lock:
+        _permission_cache["version"] = None
+        _permission_cache["roles"] = {}
+        _permission_cache["masks"] = {}
+        _permission_cache["bits"] = {}
+        _permission_cache["checked_at"] = 0.0
+        _permission_cache["generation"] += 1
+
+def start_permission_listener():
+    """
+    Inicia un hilo que escucha PERMISSIONS_CHANNEL e invalida la caché al recibir
+    una notificación. Mientras el hilo está activo no hace falta revalidar la
+    versión periódicamente. Las notificaciones con USER_CHANGED_PREFIX
+    invalidan en cambio las credenciales en caché de ese usuario.
+    """
+    global _listener_thread
+    
+    with _cache_lock:
+        if _listener_thread and _listener_thread.is_alive():
+            return _listener_thread
+        
+        _listener_thread = threading.Thread(
+            target=_listen_for_permission_changes,
+            name='permission-cache-listener',
+            daemon=True
+        )
+        _listener_thread.connected = False
+        _listener_thread.start()
+        return _listener_thread
+
+def _listener_active():
+    thread = _listener_thread
+    return bool(thread and thread.is_alive() and thread.connected)
+
+def _listen_for_permission_changes():
+    thread = threading.current_thread()
+    
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {PERMISSIONS_CHANNEL}")
+            
+            # Cualquier cambio ocurrido antes del LISTEN debe descartarse
+            invalidate_permission_cache()
+            thread.connected = True
+            
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                notifies, conn.notifies[:] = list(conn.notifies), []
+                
+                permissions_changed = False
+                for notify in notifies:
+                    if notify.payload.startswith(USER_CHANGED_PREFIX):
+                        from utils.auth_cache import invalidate_user
+                        invalidate_user(notify.payload[len(USER_CHANGED_PREFIX):])
+                    else:
+                        permissions_changed = True
+                if permissions_changed:
+                    invalidate_permission_cache()
+        except Exception as e:
+            thread.connected = False
+            logger.warning(f"Escucha de cambios de permisos interrumpida: {e}")
+            time.sleep(5)
+        finally:
+            if conn:
+                conn.close()
+
+def _fetch_permission_version():
+    conn = None
+    cursor = None
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM permission_version WHERE id = 1")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def _reload_permission_cache():
+    """
+    Carga los permisos, máscaras e índices de bit y la versión actual en una sola
+    conexión. Devuelve el estado cargado aunque no llegue a guardarse en la caché.
+    """
+    with _cache_lock:
+        generation = _permission_cache["generation"]
+    
+    conn = None
+    cursor = None
     try:
         conn = psycopg2.connect(DATABASE_URL)
         cursor = conn.cursor()
         
+        cursor.execute("SELECT version FROM permission_version WHERE id = 1")
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+        
         cursor.execute("""
-        SELECT COUNT(*)
+        SELECT rp.role, p.code
         FROM role_permissions rp
         JOIN permissions p ON rp.permission_id = p.id
-        WHERE rp.role = %s AND p.code = %s
-        """, (user_role, permission_code))
+        """)
         
-        count = cursor.fetchone()[0]
-        return count > 0
-    except Exception as e:
-        logger.error(f"Error al verificar permiso {permission_code} para el rol {user_role}: {e}")
-        return False
+        roles = {}
+        for role, code in cursor.fetchall():
+            roles.setdefault(role, set()).add(code)
+        
+        cursor.execute("SELECT role, mask FROM role_permission_masks")
+        masks = dict(cursor.fetchall())
+        
+        cursor.execute("SELECT code, bit_index FROM permissions WHERE bit_index IS NOT NULL")
+        bits = dict(cursor.fetchall())
+        
+        snapshot = {
+            "version": version,
+            "roles": {role: frozenset(codes) for role, codes in roles.items()},
+            "masks": masks,
+            "bits": bits,
+            "checked_at": time.monotonic()
+        }
+        
+        with _cache_lock:
+            # Si se invalidó durante la carga, los datos leídos podrían ser anteriores
+            if _permission_cache["generation"] == generation:
+                _permission_cache.update(snapshot)
+        
+        return snapshot
     finally:
         if cursor:
             cursor.close()
         if conn:
             conn.close()
 
+def _assign_missing_bit_indexes(cursor):
+    """
+    Asigna a los permisos que no lo tienen un índice de bit estable: el menor
+    de los que ninguna otra fila usa, entre 0 y MAX_PERMISSION_BIT.
+    
+    Raises:
+        ValueError: si no quedan índices libres para todos los permisos
+    """
+    cursor.execute("""
+    UPDATE permissions p
+    SET bit_index = free.bit_index
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS position
+        FROM permissions
+        WHERE bit_index IS NULL
+    ) missing
+    JOIN (
+        SELECT candidate AS bit_index, ROW_NUMBER() OVER (ORDER BY candidate) AS position
+        FROM generate_series(0, %s) AS candidate
+        WHERE NOT EXISTS (SELECT 1 FROM permissions WHERE bit_index = candidate)
+    ) free ON free.position = missing.position
+    WHERE p.id = missing.id
+    """, (MAX_PERMISSION_BIT,))
+    
+    cursor.execute("SELECT code FROM permissions WHERE bit_index IS NULL ORDER BY id")
+    unassigned = [code for code, in cursor.fetchall()]
+    if unassigned:
+        raise ValueError(
+            f"No quedan índices de bit libres (máximo {MAX_PERMISSION_BIT + 1} permisos): "
+            f"{', '.join(unassigned)}"
+        )
+
+def _refresh_role_masks(cursor, roles=None):
+    """
+    Recalcula en una sola sentencia la máscara de bits almacenada de los roles
+    indicados (o de todos los que tienen permisos o máscara).
+    """
+    if roles is None:
+        roles_sql = """
+            SELECT role FROM role_permissions
+            UNION
+            SELECT role FROM role_permission_masks
+        """
+        params = ()
+    else:
+        roles_sql = "SELECT unnest(%s::VARCHAR[]) AS role"
+        params = (list(roles),)
+    
+    cursor.execute(f"""
+    INSERT INTO role_permission_masks (role, mask)
+    SELECT r.role, COALESCE(bit_or(1::BIGINT << p.bit_index), 0)
+    FROM ({roles_sql}) r
+    LEFT JOIN role_permissions rp ON rp.role = r.role
+    LEFT JOIN permissions p ON rp.permission_id = p.id AND p.bit_index IS NOT NULL
+    GROUP BY r.role
+    ON CONFLICT (role) DO UPDATE SET mask = EXCLUDED.mask
+    """, params)
+
+def _bump_permission_version(cursor):
+    """
+    Incrementa la versión global de permisos y notifica a los demás procesos.
+    Debe ejecutarse dentro de la transacción que modifica los permisos.
+    """
+    cursor.execute("""
+    INSERT INTO permission_version (id, version)
+    VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = permission_version.version + 1
+    RETURNING version
+    """)
+    version = cursor.fetchone()[0]
+    cursor.execute("SELECT pg_notify(%s, %s)", (PERMISSIONS_CHANNEL, str(version)))
+    return version
+
 def initialize_default_permissions(db_session):
     """Inicializa los permisos predeterminados del sistema"""
     default_permissions = [
@@ -345,55 +707,60 @@ def initialize_default_permissions(db_session):
         }
     ]
     
-    # Crear permisos si no existen
-    for perm in default_permissions:
-        if not Permission.query.filter_by(code=perm['code']).first():
-            permission = Permission(
-                name=perm['name'],
-                description=perm['description'],
-                code=perm['code']
-            )
-            db_session.add(permission)
+    now = datetime.utcnow()
     
-    db_session.commit()
+    # Crear permisos si no existen (una sola sentencia)
+    db_session.execute(
+        insert(Permission.__table__)
+        .values([
+            {
+                'id': str(uuid.uuid4()),
+                'name': perm['name'],
+                'description': perm['description'],
+                'code': perm['code'],
+                'created_at': now
+            }
+            for perm in default_permissions
+        ])
+        .on_conflict_do_nothing(index_elements=['code'])
+    )
     
-    # Asignar permisos predeterminados a roles
-    # Admin: todos los permisos
-    admin_permissions = Permission.query.all()
-    for perm in admin_permissions:
-        if not RolePermission.query.filter_by(role='admin', permission_id=perm.id).first():
-            role_perm = RolePermission(role='admin', permission_id=perm.id)
-            db_session.add(role_perm)
+    # Asignar permisos predeterminados a roles (una sola sentencia INSERT ... SELECT)
+    permissions_table = Permission.__table__
+    new_id = cast(func.gen_random_uuid(), String(36))
     
-    # Sub-admin: todos excepto gestionar permisos
-    sub_admin_permissions = Permission.query.filter(Permission.code != 'manage_permissions').all()
-    for perm in sub_admin_permissions:
-        if not RolePermission.query.filter_by(role='sub_admin', permission_id=perm.id).first():
-            role_perm = RolePermission(role='sub_admin', permission_id=perm.id)
-            db_session.add(role_perm)
+    def role_select(role, condition=None):
+        query = sa_select(new_id, literal(role), permissions_table.c.id, literal(now))
+        return query.where(condition) if condition is not None else query
     
-    # Management: ver, subir, firmar documentos, ver reportes
-    management_permission_codes = ['view_documents', 'upload_documents', 'sign_documents', 'view_reports']
-    management_permissions = Permission.query.filter(Permission.code.in_(management_permission_codes)).all()
-    for perm in management_permissions:
-        if not RolePermission.query.filter_by(role='management', permission_id=perm.id).first():
-            role_perm = RolePermission(role='management', permission_id=perm.id)
-            db_session.add(role_perm)
+    role_assignments = union_all(
+        # Admin: todos los permisos
+        role_select('admin'),
+        # Sub-admin: todos excepto gestionar permisos
+        role_select('sub_admin', permissions_table.c.code != 'manage_permissions'),
+        # Management: ver, subir, firmar documentos, ver reportes
+        role_select('management', permissions_table.c.code.in_(DEFAULT_ROLE_PERMISSIONS['management'])),
+        # Employer: ver, subir, firmar documentos
+        role_select('employer', permissions_table.c.code.in_(DEFAULT_ROLE_PERMISSIONS['employer'])),
+        # Public: solo ver documentos
+        role_select('public', permissions_table.c.code.in_(DEFAULT_ROLE_PERMISSIONS['public']))
+    )
     
-    # Employer: ver, subir, firmar documentos
-    employer_permission_codes = ['view_documents', 'upload_documents', 'sign_documents']
-    employer_permissions = Permission.query.filter(Permission.code.in_(employer_permission_codes)).all()
-    for perm in employer_permissions:
-        if not RolePermission.query.filter_by(role='employer', permission_id=perm.id).first():
-            role_perm = RolePermission(role='employer', permission_id=perm.id)
-            db_session.add(role_perm)
+    db_session.execute(
+        insert(RolePermission.__table__)
+        .from_select(['id', 'role', 'permission_id', 'created_at'], role_assignments)
+        .on_conflict_do_nothing(index_elements=['role', 'permission_id'])
+    )
     
-    # Public: solo ver documentos
-    public_permission_codes = ['view_documents']
-    public_permissions = Permission.query.filter(Permission.code.in_(public_permission_codes)).all()
-    for perm in public_permissions:
-        if not RolePermission.query.filter_by(role='public', permission_id=perm.id).first():
-            role_perm = RolePermission(role='public', permission_id=perm.id)
-            db_session.add(role_perm)
+    # Mismos invariantes que update_role_permissions, en la misma transacción:
+    # índices de bit, máscaras por rol y versión global (con NOTIFY)
+    cursor = db_session.connection().connection.cursor()
+    try:
+        _assign_missing_bit_indexes(cursor)
+        _refresh_role_masks(cursor)
+        _bump_permission_version(cursor)
+    finally:
+        cursor.close()
     
     db_session.commit()
+    invalidate_permission_cache()
@@ -1,17 +1,34 @@
 import logging
+import random
+import time
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
-from psycopg2 import sql
+from psycopg2 import errors, sql
 from psycopg2.extras import RealDictCursor
 
 from backend.db import get_db_connection
 
 logger = logging.getLogger(__name__)
 
+# Reintentos ante conflictos de concurrencia al registrar firmas
+SIGNATURE_MAX_RETRIES = 3
+SIGNATURE_RETRY_BACKOFF = 0.05  # segundos, crece linealmente con el intento
+SIGNATURE_LOCK_TIMEOUT = '5s'
+
+RETRYABLE_LOCK_ERRORS = (
+    errors.DeadlockDetected,
+    errors.LockNotAvailable,
+    errors.SerializationFailure,
+)
+
 class SignatureFlow:
     """Gestiona los flujos de firma para documentos que requieren múltiples aprobaciones."""
     
+    # Límites superiores (en horas) de los buckets del histograma de espera por etapa;
+    # el último bucket agrupa todo lo que supera el último límite
+    WAIT_BUCKET_HOURS = [1, 4, 24, 72, 168]
+    
     @staticmethod
     def create_flow(document_id: str, required_signatures: List[Dict[str, Any]]) -> bool:
         """
@@ -25,10 +42,22 @@ class SignatureFlow:
                     {"role": "coordinador", "count": 1, "order": 2},
                     ...
                 ]
+                Las etapas que comparten ``order`` se firman en paralelo. Cada
+                etapa puede indicar ``"depends_on": ["rol", ...]`` para definir
+                sus prerrequisitos explícitamente; si se omite, depende de todas
+                las etapas del ``order`` inmediatamente anterior.
         
         Returns:
             True si se creó correctamente, False en caso contrario
+        
+        Raises:
+            ValueError: si la definición del flujo no es válida (etapa incompleta,
+                rol repetido, dependencia desconocida o ciclo)
         """
+        # Validar la definición antes de tocar la base de datos: es un error del cliente
+        prerequisites = SignatureFlow._resolve_prerequisites(required_signatures)
+        
+        conn = None
         try:
             conn = get_db_connection()
             cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -39,31 +68,93 @@ class SignatureFlow:
                 (document_id,)
             )
             
+            now = datetime.now()
+            
             # Insertar el nuevo flujo
             for req in required_signatures:
                 cursor.execute(
                     """
                     INSERT INTO signature_flows 
-                    (document_id, role, required_count, current_count, flow_order, created_at)
-                    VALUES (%s, %s, %s, 0, %s, %s)
+                    (document_id, role, required_count, current_count, flow_order,
+                     prerequisites, pending_prereqs, ready_at, created_at)
+                    VALUES (%s, %s, %s, 0, %s, %s, %s, %s, %s)
                     """,
                     (
                         document_id, 
                         req["role"], 
                         req["count"], 
                         req["order"],
-                        datetime.now()
+                        prerequisites[req["role"]],
+                        len(prerequisites[req["role"]]),
+                        now if not prerequisites[req["role"]] else None,
+                        now
                     )
                 )
             
             conn.commit()
             cursor.close()
-            conn.close()
             return True
             
         except Exception as e:
             logger.error(f"Error al crear flujo de firmas: {str(e)}")
+            if conn:
+                conn.rollback()
             return False
+        finally:
+            if conn:
+                conn.close()
+    
+    @staticmethod
+    def _resolve_prerequisites(required_signatures: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """
+        Calcula los roles prerrequisito de cada etapa y valida que formen un DAG.
+        
+        Raises:
+            ValueError: si falta un campo de una etapa, una dependencia no existe
+                en el flujo o hay un ciclo
+        """
+        for req in required_signatures:
+            missing = [field for field in ("role", "count", "order") if field not in req]
+            if missing:
+                raise ValueError(f"Cada etapa del flujo requiere: {', '.join(missing)}")
+        
+        roles = [req["role"] for req in required_signatures]
+        if len(set(roles)) != len(roles):
+            raise ValueError("Cada rol solo puede aparecer en una etapa del flujo")
+        
+        prerequisites = {}
+        for req in required_signatures:
+            if "depends_on" in req:
+                depends_on = list(req["depends_on"] or [])
+            else:
+                previous = [r["order"] for r in required_signatures if r["order"] < req["order"]]
+                depends_on = [
+                    r["role"] for r in required_signatures
+                    if previous and r["order"] == max(previous)
+                ]
+            
+            unknown = [role for role in depends_on if role not in roles]
+            if unknown:
+                raise ValueError(f"Dependencias desconocidas para {req['role']}: {', '.join(unknown)}")
+            prerequisites[req["role"]] = depends_on
+        
+        # Verificar que no haya ciclos (orden topológico de Kahn)
+        pending = {role: len(deps) for role, deps in prerequisites.items()}
+        ready = [role for role, count in pending.items() if count == 0]
+        visited = 0
+        while ready:
+            role = ready.pop()
+            visited += 1
+            for other, deps in prerequisites.items():
+                if role in deps:
+                    pending[other] -= 1
+                    if pending[other] == 0:
+                        ready.append(other)
+        
+        if visited != len(roles):
+            raise ValueError("Las dependencias del flujo de firmas contienen un ciclo")
+        
+        return prerequisites
     
     @staticmethod
     def get_document_flow(document_id: str) -> List[Dict[str, Any]]:
@@ -87,6 +178,7 @@ class SignatureFlow:
                            WHEN sf.current_count >= sf.required_count THEN true 
                            ELSE false 
                        END AS completed,
+                       (sf.pending_prereqs = 0 AND sf.current_count < sf.required_count) AS ready,
                        (SELECT json_agg(json_build_object(
                            'user_id', ss.user_id,
                            'user_name', u.name,
@@ -118,6 +210,11 @@ class SignatureFlow:
         """
         Registra una firma en el flujo y actualiza el estado.
         
+        Las etapas del documento se bloquean con ``SELECT ... FOR UPDATE`` durante
+        la transacción, de modo que firmantes concurrentes sobre el mismo documento
+        se serializan. Los conflictos transitorios (deadlock, timeout de bloqueo o
+        fallo de serialización) se reintentan hasta ``SIGNATURE_MAX_RETRIES`` veces.
+        
         Args:
             document_id: ID del documento
             user_id: ID del usuario que firma
@@ -126,145 +223,346 @@ class SignatureFlow:
         Returns:
             Diccionario con el resultado de la operación
         """
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Verificar si el usuario ya ha firmado este documento
-            cursor.execute(
-                """
-                SELECT * FROM signature_status 
-                WHERE document_id = %s AND user_id = %s
-                """,
-                (document_id, user_id)
-            )
-            
-            if cursor.fetchone():
+        for attempt in range(1, SIGNATURE_MAX_RETRIES + 1):
+            conn = None
+            cursor = None
+            try:
+                conn = get_db_connection()
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                
+                result = SignatureFlow._record_signature_locked(
+                    cursor, document_id, user_id, user_role
+                )
+                
+                if not result["success"]:
+                    conn.rollback()
+                    return result
+                
+                conn.commit()
+                break
+                
+            except errors.UniqueViolation:
+                if conn:
+                    conn.rollback()
                 return {
                     "success": False,
                     "message": "El usuario ya ha firmado este documento"
                 }
-            
-            # Verificar el estado actual del flujo
-            cursor.execute(
-                """
-                SELECT * FROM signature_flows
-                WHERE document_id = %s
-                ORDER BY flow_order
-                """,
-                (document_id,)
-            )
-            
-            flow_stages = cursor.fetchall()
-            if not flow_stages:
-                return {
-                    "success": False,
-                    "message": "No existe un flujo de firmas para este documento"
-                }
-            
-            # Determinar la etapa actual (la primera que no está completa)
-            current_stage = None
-            for stage in flow_stages:
-                if stage["current_count"] < stage["required_count"]:
-                    current_stage = stage
-                    break
-            
-            if not current_stage:
-                return {
-                    "success": False,
-                    "message": "El flujo de firmas ya está completo"
-                }
-            
-            # Verificar si el rol del usuario corresponde a la etapa actual
-            if current_stage["role"] != user_role:
+            except RETRYABLE_LOCK_ERRORS as e:
+                if conn:
+                    conn.rollback()
+                if attempt == SIGNATURE_MAX_RETRIES:
+                    logger.error(f"Conflicto persistente al registrar firma: {str(e)}")
+                    return {
+                        "success": False,
+                        "message": "El documento está siendo firmado por otros usuarios, intente de nuevo"
+                    }
+                logger.warning(
+                    f"Conflicto al registrar firma (intento {attempt}/{SIGNATURE_MAX_RETRIES}): {str(e)}"
+                )
+                time.sleep(SIGNATURE_RETRY_BACKOFF * attempt * (1 + random.random()))
+            except Exception as e:
+                if conn:
+                    conn.rollback()
+                logger.error(f"Error al registrar firma: {str(e)}")
                 return {
                     "success": False,
-                    "message": f"En este momento se requieren firmas del rol: {current_stage['role']}"
+                    "message": f"Error al registrar firma: {str(e)}"
                 }
-            
-            # Registrar la firma
-            cursor.execute(
-                """
-                INSERT INTO signature_status
-                (document_id, user_id, role, signed_at)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (document_id, user_id, user_role, datetime.now())
+            finally:
+                if cursor:
+                    cursor.close()
+                if conn:
+                    conn.close()
+        
+        # Obtener el flujo actualizado
+        result["updated_flow"] = SignatureFlow.get_document_flow(document_id)
+        return result
+    
+    @staticmethod
+    def _record_signature_locked(cursor, document_id: str, user_id: str, user_role: str) -> Dict[str, Any]:
+        """
+        Ejecuta el registro de la firma dentro de la transacción actual.
+        
+        Bloquea todas las etapas del documento antes de leer los contadores, por lo
+        que la decisión sobre la etapa actual y el incremento son atómicos. El
+        llamador es responsable de hacer commit o rollback.
+        """
+        # Limitar la espera por el bloqueo para que un firmante lento no retenga la petición
+        cursor.execute("SET LOCAL lock_timeout = %s", (SIGNATURE_LOCK_TIMEOUT,))
+        
+        # Bloquear las etapas del flujo (siempre en el mismo orden para evitar deadlocks)
+        cursor.execute(
+            """
+            SELECT * FROM signature_flows
+            WHERE document_id = %s
+            ORDER BY flow_order, id
+            FOR UPDATE
+            """,
+            (document_id,)
+        )
+        
+        flow_stages = cursor.fetchall()
+        if not flow_stages:
+            return {
+                "success": False,
+                "message": "No existe un flujo de firmas para este documento"
+            }
+        
+        # Verificar si el usuario ya ha firmado este documento (con el flujo ya bloqueado)
+        cursor.execute(
+            """
+            SELECT 1 FROM signature_status 
+            WHERE document_id = %s AND user_id = %s
+            """,
+            (document_id, user_id)
+        )
+        
+        if cursor.fetchone():
+            return {
+                "success": False,
+                "message": "El usuario ya ha firmado este documento"
+            }
+        
+        # Etapas firmables: sin prerrequisitos pendientes y con firmas faltantes
+        ready_stages = [
+            stage for stage in flow_stages
+            if stage["pending_prereqs"] == 0 and stage["current_count"] < stage["required_count"]
+        ]
+        
+        if not ready_stages:
+            return {
+                "success": False,
+                "message": "El flujo de firmas ya está completo"
+            }
+        
+        # Verificar si el rol del usuario corresponde a una etapa firmable
+        current_stage = next((stage for stage in ready_stages if stage["role"] == user_role), None)
+        if not current_stage:
+            ready_roles = ", ".join(stage["role"] for stage in ready_stages)
+            return {
+                "success": False,
+                "message": f"En este momento se requieren firmas del rol: {ready_roles}"
+            }
+        
+        signed_at = datetime.now()
+        
+        # Registrar la firma
+        cursor.execute(
+            """
+            INSERT INTO signature_status
+            (document_id, user_id, role, signed_at)
+            VALUES (%s, %s, %s, %s)
+            """,
+            (document_id, user_id, user_role, signed_at)
+        )
+        
+        # Actualizar el contador de firmas en la etapa actual
+        cursor.execute(
+            """
+            UPDATE signature_flows
+            SET current_count = current_count + 1,
+                completed_at = CASE
+                    WHEN current_count + 1 >= required_count THEN %s
+                    ELSE completed_at
+                END
+            WHERE id = %s
+            RETURNING current_count, required_count, flow_order, ready_at, created_at
+            """,
+            (signed_at, current_stage["id"])
+        )
+        
+        updated_stage = cursor.fetchone()
+        stage_completed = updated_stage["current_count"] >= updated_stage["required_count"]
+        
+        # Si se completó la etapa, descontarla de las etapas que dependen de ella;
+        # las que llegan a cero prerrequisitos pendientes quedan listas para firmar
+        unlocked_stages = []
+        if stage_completed:
+            SignatureFlow._record_stage_latency(
+                cursor,
+                document_id,
+                user_role,
+                updated_stage["flow_order"],
+                updated_stage["ready_at"] or updated_stage["created_at"],
+                signed_at
             )
             
-            # Actualizar el contador de firmas en la etapa actual
             cursor.execute(
                 """
                 UPDATE signature_flows
-                SET current_count = current_count + 1
-                WHERE document_id = %s AND role = %s
+                SET pending_prereqs = pending_prereqs - 1,
+                    ready_at = CASE WHEN pending_prereqs - 1 = 0 THEN %s ELSE ready_at END
+                WHERE document_id = %s AND %s = ANY(prerequisites)
+                RETURNING *
                 """,
-                (document_id, user_role)
+                (signed_at, document_id, user_role)
             )
-            
-            # Verificar si se completó la etapa actual
+            unlocked_stages = [
+                dict(stage) for stage in cursor.fetchall()
+                if stage["pending_prereqs"] == 0
+            ]
+        
+        # Verificar si se completó todo el flujo
+        flow_completed = stage_completed and all(
+            stage["current_count"] >= stage["required_count"]
+            for stage in flow_stages
+            if stage["id"] != current_stage["id"]
+        )
+        
+        # Si se completó todo el flujo, actualizar el estado del documento
+        if flow_completed:
             cursor.execute(
                 """
-                SELECT * FROM signature_flows
-                WHERE document_id = %s AND role = %s
+                UPDATE documents
+                SET status = 'signed', updated_at = %s
+                WHERE id = %s
                 """,
-                (document_id, user_role)
+                (datetime.now(), document_id)
             )
+        
+        return {
+            "success": True,
+            "message": "Firma registrada correctamente",
+            "stage_completed": stage_completed,
+            "flow_completed": flow_completed,
+            "next_stage": unlocked_stages[0] if unlocked_stages else None,
+            "unlocked_stages": unlocked_stages
+        }
+    
+    @staticmethod
+    def _wait_bucket(wait_seconds: float) -> int:
+        """Devuelve el índice del bucket del histograma para un tiempo de espera."""
+        hours = wait_seconds / 3600
+        for index, limit in enumerate(SignatureFlow.WAIT_BUCKET_HOURS):
+            if hours < limit:
+                return index
+        return len(SignatureFlow.WAIT_BUCKET_HOURS)
+    
+    @staticmethod
+    def _record_stage_latency(cursor, document_id: str, role: str, stage_order: int,
+                              waiting_since: datetime, completed_at: datetime) -> None:
+        """
+        Suma la espera de una etapa completada al agregado diario por área y rol.
+        
+        Se ejecuta dentro de la transacción de ``record_signature``, por lo que el
+        agregado se actualiza de forma atómica con la firma que completa la etapa.
+        """
+        wait_seconds = max((completed_at - waiting_since).total_seconds(), 0.0)
+        cursor.execute(
+            """
+            INSERT INTO signature_stage_latency_daily AS agg
+            (day, area, role, stage_order, bucket, stage_count, total_wait_seconds, max_wait_seconds)
+            VALUES (
+                %s,
+                COALESCE((SELECT area FROM documents WHERE id = %s), ''),
+                %s, %s, %s, 1, %s, %s
+            )
+            ON CONFLICT (day, area, role, stage_order, bucket) DO UPDATE
+            SET stage_count = agg.stage_count + 1,
+                total_wait_seconds = agg.total_wait_seconds + EXCLUDED.total_wait_seconds,
+                max_wait_seconds = GREATEST(agg.max_wait_seconds, EXCLUDED.max_wait_seconds)
+            """,
+            (
+                completed_at.date(),
+                document_id,
+                role,
+                stage_order,
+                SignatureFlow._wait_bucket(wait_seconds),
+                wait_seconds,
+                wait_seconds
+            )
+        )
+    
+    @staticmethod
+    def get_turnaround_stats(start_date: datetime, end_date: datetime,
+                             area: Optional[str] = None,
+                             role: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Obtiene los tiempos de espera por etapa a partir de los agregados diarios.
+        
+        Solo lee ``signature_stage_latency_daily``; nunca recorre las tablas de firmas.
+        
+        Args:
+            start_date: Fecha inicial (inclusive)
+            end_date: Fecha final (inclusive)
+            area: Filtrar por área del documento (opcional)
+            role: Filtrar por rol de la etapa (opcional)
             
-            updated_stage = cursor.fetchone()
-            stage_completed = updated_stage["current_count"] >= updated_stage["required_count"]
-            
-            # Si se completó la etapa, verificar si hay siguientes etapas
-            next_stage = None
-            if stage_completed:
-                cursor.execute(
-                    """
-                    SELECT * FROM signature_flows
-                    WHERE document_id = %s AND flow_order > %s
-                    ORDER BY flow_order
-                    LIMIT 1
-                    """,
-                    (document_id, updated_stage["flow_order"])
-                )
-                next_stage = cursor.fetchone()
+        Returns:
+            Lista de agregados por área, rol y orden de etapa con su histograma
+        """
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
             
-            # Verificar si se completó todo el flujo
-            flow_completed = stage_completed and not next_stage
+            conditions = [sql.SQL("day BETWEEN %s AND %s")]
+            params = [start_date.date(), end_date.date()]
+            if area is not None:
+                conditions.append(sql.SQL("area = %s"))
+                params.append(area)
+            if role is not None:
+                conditions.append(sql.SQL("role = %s"))
+                params.append(role)
             
-            # Si se completó todo el flujo, actualizar el estado del documento
-            if flow_completed:
-                cursor.execute(
+            cursor.execute(
+                sql.SQL(
                     """
-                    UPDATE documents
-                    SET status = 'signed', updated_at = %s
-                    WHERE id = %s
-                    """,
-                    (datetime.now(), document_id)
-                )
-            
-            conn.commit()
-            
-            # Obtener el flujo actualizado
-            updated_flow = SignatureFlow.get_document_flow(document_id)
+                    SELECT area, role, stage_order, bucket,
+                           SUM(stage_count) AS stage_count,
+                           SUM(total_wait_seconds) AS total_wait_seconds,
+                           MAX(max_wait_seconds) AS max_wait_seconds
+                    FROM signature_stage_latency_daily
+                    WHERE {conditions}
+                    GROUP BY area, role, stage_order, bucket
+                    ORDER BY area, stage_order, role, bucket
+                    """
+                ).format(conditions=sql.SQL(" AND ").join(conditions)),
+                params
+            )
             
+            rows = cursor.fetchall()
             cursor.close()
             conn.close()
             
-            return {
-                "success": True,
-                "message": "Firma registrada correctamente",
-                "stage_completed": stage_completed,
-                "flow_completed": flow_completed,
-                "next_stage": dict(next_stage) if next_stage else None,
-                "updated_flow": updated_flow
-            }
+            labels = [f"<{limit}h" for limit in SignatureFlow.WAIT_BUCKET_HOURS]
+            labels.append(f">={SignatureFlow.WAIT_BUCKET_HOURS[-1]}h")
+            
+            # Agrupar los buckets de cada (área, rol, etapa)
+            stats = {}
+            for row in rows:
+                key = (row["area"], row["role"], row["stage_order"])
+                if key not in stats:
+                    stats[key] = {
+                        "area": row["area"],
+                        "role": row["role"],
+                        "stage_order": row["stage_order"],
+                        "completed_stages": 0,
+                        "total_wait_seconds": 0.0,
+                        "max_wait_hours": 0.0,
+                        "histogram": {label: 0 for label in labels}
+                    }
+                entry = stats[key]
+                entry["completed_stages"] += int(row["stage_count"])
+                entry["total_wait_seconds"] += float(row["total_wait_seconds"])
+                entry["max_wait_hours"] = max(entry["max_wait_hours"], float(row["max_wait_seconds"]) / 3600)
+                entry["histogram"][labels[row["bucket"]]] += int(row["stage_count"])
+            
+            result = []
+            for entry in stats.values():
+                total_wait = entry.pop("total_wait_seconds")
+                entry["avg_wait_hours"] = (
+                    round(total_wait / entry["completed_stages"] / 3600, 2)
+                    if entry["completed_stages"] else 0.0
+                )
+                entry["max_wait_hours"] = round(entry["max_wait_hours"], 2)
+                result.append(entry)
+            
+            return result
             
         except Exception as e:
-            logger.error(f"Error al registrar firma: {str(e)}")
-            return {
-                "success": False,
-                "message": f"Error al registrar firma: {str(e)}"
-            }
+            logger.error(f"Error al obtener estadísticas de flujos: {str(e)}")
+            return []
     
     @staticmethod
     def get_pending_signatures(user_id: str, user_role: str) -> List[Dict[str, Any]]:
@@ -291,27 +589,14 @@ class SignatureFlow:
                 JOIN signature_flows sf ON d.id = sf.document_id
                 JOIN users u ON d.created_by = u.id
                 WHERE sf.role = %s
+                -- La etapa está lista cuando todos sus prerrequisitos se completaron
+                AND sf.pending_prereqs = 0
                 AND sf.current_count < sf.required_count
                 AND d.status = 'pending'
                 AND NOT EXISTS (
                     SELECT 1 FROM signature_status ss
                     WHERE ss.document_id = d.id AND ss.user_id = %s
                 )
-                AND (
-                    -- Es la primera etapa del flujo
-                    sf.flow_order = (
-                        SELECT MIN(flow_order) FROM signature_flows
-                        WHERE document_id = d.id
-                    )
-                    OR
-                    -- O todas las etapas anteriores están completas
-                    NOT EXISTS (
-                        SELECT 1 FROM signature_flows sf2
-                        WHERE sf2.document_id = d.id
-                        AND sf2.flow_order < sf.flow_order
-                        AND sf2.current_count < sf2.required_count
-                    )
-                )
                 ORDER BY d.created_at DESC
                 """,
                 (user_role, user_id)
@@ -1,14 +1,19 @@
-from flask import Blueprint, request, jsonify
-from models.audit_log import AuditLog
+from flask import Blueprint, Response, request, jsonify, g, stream_with_context
+from models.audit_log import AuditLog, AuditStatsDaily
 from flask_sqlalchemy import SQLAlchemy
 from functools import wraps
-import jwt
-import os
+from utils.auth_cache import authenticate
+from utils.audit_export import ExportError, build_export
+from utils.audit_integrity import AuditIntegrity
 from datetime import datetime
+import json
 
 # Crear blueprint para rutas de auditoría
 audit_bp = Blueprint('audit', __name__, url_prefix='/api/audit')
 
+# Filas leídas por viaje al exportar
+EXPORT_CHUNK_SIZE = 2000
+
 # Referencia a la base de datos (se inicializará en la aplicación principal)
 db = None
 
@@ -30,9 +35,9 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
             
         try:
-            data = jwt.decode(token, os.environ.get('SECRET_KEY', 'casamonarca_secret_key'), algorithms=["HS256"])
-            from models.user import User
-            current_user = User.query.filter_by(id=data['user_id']).first()
+            # Token y usuario se resuelven desde la caché compartida de credenciales
+            data, current_user = authenticate(token)
+            g.token_payload = data
             
             # Verificar si el usuario tiene permisos para ver logs de auditoría
             if current_user.role not in ['admin', 'sub_admin']:
@@ -44,6 +49,63 @@ def token_required(f):
     
     return decorated
 
+# Función para construir los filtros de auditoría a partir de los parámetros de consulta
+def _parse_filters(args):
+    """
+    Construye el diccionario de filtros de AuditLog.get_logs a partir de los
+    parámetros de consulta (compartido por el listado y la exportación).
+    """
+    filters = {}
+    
+    if 'user_id' in args:
+        filters['user_id'] = args.get('user_id')
+    
+    if 'user_email' in args:
+        filters['user_email'] = args.get('user_email')
+    
+    if 'action' in args:
+        filters['action'] = args.get('action')
+    
+    if 'status' in args:
+        filters['status'] = args.get('status')
+    
+    if 'start_date' in args:
+        try:
+            start_date = datetime.strptime(args.get('start_date'), '%Y-%m-%d')
+            filters['start_date'] = start_date
+        except:
+            pass
+    
+    if 'end_date' in args:
+        try:
+            end_date = datetime.strptime(args.get('end_date'), '%Y-%m-%d')
+            # Ajustar al final del día
+            end_date = end_date.replace(hour=23, minute=59, second=59)
+            filters['end_date'] = end_date
+        except:
+            pass
+    
+    if 'ip_address' in args:
+        filters['ip_address'] = args.get('ip_address')
+    
+    if 'details' in args:
+        filters['details'] = args.get('details')
+    
+    # Filtros por campo de los detalles estructurados: details.document_id=123
+    details_fields = {}
+    for name, value in args.items():
+        if name.startswith('details.') and len(name) > len('details.'):
+            try:
+                # Permite filtrar por números y booleanos además de cadenas
+                details_fields[name[len('details.'):]] = json.loads(value)
+            except ValueError:
+                details_fields[name[len('details.'):]] = value
+    
+    if details_fields:
+        filters['details_fields'] = details_fields
+    
+    return filters
+
 # Ruta para obtener logs de auditoría
 @audit_bp.route('/', methods=['GET'])
 @token_required
@@ -56,6 +118,8 @@ def get_audit_logs(current_user):
         offset: Desplazamiento para paginación (default: 0)
         order_by: Campo por el cual ordenar (default: created_at)
         order: Dirección de ordenamiento (asc, desc) (default: desc)
+        cursor: Cursor de la página anterior (next_cursor); sustituye a offset
+        count: Cálculo del total (exact, estimated, none) (default: exact)
         user_id: Filtrar por ID de usuario
         user_email: Filtrar por correo de usuario
         action: Filtrar por tipo de acción
@@ -64,6 +128,8 @@ def get_audit_logs(current_user):
         end_date: Filtrar por fecha de fin (formato: YYYY-MM-DD)
         ip_address: Filtrar por dirección IP
         details: Filtrar por detalles
+        details.<campo>: Filtrar por un campo de los detalles estructurados
+            (p. ej. details.document_id=123; admite rutas anidadas con puntos)
         
     Returns:
         JSON con los logs de auditoría y metadatos de paginación
@@ -73,6 +139,8 @@ def get_audit_logs(current_user):
     offset = request.args.get('offset', 0, type=int)
     order_by = request.args.get('order_by', 'created_at')
     order = request.args.get('order', 'desc')
+    cursor = request.args.get('cursor')
+    count_mode = request.args.get('count', 'exact')
     
     # Validar parámetros
     if limit > 1000:
@@ -84,45 +152,23 @@ def get_audit_logs(current_user):
     if order not in ['asc', 'desc']:
         order = 'desc'  # Valor por defecto
     
-    # Construir filtros
-    filters = {}
-    
-    if 'user_id' in request.args:
-        filters['user_id'] = request.args.get('user_id')
-    
-    if 'user_email' in request.args:
-        filters['user_email'] = request.args.get('user_email')
-    
-    if 'action' in request.args:
-        filters['action'] = request.args.get('action')
+    if count_mode not in ['exact', 'estimated', 'none']:
+        count_mode = 'exact'  # Valor por defecto
     
-    if 'status' in request.args:
-        filters['status'] = request.args.get('status')
+    if cursor and order_by != 'created_at':
+        return jsonify({'message': 'cursor pagination requires order_by=created_at'}), 400
     
-    if 'start_date' in request.args:
-        try:
-            start_date = datetime.strptime(request.args.get('start_date'), '%Y-%m-%d')
-            filters['start_date'] = start_date
-        except:
-            pass
-    
-    if 'end_date' in request.args:
-        try:
-            end_date = datetime.strptime(request.args.get('end_date'), '%Y-%m-%d')
-            # Ajustar al final del día
-            end_date = end_date.replace(hour=23, minute=59, second=59)
-            filters['end_date'] = end_date
-        except:
-            pass
-    
-    if 'ip_address' in request.args:
-        filters['ip_address'] = request.args.get('ip_address')
-    
-    if 'details' in request.args:
-        filters['details'] = request.args.get('details')
+    # Construir filtros
+    filters = _parse_filters(request.args)
     
     # Obtener logs
-    logs, total = AuditLog.get_logs(db.session, filters, limit, offset, order_by, order)
+    try:
+        logs, total, has_more, next_cursor = AuditLog.get_logs(
+            db.session, filters, limit, offset, order_by, order,
+            cursor=cursor, count_mode=count_mode
+        )
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     
     # Formatear resultados
     result = []
@@ -143,9 +189,11 @@ def get_audit_logs(current_user):
     return jsonify({
         'logs': result,
         'total': total,
+        'total_is_estimate': count_mode == 'estimated',
         'limit': limit,
         'offset': offset,
-        'has_more': total > (offset + limit)
+        'has_more': has_more,
+        'next_cursor': next_cursor
     })
 
 # Ruta para obtener un log de auditoría específico
@@ -186,101 +234,87 @@ def get_audit_stats(current_user):
     """
     Obtiene estadísticas de los logs de auditoría.
     
+    Se leen de los contadores diarios precalculados (audit_stats_daily), por lo
+    que el costo no depende del volumen de audit_logs.
+    
+    Query params:
+        start_date: Fecha de inicio (formato: YYYY-MM-DD)
+        end_date: Fecha de fin (formato: YYYY-MM-DD)
+        
     Returns:
         JSON con estadísticas de auditoría
     """
-    # Estadísticas por acción
-    action_stats = db.session.query(
-        AuditLog.action, 
-        db.func.count(AuditLog.id)
-    ).group_by(AuditLog.action).all()
-    
-    # Estadísticas por estado
-    status_stats = db.session.query(
-        AuditLog.status, 
-        db.func.count(AuditLog.id)
-    ).group_by(AuditLog.status).all()
-    
-    # Estadísticas por usuario (top 10)
-    user_stats = db.session.query(
-        AuditLog.user_email, 
-        db.func.count(AuditLog.id)
-    ).filter(AuditLog.user_email != None).group_by(AuditLog.user_email).order_by(
-        db.func.count(AuditLog.id).desc()
-    ).limit(10).all()
-    
-    # Estadísticas por día (últimos 30 días)
-    from sqlalchemy import func, cast, Date
-    date_stats = db.session.query(
-        cast(AuditLog.created_at, Date).label('date'), 
-        db.func.count(AuditLog.id)
-    ).filter(
-        AuditLog.created_at >= db.func.date_sub(db.func.now(), 30)
-    ).group_by('date').order_by('date').all()
+    try:
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() \
+            if 'start_date' in request.args else None
+        end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() \
+            if 'end_date' in request.args else None
+    except ValueError:
+        return jsonify({'message': 'Invalid date format, expected YYYY-MM-DD'}), 400
+    
+    return jsonify(AuditStatsDaily.summarize(db.session, start_date, end_date))
+
+# Ruta para verificar la integridad de los logs de auditoría
+@audit_bp.route('/integrity/verify', methods=['POST'])
+@token_required
+def verify_audit_integrity(current_user):
+    """
+    Verifica la cadena de checkpoints de auditoría desde el último verificado.
     
-    return jsonify({
-        'action_stats': {action: count for action, count in action_stats},
-        'status_stats': {status: count for status, count in status_stats},
-        'user_stats': {email: count for email, count in user_stats},
-        'date_stats': {str(date): count for date, count in date_stats}
-    })
+    Solo se recalculan los lotes nuevos, por lo que el costo depende de los
+    registros escritos desde la última verificación.
+    
+    Query params:
+        limit: Número máximo de checkpoints a verificar
+        
+    Returns:
+        JSON con el resultado de la verificación
+    """
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Unauthorized access!'}), 403
+    
+    integrity = AuditLog._integrity or AuditIntegrity()
+    result = integrity.verify(db.session, limit=request.args.get('limit', type=int))
+    if not result['signatures_checked']:
+        result['warning'] = 'No hay firmante configurado: no se comprobaron las firmas de los checkpoints'
+    
+    return jsonify(result), 200 if result['valid'] else 409
 
 # Ruta para exportar logs de auditoría
 @audit_bp.route('/export', methods=['GET'])
 @token_required
 def export_audit_logs(current_user):
     """
-    Exporta logs de auditoría a CSV.
+    Exporta logs de auditoría en CSV, NDJSON o Parquet.
+    
+    La respuesta se genera en streaming: las filas se leen por bloques con un
+    cursor del servidor, por lo que la memoria usada no depende del volumen.
     
     Query params:
-        Los mismos que para get_audit_logs
+        Los filtros de get_audit_logs
+        format: csv, ndjson o parquet (default: csv)
+        compression: none, gzip o zstd (default: none); en Parquet es el códec interno
         
     Returns:
-        Archivo CSV con los logs de auditoría
+        Archivo con los logs de auditoría
     """
-    from flask import Response
-    import csv
-    import io
-    
-    # Obtener parámetros de consulta (igual que en get_audit_logs)
-    # ...
-    
     # Construir filtros (igual que en get_audit_logs)
-    filters = {}
-    # ...
-    
-    # Obtener todos los logs que coincidan con los filtros (sin límite)
-    logs, _ = AuditLog.get_logs(db.session, filters, limit=10000, offset=0)
-    
-    # Crear archivo CSV en memoria
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Escribir encabezados
-    writer.writerow([
-        'ID', 'Usuario', 'Correo', 'Rol', 'Acción', 'Detalles', 
-        'Dirección IP', 'User-Agent', 'Estado', 'Fecha y Hora'
-    ])
-    
-    # Escribir datos
-    for log in logs:
-        writer.writerow([
-            log.id,
-            log.user_id,
-            log.user_email,
-            log.user_role,
-            log.action,
-            log.details,
-            log.ip_address,
-            log.user_agent,
-            log.status,
-            log.created_at.isoformat()
-        ])
-    
-    # Preparar respuesta
-    output.seek(0)
+    filters = _parse_filters(request.args)
+    
+    rows = AuditLog.iter_logs(db.session, filters, chunk_size=EXPORT_CHUNK_SIZE)
+    try:
+        chunks, mimetype, filename = build_export(
+            rows,
+            AuditLog.EXPORT_COLUMNS,
+            request.args.get('format', 'csv'),
+            request.args.get('compression', 'none')
+        )
+    except ExportError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Preparar respuesta en streaming (sin límite de filas)
     return Response(
-        output,
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=audit_logs.csv'}
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
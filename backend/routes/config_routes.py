@@ -1,9 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, g
 from models.config import SystemConfig
+from models.audit_log import AuditLog
 from flask_sqlalchemy import SQLAlchemy
 from functools import wraps
-import jwt
-import os
+from utils.auth_cache import authenticate
+from utils.audit_policy import POLICY_CATEGORY
 
 # Crear blueprint para rutas de configuración
 config_bp = Blueprint('config', __name__, url_prefix='/api/config')
@@ -29,9 +30,9 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
             
         try:
-            data = jwt.decode(token, os.environ.get('SECRET_KEY', 'casamonarca_secret_key'), algorithms=["HS256"])
-            from models.user import User
-            current_user = User.query.filter_by(id=data['user_id']).first()
+            # Token y usuario se resuelven desde la caché compartida de credenciales
+            data, current_user = authenticate(token)
+            g.token_payload = data
             
             # Verificar si el usuario es administrador
             if current_user.role != 'admin':
@@ -43,6 +44,29 @@ def token_required(f):
     
     return decorated
 
+# Función para aplicar en este proceso los cambios de configuración que se cachean
+def _config_changed(category):
+    # La política de auditoría se relee de inmediato (el resto de procesos la
+    # releen al vencer AUDIT_POLICY_RELOAD_INTERVAL)
+    if category == POLICY_CATEGORY and AuditLog._policy is not None:
+        AuditLog._policy.invalidate()
+
+# Función para responder a las peticiones condicionales (If-None-Match)
+def _conditional(etag, build):
+    """
+    Devuelve 304 si el cliente ya tiene la versión ``etag``; en caso contrario
+    construye la respuesta con ``build`` y le asigna el ETag.
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = build()
+    
+    response.set_etag(etag)
+    # Los clientes pueden guardar la respuesta pero deben revalidarla siempre
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # Ruta para obtener todas las configuraciones de una categoría
 @config_bp.route('/<category>', methods=['GET'])
 @token_required
@@ -50,14 +74,17 @@ def get_config_category(current_user, category):
     """
     Obtiene todas las configuraciones de una categoría.
     
+    La respuesta lleva como ETag la versión de la categoría; con If-None-Match
+    igual a la versión vigente se responde 304 sin cuerpo.
+    
     Args:
         category: Categoría de las configuraciones
         
     Returns:
         JSON con las configuraciones de la categoría
     """
-    configs = SystemConfig.get_category(db.session, category)
-    return jsonify(configs)
+    version, configs = SystemConfig.get_category_snapshot(db.session, category)
+    return _conditional(f"{category}-{version}", lambda: jsonify(configs))
 
 # Ruta para obtener una configuración específica
 @config_bp.route('/<category>/<key>', methods=['GET'])
@@ -73,8 +100,8 @@ def get_config(current_user, category, key):
     Returns:
         JSON con el valor de la configuración
     """
-    value = SystemConfig.get_value(db.session, category, key)
-    return jsonify({'value': value})
+    version, configs = SystemConfig.get_category_snapshot(db.session, category)
+    return _conditional(f"{category}-{version}", lambda: jsonify({'value': configs.get(key)}))
 
 # Ruta para establecer una configuración
 @config_bp.route('/<category>/<key>', methods=['POST'])
@@ -112,13 +139,14 @@ def set_config(current_user, category, key):
         value_type,
         description
     )
+    _config_changed(category)
     
     return jsonify({
         'message': 'Configuration updated successfully',
         'config': {
             'category': config.category,
             'key': config.key,
-            'value': SystemConfig.get_value(db.session, category, key),
+            'value': SystemConfig.decode_value(config.value, config.value_type),
             'value_type': config.value_type,
             'description': config.description
         }
@@ -145,32 +173,17 @@ def set_config_category(current_user, category):
     if not data:
         return jsonify({'message': 'Missing configuration data'}), 400
     
-    results = {}
-    
+    items = {}
     for key, value in data.items():
         # Si el valor es un diccionario, puede contener metadatos
         if isinstance(value, dict) and 'value' in value:
-            config_value = value['value']
-            value_type = value.get('value_type', 'string')
-            description = value.get('description')
+            items[key] = value
         else:
-            config_value = value
-            value_type = 'string'
-            description = None
-        
-        config = SystemConfig.set_value(
-            db.session,
-            category,
-            key,
-            config_value,
-            value_type,
-            description
-        )
-        
-        results[key] = {
-            'value': SystemConfig.get_value(db.session, category, key),
-            'value_type': config.value_type
-        }
+            items[key] = {'value': value, 'value_type': 'string'}
+    
+    # Todas las claves se guardan con una sola escritura y un solo commit
+    results = SystemConfig.set_many(db.session, category, items)
+    _config_changed(category)
     
     return jsonify({
         'message': 'Configurations updated successfully',
@@ -191,13 +204,9 @@ def delete_config(current_user, category, key):
     Returns:
         JSON con el resultado de la operación
     """
-    config = db.session.query(SystemConfig).filter_by(category=category, key=key).first()
-    
-    if not config:
+    if not SystemConfig.delete_value(db.session, category, key):
         return jsonify({'message': 'Configuration not found'}), 404
-    
-    db.session.delete(config)
-    db.session.commit()
+    _config_changed(category)
     
     return jsonify({'message': 'Configuration deleted successfully'})
 
@@ -208,11 +217,44 @@ def get_categories(current_user):
     """
     Obtiene todas las categorías de configuración.
     
+    El ETag es la versión global de configuración, por lo que la consulta de
+    categorías solo se ejecuta si hubo escrituras desde la versión del cliente.
+    
     Returns:
         JSON con las categorías de configuración
     """
-    categories = db.session.query(SystemConfig.category).distinct().all()
-    return jsonify({'categories': [category[0] for category in categories]})
+    def build():
+        categories = db.session.query(SystemConfig.category).distinct().all()
+        return jsonify({'categories': [category[0] for category in categories]})
+    
+    return _conditional(f"categories-{SystemConfig.get_global_version(db.session)}", build)
+
+# Ruta para obtener los cambios de configuración posteriores a una versión
+@config_bp.route('/changes', methods=['GET'])
+@token_required
+def get_config_changes(current_user):
+    """
+    Obtiene las configuraciones modificadas o eliminadas después de una versión.
+    
+    Query params:
+        since: Última versión conocida por el cliente (default: 0, todos los cambios)
+        limit: Número máximo de cambios (default: 500, máximo: 1000)
+        
+    Returns:
+        JSON con los cambios, la versión hasta la que se leyó y si hay más cambios
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 1000)
+    
+    version = SystemConfig.get_global_version(db.session)
+    if since >= version:
+        return jsonify({'version': version, 'changes': [], 'has_more': False})
+    
+    changes, has_more = SystemConfig.get_changes(db.session, since, limit)
+    if has_more:
+        version = changes[-1]['version']
+    
+    return jsonify({'version': version, 'changes': changes, 'has_more': has_more})
 
 # Ruta para inicializar configuraciones por defecto
 @config_bp.route('/initialize', methods=['POST'])
@@ -280,20 +322,16 @@ def initialize_configs(current_user):
         'allowedFileTypes': {'value': 'pdf', 'value_type': 'string', 'description': 'Tipos de archivo permitidos'}
     }
     
-    # Guardar configuraciones
-    for key, config in general_configs.items():
-        SystemConfig.set_value(db.session, 'general', key, config['value'], config['value_type'], config['description'])
-    
-    for key, config in email_configs.items():
-        SystemConfig.set_value(db.session, 'email', key, config['value'], config['value_type'], config['description'])
-    
-    for key, config in security_configs.items():
-        SystemConfig.set_value(db.session, 'security', key, config['value'], config['value_type'], config['description'])
-    
-    for key, config in signature_configs.items():
-        SystemConfig.set_value(db.session, 'signature', key, config['value'], config['value_type'], config['description'])
-    
-    for key, config in storage_configs.items():
-        SystemConfig.set_value(db.session, 'storage', key, config['value'], config['value_type'], config['description'])
+    # Guardar configuraciones en una sola transacción
+    defaults = {
+        'general': general_configs,
+        'email': email_configs,
+        'security': security_configs,
+        'signature': signature_configs,
+        'storage': storage_configs
+    }
+    SystemConfig.set_categories(db.session, defaults)
+    for category in defaults:
+        _config_changed(category)
     
     return jsonify({'message': 'Default configurations initialized successfully'})
@@ -1,6 +1,7 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from functools import wraps
 from models.permissions import get_all_permissions, get_permissions_by_role, get_permissions_by_roles, update_role_permissions
+from models.permissions import decode_permission_mask, get_permission_version, get_role_mask
 
 permissions_bp = Blueprint('permissions', __name__)
 
@@ -9,12 +10,20 @@ def require_permission(permission_code):
     def decorator(f):
         @wraps(f)
         def decorated_function(current_user, *args, **kwargs):
-            from models.permissions import get_permissions_by_role
+            from models.permissions import get_permission_bit, get_permission_version, has_permission
             
-            user_permissions = get_permissions_by_role(current_user.role)
-            permission_codes = [p['code'] for p in user_permissions]
+            # Si el JWT trae una máscara emitida para el rol actual del usuario y con la versión
+            # vigente basta un AND de bits; en caso contrario (token antiguo, rol cambiado o
+            # permisos modificados) se usa la caché por rol
+            claims = g.get('token_payload') or {}
+            if ('perm_mask' in claims
+                    and claims.get('perm_role') == current_user.role
+                    and claims.get('perm_version') == get_permission_version()):
+                allowed = bool(claims['perm_mask'] & get_permission_bit(permission_code))
+            else:
+                allowed = has_permission(current_user.role, permission_code)
             
-            if permission_code not in permission_codes:
+            if not allowed:
                 return jsonify({'message': 'Unauthorized: Missing required permission'}), 403
                 
             return f(current_user, *args, **kwargs)
@@ -39,6 +48,20 @@ def get_role_permissions(current_user):
     role_permissions = get_permissions_by_roles()
     return jsonify({'role_permissions': role_permissions})
 
+@permissions_bp.route('/api/permissions/masks', methods=['GET'])
+def get_permission_masks(current_user):
+    # Verificar si el usuario tiene permisos para gestionar permisos
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    valid_roles = ["admin", "sub_admin", "management", "employer", "public"]
+    masks = {}
+    for role in valid_roles:
+        mask = get_role_mask(role)
+        masks[role] = {'mask': mask, 'permissions': decode_permission_mask(mask)}
+    
+    return jsonify({'version': get_permission_version(), 'masks': masks})
+
 @permissions_bp.route('/api/permissions/roles/<role>', methods=['GET'])
 def get_specific_role_permissions(current_user, role):
     # Verificar si el usuario tiene permisos para gestionar permisos
@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta
+
 from flask import Blueprint, request, jsonify, g
 from backend.models.signature_flow import SignatureFlow
 from backend.utils.auth import token_required, admin_required
@@ -22,7 +24,10 @@ def create_flow(document_id):
     if not required_signatures:
         return jsonify({"success": False, "message": "Se requiere al menos una firma"}), 400
     
-    result = SignatureFlow.create_flow(document_id, required_signatures)
+    try:
+        result = SignatureFlow.create_flow(document_id, required_signatures)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     
     if result:
         return jsonify({"success": True, "message": "Flujo de firmas creado correctamente"})
@@ -52,3 +57,37 @@ def get_pending_documents():
     
     documents = SignatureFlow.get_pending_signatures(user_id, user_role)
     return jsonify({"success": True, "documents": documents})
+
+@signature_flow_bp.route('/api/flows/analytics', methods=['GET'])
+@token_required
+@admin_required
+def get_flow_analytics():
+    """
+    Obtiene los tiempos de espera por etapa de los flujos de firma.
+    
+    Query params:
+        start_date: Fecha de inicio (formato: YYYY-MM-DD, default: hace 30 días)
+        end_date: Fecha de fin (formato: YYYY-MM-DD, default: hoy)
+        area: Filtrar por área del documento
+        role: Filtrar por rol de la etapa
+    """
+    try:
+        end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d') \
+            if 'end_date' in request.args else datetime.now()
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d') \
+            if 'start_date' in request.args else end_date - timedelta(days=30)
+    except ValueError:
+        return jsonify({"success": False, "message": "Formato de fecha inválido, use YYYY-MM-DD"}), 400
+    
+    stats = SignatureFlow.get_turnaround_stats(
+        start_date,
+        end_date,
+        area=request.args.get('area'),
+        role=request.args.get('role')
+    )
+    return jsonify({
+        "success": True,
+        "start_date": start_date.date().isoformat(),
+        "end_date": end_date.date().isoformat(),
+        "stages": stats
+    })
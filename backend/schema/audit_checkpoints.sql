@@ -0,0 +1,25 @@
+-- Modo a prueba de manipulaciones de audit_logs: cada lote insertado se sella
+-- con un checkpoint que guarda la raíz de Merkle de sus filas y un hash
+-- encadenado con el checkpoint anterior (ver utils/audit_integrity.py).
+
+ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS checkpoint_seq BIGINT;
+
+CREATE INDEX IF NOT EXISTS ix_audit_logs_checkpoint_seq
+    ON audit_logs (checkpoint_seq);
+
+CREATE TABLE IF NOT EXISTS audit_checkpoints (
+    seq BIGINT PRIMARY KEY,
+    merkle_root VARCHAR(64) NOT NULL,
+    prev_hash VARCHAR(64) NOT NULL,
+    chain_hash VARCHAR(64) NOT NULL,
+    row_count INTEGER NOT NULL,
+    first_created_at TIMESTAMP NOT NULL,
+    last_created_at TIMESTAMP NOT NULL,
+    signature TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    verified_at TIMESTAMP
+);
+
+-- Última posición verificada (la verificación es incremental)
+CREATE INDEX IF NOT EXISTS ix_audit_checkpoints_verified
+    ON audit_checkpoints (seq) WHERE verified_at IS NOT NULL;
@@ -0,0 +1,21 @@
+-- Detalles estructurados de auditoría en JSONB con índice GIN para consultas
+-- de contención (details_json @> '{"document_id": "..."}').
+
+ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS details_json JSONB;
+
+-- Migrar los detalles existentes que contienen un objeto JSON válido
+CREATE OR REPLACE FUNCTION pg_temp.to_jsonb_or_null(value TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN value::JSONB;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+UPDATE audit_logs
+SET details_json = pg_temp.to_jsonb_or_null(details)
+WHERE details_json IS NULL
+AND details LIKE '{%';
+
+CREATE INDEX IF NOT EXISTS ix_audit_logs_details_json
+    ON audit_logs USING gin (details_json jsonb_path_ops);
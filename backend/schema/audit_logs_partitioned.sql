@@ -0,0 +1,61 @@
+-- Migración de audit_logs a una tabla particionada por mes sobre created_at.
+-- Las particiones futuras y la retención las mantiene utils/audit_partitions.py
+-- (run_audit_maintenance); aquí solo se crean las necesarias para los datos actuales.
+
+BEGIN;
+
+ALTER TABLE audit_logs RENAME TO audit_logs_legacy;
+
+CREATE TABLE audit_logs (
+    id VARCHAR(36) NOT NULL,
+    user_id VARCHAR(36),
+    user_email VARCHAR(100),
+    user_role VARCHAR(20),
+    action VARCHAR(50) NOT NULL,
+    details TEXT,
+    ip_address VARCHAR(50),
+    user_agent VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'success',
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    -- La clave de partición debe formar parte de la clave primaria
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Partición por defecto para filas fuera de los meses creados
+CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT;
+
+-- Una partición por cada mes con datos, más el actual y los tres siguientes
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE(MIN(created_at), now()))::date,
+            (date_trunc('month', now()) + INTERVAL '3 months')::date,
+            INTERVAL '1 month'
+        )::date
+        FROM audit_logs_legacy
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF audit_logs FOR VALUES FROM (%L) TO (%L)',
+            'audit_logs_y' || to_char(month_start, 'YYYY') || 'm' || to_char(month_start, 'MM'),
+            month_start,
+            (month_start + INTERVAL '1 month')::date
+        );
+    END LOOP;
+END $$;
+
+-- Los índices del padre se crean en cada partición
+CREATE INDEX ix_audit_logs_action ON audit_logs (action);
+CREATE INDEX ix_audit_logs_created_at ON audit_logs (created_at);
+CREATE INDEX ix_audit_logs_created_at_id ON audit_logs (created_at, id);
+
+INSERT INTO audit_logs
+SELECT id, user_id, user_email, user_role, action, details, ip_address, user_agent, status,
+       COALESCE(created_at, now() AT TIME ZONE 'utc')
+FROM audit_logs_legacy;
+
+DROP TABLE audit_logs_legacy;
+
+COMMIT;
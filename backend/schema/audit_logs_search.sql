@@ -0,0 +1,24 @@
+-- Índices de búsqueda para audit_logs (filtros de AuditLog.get_logs).
+-- Los filtros de detalles y correo usan ILIKE '%...%' sobre índices trigram y el
+-- filtro de IP usa los operadores de inet (=, <<=) sobre un índice GiST.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- ip_address pasa de texto a inet; los valores que no son direcciones válidas se descartan
+CREATE OR REPLACE FUNCTION pg_temp.to_inet_or_null(value TEXT) RETURNS INET AS $$
+BEGIN
+    RETURN split_part(value, ',', 1)::INET;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+ALTER TABLE audit_logs
+    ALTER COLUMN ip_address TYPE INET USING pg_temp.to_inet_or_null(ip_address);
+
+CREATE INDEX IF NOT EXISTS ix_audit_logs_details_trgm
+    ON audit_logs USING gin (details gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_audit_logs_user_email_trgm
+    ON audit_logs USING gin (user_email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_audit_logs_ip_address
+    ON audit_logs USING gist (ip_address inet_ops);
@@ -0,0 +1,33 @@
+-- Conteos diarios de auditoría por acción, estado y usuario (AuditStatsDaily).
+-- /api/audit/stats solo lee esta tabla; se actualiza en la misma transacción
+-- que inserta los eventos.
+
+CREATE TABLE IF NOT EXISTS audit_stats_daily (
+    day DATE NOT NULL,
+    action VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    user_email VARCHAR(100) NOT NULL DEFAULT '',  -- '' para eventos sin usuario
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, action, status, user_email)
+);
+
+-- Carga inicial con el histórico existente (solo si la tabla está vacía).
+-- Ejecutar antes de desplegar el código que incrementa los contadores y después
+-- de audit_logs_details_json.sql. Las filas agregadas o muestreadas por
+-- utils/audit_policy.py cuentan por los eventos que representan, igual que en
+-- AuditStatsDaily.rebuild(), que sirve para recalcular rangos concretos.
+INSERT INTO audit_stats_daily (day, action, status, user_email, count)
+SELECT
+    created_at::DATE,
+    action,
+    status,
+    COALESCE(user_email, ''),
+    SUM(COALESCE(
+        (details_json ->> 'event_count')::BIGINT,
+        ROUND(1.0 / (details_json ->> 'sample_rate')::FLOAT)::BIGINT,
+        1
+    ))
+FROM audit_logs
+WHERE NOT EXISTS (SELECT 1 FROM audit_stats_daily)
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (day, action, status, user_email) DO NOTHING;
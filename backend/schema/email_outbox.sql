@@ -0,0 +1,33 @@
+-- Bandeja de salida de correos. Las peticiones solo insertan el mensaje y los
+-- workers de utils/email_outbox.py lo entregan con reintentos.
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    recipient VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body_html TEXT NOT NULL,
+    -- pending: en espera, sending: reservado por un worker, sent: entregado,
+    -- dead: agotó los reintentos o expiró
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    priority SMALLINT NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 8,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    -- Un mensaje en 'sending' cuyo worker murió se vuelve a reservar al vencer;
+    -- locked_by identifica al hilo que lo reservó
+    locked_until TIMESTAMP,
+    locked_by VARCHAR(128),
+    -- Los mensajes que dejan de tener sentido (p. ej. códigos 2FA) no se reintentan después
+    expires_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMP
+);
+
+-- Mensajes por entregar en el orden en que los reservan los workers
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+    ON email_outbox (priority DESC, next_attempt_at)
+    WHERE status IN ('pending', 'sending');
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_dead
+    ON email_outbox (created_at)
+    WHERE status = 'dead';
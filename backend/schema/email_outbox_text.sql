@@ -0,0 +1,3 @@
+-- Alternativa en texto plano de los correos generados con las plantillas de
+-- templates/email (NULL para los mensajes que solo tienen HTML).
+ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS body_text TEXT;
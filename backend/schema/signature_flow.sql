@@ -6,10 +6,41 @@ CREATE TABLE IF NOT EXISTS signature_flows (
     required_count INTEGER NOT NULL DEFAULT 1,
     current_count INTEGER NOT NULL DEFAULT 0,
     flow_order INTEGER NOT NULL,
+    -- Roles de las etapas que deben completarse antes de esta (DAG)
+    prerequisites VARCHAR(50)[] NOT NULL DEFAULT '{}',
+    -- Número de prerrequisitos aún incompletos; la etapa es firmable cuando llega a 0
+    pending_prereqs INTEGER NOT NULL DEFAULT 0,
+    -- Momento en que la etapa quedó firmable y en que se completó
+    ready_at TIMESTAMP,
+    completed_at TIMESTAMP,
     created_at TIMESTAMP NOT NULL,
     UNIQUE(document_id, role)
 );
 
+-- Migración de flujos existentes (secuenciales por flow_order)
+ALTER TABLE signature_flows ADD COLUMN IF NOT EXISTS prerequisites VARCHAR(50)[] NOT NULL DEFAULT '{}';
+ALTER TABLE signature_flows ADD COLUMN IF NOT EXISTS pending_prereqs INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE signature_flows ADD COLUMN IF NOT EXISTS ready_at TIMESTAMP;
+ALTER TABLE signature_flows ADD COLUMN IF NOT EXISTS completed_at TIMESTAMP;
+
+UPDATE signature_flows sf
+SET prerequisites = prev.roles,
+    pending_prereqs = prev.pending
+FROM (
+    SELECT cur.id,
+           array_agg(p.role) AS roles,
+           COUNT(*) FILTER (WHERE p.current_count < p.required_count) AS pending
+    FROM signature_flows cur
+    JOIN signature_flows p
+      ON p.document_id = cur.document_id
+     AND p.flow_order = (
+         SELECT MAX(flow_order) FROM signature_flows
+         WHERE document_id = cur.document_id AND flow_order < cur.flow_order
+     )
+    GROUP BY cur.id
+) prev
+WHERE sf.id = prev.id AND sf.prerequisites = '{}';
+
 -- Tabla para registrar las firmas realizadas
 CREATE TABLE IF NOT EXISTS signature_status (
     id SERIAL PRIMARY KEY,
@@ -20,8 +51,26 @@ CREATE TABLE IF NOT EXISTS signature_status (
     UNIQUE(document_id, user_id)
 );
 
+-- Agregados diarios de tiempos de espera por etapa (desde que queda firmable hasta completarse).
+-- Se mantienen incrementalmente al completarse cada etapa; los límites de los
+-- buckets del histograma están definidos en SignatureFlow.WAIT_BUCKET_HOURS.
+CREATE TABLE IF NOT EXISTS signature_stage_latency_daily (
+    day DATE NOT NULL,
+    area VARCHAR(50) NOT NULL,
+    role VARCHAR(50) NOT NULL,
+    stage_order INTEGER NOT NULL,
+    bucket SMALLINT NOT NULL,
+    stage_count INTEGER NOT NULL DEFAULT 0,
+    total_wait_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    max_wait_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, area, role, stage_order, bucket)
+);
+
 -- Índices para mejorar el rendimiento
 CREATE INDEX IF NOT EXISTS idx_signature_flows_document_id ON signature_flows(document_id);
 CREATE INDEX IF NOT EXISTS idx_signature_flows_role ON signature_flows(role);
+-- Etapas firmables: prerrequisitos completos y firmas pendientes
+CREATE INDEX IF NOT EXISTS idx_signature_flows_ready ON signature_flows(role, document_id)
+    WHERE pending_prereqs = 0 AND current_count < required_count;
 CREATE INDEX IF NOT EXISTS idx_signature_status_document_id ON signature_status(document_id);
 CREATE INDEX IF NOT EXISTS idx_signature_status_user_id ON signature_status(user_id);
@@ -0,0 +1,25 @@
+-- Versiones globales de configuración para ETags y el feed de cambios
+-- (GET /api/config/changes?since=<versión>). Cada transacción de escritura
+-- toma un valor de la secuencia y lo asigna a las filas modificadas, a los
+-- tombstones de las eliminadas y a sus categorías en system_config_versions.
+
+CREATE SEQUENCE IF NOT EXISTS system_config_version_seq;
+
+ALTER TABLE system_config ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS ix_system_config_version ON system_config (version);
+
+CREATE TABLE IF NOT EXISTS system_config_deletions (
+    category VARCHAR(50) NOT NULL,
+    key VARCHAR(100) NOT NULL,
+    version BIGINT NOT NULL,
+    deleted_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (category, key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_system_config_deletions_version ON system_config_deletions (version);
+
+-- Las filas existentes pasan a la versión 1 y las categorías a su versión global
+SELECT setval('system_config_version_seq', GREATEST(1, (SELECT COALESCE(MAX(version), 0) FROM system_config_versions)));
+UPDATE system_config SET version = 1 WHERE version = 0;
+UPDATE system_config_versions SET version = currval('system_config_version_seq');
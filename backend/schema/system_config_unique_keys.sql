@@ -0,0 +1,12 @@
+-- Una sola fila por (category, key), requerida por las escrituras con
+-- INSERT ... ON CONFLICT de SystemConfig.set_many. Se conserva la fila más
+-- reciente de cada clave duplicada.
+
+DELETE FROM system_config a
+USING system_config b
+WHERE a.category = b.category
+AND a.key = b.key
+AND (a.updated_at, a.id) < (b.updated_at, b.id);
+
+ALTER TABLE system_config
+    ADD CONSTRAINT uq_system_config_category_key UNIQUE (category, key);
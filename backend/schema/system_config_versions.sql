@@ -0,0 +1,13 @@
+-- Versión por categoría de system_config. La caché en proceso de
+-- SystemConfig compara estas versiones para detectar cambios hechos por
+-- otros procesos sin releer las configuraciones.
+
+CREATE TABLE IF NOT EXISTS system_config_versions (
+    category VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO system_config_versions (category, version)
+SELECT DISTINCT category, 1 FROM system_config
+ON CONFLICT (category) DO NOTHING;
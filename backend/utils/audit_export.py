@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+import zlib
+
+# Formatos y compresiones admitidos por /api/audit/export
+EXPORT_FORMATS = ('csv', 'ndjson', 'parquet')
+EXPORT_COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+# Tamaño aproximado de cada bloque enviado al cliente y filas por row group de Parquet
+EXPORT_BUFFER_BYTES = 64 * 1024
+PARQUET_ROW_GROUP_SIZE = 50000
+
+CSV_HEADERS = [
+    'ID', 'Usuario', 'Correo', 'Rol', 'Acción', 'Detalles',
+    'Dirección IP', 'User-Agent', 'Estado', 'Fecha y Hora'
+]
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+class ExportError(Exception):
+    """Formato o compresión no disponibles en este entorno."""
+
+
+def build_export(rows, columns, export_format='csv', compression='none'):
+    """
+    Prepara la exportación en streaming de los registros de auditoría.
+
+    Args:
+        rows: Iterable de tuplas con las columnas de ``columns`` (AuditLog.iter_logs)
+        columns: Nombres de las columnas de cada tupla
+        export_format: csv, ndjson o parquet
+        compression: none, gzip o zstd. En Parquet se usa como códec interno
+            de las páginas en lugar de comprimir el archivo completo.
+
+    Returns:
+        Tupla (generador de bytes, mimetype, nombre de archivo)
+
+    Raises:
+        ExportError: si el formato o la compresión no son válidos o falta la dependencia
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"Formato no soportado: {export_format}")
+    if compression not in EXPORT_COMPRESSIONS:
+        raise ExportError(f"Compresión no soportada: {compression}")
+
+    filename = f"audit_logs.{export_format}"
+
+    if export_format == 'parquet':
+        chunks = _parquet_chunks(rows, columns, compression)
+        return chunks, MIMETYPES['parquet'], filename
+
+    if export_format == 'csv':
+        chunks = _encode(_csv_chunks(rows))
+    else:
+        chunks = _encode(_ndjson_chunks(rows, columns))
+
+    if compression == 'gzip':
+        return _gzip(chunks), 'application/gzip', f"{filename}.gz"
+    if compression == 'zstd':
+        return _zstd(chunks), 'application/zstd', f"{filename}.zst"
+    return chunks, MIMETYPES[export_format], filename
+
+
+def _format_value(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value) if not isinstance(value, (int, float, bool)) else value
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADERS)
+
+    for row in rows:
+        writer.writerow([_format_value(value) for value in row])
+
+        if buffer.tell() >= EXPORT_BUFFER_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows, columns):
+    lines = []
+    size = 0
+
+    for row in rows:
+        line = json.dumps(
+            {column: _format_value(value) for column, value in zip(columns, row)},
+            ensure_ascii=False
+        )
+        lines.append(line)
+        size += len(line) + 1
+
+        if size >= EXPORT_BUFFER_BYTES:
+            yield '\n'.join(lines) + '\n'
+            lines, size = [], 0
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _encode(chunks):
+    for chunk in chunks:
+        if chunk:
+            yield chunk.encode('utf-8')
+
+
+def _gzip(chunks):
+    # wbits=31 genera un flujo con cabecera gzip
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _zstd(chunks):
+    try:
+        import zstandard
+    except ImportError:
+        raise ExportError("La compresión zstd requiere el paquete 'zstandard'")
+
+    def generate():
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    return generate()
+
+
+class _ChunkSink:
+    """
+    Archivo de solo escritura que acumula los bytes escritos por ParquetWriter
+    para enviarlos al cliente después de cada row group.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_chunks(rows, columns, compression):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("La exportación Parquet requiere el paquete 'pyarrow'")
+
+    schema = pa.schema([
+        (column, pa.timestamp('us') if column == 'created_at' else pa.string())
+        for column in columns
+    ])
+    codec = {'none': 'none', 'gzip': 'gzip', 'zstd': 'zstd'}[compression]
+
+    def to_batch(buffered):
+        arrays = []
+        for index, column in enumerate(columns):
+            values = [row[index] for row in buffered]
+            if column != 'created_at':
+                values = [str(value) if value is not None else None for value in values]
+            arrays.append(pa.array(values, type=schema.field(column).type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    def generate():
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression=codec)
+        buffered = []
+
+        try:
+            for row in rows:
+                buffered.append(row)
+                if len(buffered) >= PARQUET_ROW_GROUP_SIZE:
+                    writer.write_table(to_batch(buffered))
+                    buffered = []
+                    yield sink.drain()
+
+            if buffered:
+                writer.write_table(to_batch(buffered))
+        finally:
+            writer.close()
+
+        yield sink.drain()
+
+    return generate()
@@ -0,0 +1,240 @@
+import base64
+import hashlib
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models.audit_log import AuditCheckpoint, AuditLog
+
+logger = logging.getLogger(__name__)
+
+# Hash del "checkpoint 0" con el que empieza la cadena
+GENESIS_HASH = '0' * 64
+# Clave del bloqueo asesor que serializa la creación de checkpoints entre procesos
+CHECKPOINT_LOCK_KEY = 0x41554454  # 'AUDT'
+
+# Campos de audit_logs incluidos en el hash de cada fila (en este orden)
+LEAF_FIELDS = (
+    'id', 'created_at', 'user_id', 'user_email', 'user_role', 'action',
+    'details', 'details_json', 'ip_address', 'user_agent', 'status'
+)
+
+PendingCheckpoint = namedtuple('PendingCheckpoint', ['seq', 'prev_hash'])
+
+
+def leaf_hash(row):
+    """
+    Hash de una fila de auditoría a partir de una serialización canónica.
+
+    Args:
+        row: Diccionario (o fila con acceso por nombre) con los campos LEAF_FIELDS
+    """
+    values = []
+    for field in LEAF_FIELDS:
+        value = row[field]
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, (dict, list)):
+            # JSONB no conserva el orden de las claves: serializar de forma canónica
+            value = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        elif value is not None:
+            value = str(value)
+        values.append(value)
+
+    canonical = json.dumps(values, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(b'\x00' + canonical.encode('utf-8')).digest()
+
+
+def merkle_root(leaves):
+    """
+    Raíz del árbol de Merkle de una lista de hashes de hojas (en hexadecimal).
+
+    Los nodos internos usan un prefijo distinto al de las hojas y un nodo sin
+    pareja sube sin modificarse al nivel siguiente.
+    """
+    if not leaves:
+        return hashlib.sha256(b'').hexdigest()
+
+    level = list(leaves)
+    while len(level) > 1:
+        next_level = []
+        for index in range(0, len(level) - 1, 2):
+            next_level.append(hashlib.sha256(b'\x01' + level[index] + level[index + 1]).digest())
+        if len(level) % 2:
+            next_level.append(level[-1])
+        level = next_level
+
+    return level[0].hex()
+
+
+def chain_hash(seq, prev_hash, root, row_count):
+    """
+    Hash encadenado de un checkpoint con el anterior.
+    """
+    return hashlib.sha256(f"{seq}:{prev_hash}:{root}:{row_count}".encode()).hexdigest()
+
+
+def batch_root(rows):
+    """
+    Raíz de Merkle de un lote; las filas se ordenan por id para que el cálculo
+    sea reproducible al verificar.
+    """
+    ordered = sorted(rows, key=lambda row: row['id'])
+    return merkle_root([leaf_hash(row) for row in ordered])
+
+
+class AuditIntegrity:
+    """
+    Sellado de lotes de auditoría con árboles de Merkle encadenados.
+
+    Cada lote escrito recibe un número de checkpoint (``checkpoint_seq``) y se
+    guarda un registro en ``audit_checkpoints`` con la raíz de Merkle del lote y
+    un hash encadenado con el checkpoint anterior, firmado opcionalmente con la
+    clave de ``PDFSigner``. El costo es de un checkpoint por lote, no por fila.
+
+    Uso dentro de la transacción que inserta el lote:
+        checkpoint = integrity.begin(conn)
+        ... insertar filas con checkpoint_seq = checkpoint.seq ...
+        integrity.commit(conn, checkpoint, filas_insertadas)
+    """
+
+    def __init__(self, signer=None):
+        """
+        Args:
+            signer: Instancia de PDFSigner para firmar los checkpoints (opcional)
+        """
+        self.signer = signer
+
+    def begin(self, connection):
+        """
+        Reserva el siguiente número de checkpoint.
+
+        Toma un bloqueo asesor de transacción, por lo que los checkpoints de
+        distintos procesos se crean en orden y sin huecos en la cadena.
+        """
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': CHECKPOINT_LOCK_KEY})
+        last = connection.execute(text(
+            "SELECT seq, chain_hash FROM audit_checkpoints ORDER BY seq DESC LIMIT 1"
+        )).first()
+
+        if last is None:
+            return PendingCheckpoint(seq=1, prev_hash=GENESIS_HASH)
+        return PendingCheckpoint(seq=last.seq + 1, prev_hash=last.chain_hash)
+
+    def commit(self, connection, checkpoint, rows):
+        """
+        Registra el checkpoint de las filas efectivamente insertadas en el lote.
+        """
+        if not rows:
+            return None
+
+        root = batch_root(rows)
+        chained = chain_hash(checkpoint.seq, checkpoint.prev_hash, root, len(rows))
+
+        signature = None
+        if self.signer is not None:
+            signature = base64.b64encode(self.signer.sign_bytes(chained.encode())).decode()
+
+        connection.execute(AuditCheckpoint.__table__.insert().values(
+            seq=checkpoint.seq,
+            merkle_root=root,
+            prev_hash=checkpoint.prev_hash,
+            chain_hash=chained,
+            row_count=len(rows),
+            first_created_at=min(row['created_at'] for row in rows),
+            last_created_at=max(row['created_at'] for row in rows),
+            signature=signature,
+            created_at=datetime.utcnow()
+        ))
+        return chained
+
+    def verify(self, session, limit=None):
+        """
+        Verifica la cadena desde el último checkpoint verificado.
+
+        Recalcula la raíz de Merkle de cada checkpoint nuevo con las filas que
+        lo referencian, comprueba el encadenamiento y la firma, y marca los
+        checkpoints válidos como verificados. Se detiene en el primer fallo.
+        Sin ``signer`` las firmas no se comprueban; el resultado lo indica con
+        ``signatures_checked`` y cuenta las omitidas en ``unverified_signatures``.
+
+        Args:
+            session: Sesión de SQLAlchemy
+            limit: Número máximo de checkpoints a verificar en esta ejecución
+
+        Returns:
+            Diccionario con el resultado (valid, verified, failed_seq, reason,
+            signatures_checked, unverified_signatures)
+        """
+        anchor = session.query(AuditCheckpoint).filter(
+            AuditCheckpoint.verified_at.isnot(None)
+        ).order_by(AuditCheckpoint.seq.desc()).first()
+
+        expected_prev = anchor.chain_hash if anchor else GENESIS_HASH
+        expected_seq = anchor.seq + 1 if anchor else 1
+
+        query = session.query(AuditCheckpoint).filter(
+            AuditCheckpoint.seq >= expected_seq
+        ).order_by(AuditCheckpoint.seq)
+        if limit:
+            query = query.limit(limit)
+
+        columns = [getattr(AuditLog, field) for field in LEAF_FIELDS]
+        verified = 0
+        unverified_signatures = 0
+
+        for checkpoint in query:
+            failure = None
+
+            if checkpoint.seq != expected_seq or checkpoint.prev_hash != expected_prev:
+                failure = 'La cadena de checkpoints está rota (checkpoint faltante o alterado)'
+            else:
+                rows = session.query(*columns).filter(
+                    AuditLog.checkpoint_seq == checkpoint.seq,
+                    # Acotar por fecha para recorrer solo las particiones del lote
+                    AuditLog.created_at.between(checkpoint.first_created_at, checkpoint.last_created_at)
+                ).all()
+                rows = [dict(zip(LEAF_FIELDS, row)) for row in rows]
+
+                if len(rows) != checkpoint.row_count:
+                    failure = f'Se esperaban {checkpoint.row_count} filas y hay {len(rows)}'
+                elif batch_root(rows) != checkpoint.merkle_root:
+                    failure = 'La raíz de Merkle no coincide (filas modificadas)'
+                elif chain_hash(checkpoint.seq, checkpoint.prev_hash, checkpoint.merkle_root,
+                                checkpoint.row_count) != checkpoint.chain_hash:
+                    failure = 'El hash encadenado no coincide'
+                elif checkpoint.signature and self.signer is not None and not self.signer.verify_bytes(
+                        checkpoint.chain_hash.encode(), base64.b64decode(checkpoint.signature)):
+                    failure = 'La firma del checkpoint no es válida'
+
+            if failure:
+                session.commit()
+                logger.error(f"Verificación de auditoría fallida en checkpoint {checkpoint.seq}: {failure}")
+                return {
+                    'valid': False,
+                    'verified': verified,
+                    'failed_seq': checkpoint.seq,
+                    'reason': failure,
+                    'signatures_checked': self.signer is not None,
+                    'unverified_signatures': unverified_signatures
+                }
+
+            if checkpoint.signature and self.signer is None:
+                unverified_signatures += 1
+            checkpoint.verified_at = datetime.utcnow()
+            expected_prev = checkpoint.chain_hash
+            expected_seq = checkpoint.seq + 1
+            verified += 1
+
+        session.commit()
+        return {
+            'valid': True,
+            'verified': verified,
+            'failed_seq': None,
+            'reason': None,
+            'signatures_checked': self.signer is not None,
+            'unverified_signatures': unverified_signatures
+        }
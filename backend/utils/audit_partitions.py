@@ -0,0 +1,175 @@
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'audit_logs'
+# Nombre de las particiones mensuales: audit_logs_y2024m01
+PARTITION_PATTERN = re.compile(r'^audit_logs_y(\d{4})m(\d{2})$')
+
+
+def _month_start(value, months_offset=0):
+    """
+    Devuelve el primer día del mes de ``value`` desplazado ``months_offset`` meses.
+    """
+    month_index = value.year * 12 + (value.month - 1) + months_offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def list_partitions(conn):
+    """
+    Obtiene las particiones mensuales existentes como {nombre: primer día del mes}.
+    """
+    rows = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:parent AS regclass)
+    """), {'parent': PARENT_TABLE}).scalars()
+
+    partitions = {}
+    for name in rows:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def ensure_future_partitions(engine, months_ahead=3, today=None):
+    """
+    Crea las particiones del mes actual y de los ``months_ahead`` meses siguientes.
+
+    Returns:
+        Lista con los nombres de las particiones creadas
+    """
+    today = today or datetime.utcnow().date()
+    created = []
+
+    with engine.begin() as conn:
+        existing = list_partitions(conn)
+
+        for offset in range(months_ahead + 1):
+            start = _month_start(today, offset)
+            name = partition_name(start)
+            if name in existing:
+                continue
+
+            end = _month_start(start, 1)
+            conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {PARENT_TABLE} '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            created.append(name)
+
+    if created:
+        logger.info(f"Particiones de auditoría creadas: {', '.join(created)}")
+    return created
+
+
+def archive_old_partitions(engine, retention_months, archive_dir, today=None):
+    """
+    Archiva, separa y elimina las particiones anteriores al periodo de retención.
+
+    Cada partición se vuelca con COPY a un CSV comprimido con gzip en
+    ``archive_dir``; una vez escrito y sincronizado el archivo, la partición se
+    separa de ``audit_logs`` y se elimina en una misma transacción. Si algo
+    falla antes de eso la partición queda intacta y se reintenta en la próxima
+    ejecución.
+
+    Un mes con filas de checkpoints de integridad aún sin verificar
+    (utils/audit_integrity.py) no se archiva: sin sus filas la verificación
+    fallaría para siempre en ese checkpoint. Se omite hasta que
+    ``AuditIntegrity.verify`` lo haya verificado.
+
+    Returns:
+        Lista con las rutas de los archivos generados
+    """
+    today = today or datetime.utcnow().date()
+    cutoff = _month_start(today, -retention_months)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    with engine.connect() as conn:
+        expired = sorted(
+            (month, name) for name, month in list_partitions(conn).items() if month < cutoff
+        )
+
+    archived = []
+    for month, name in expired:
+        path = os.path.join(archive_dir, f"{name}.csv.gz")
+        tmp_path = f"{path}.tmp"
+
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+
+            # Bloquear escrituras tardías mientras se vuelca y elimina la partición
+            cursor.execute(f'LOCK TABLE "{name}" IN SHARE MODE')
+
+            if _has_unverified_checkpoints(cursor, month, _month_start(month, 1)):
+                raw.rollback()
+                cursor.close()
+                logger.warning(
+                    f"Partición {name} no archivada: contiene checkpoints de integridad sin verificar"
+                )
+                continue
+
+            with gzip.open(tmp_path, 'wb') as archive:
+                cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', archive)
+            with open(tmp_path, 'rb') as archive:
+                os.fsync(archive.fileno())
+            os.replace(tmp_path, path)
+
+            cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+            raw.commit()
+            cursor.close()
+        except Exception as e:
+            raw.rollback()
+            logger.error(f"Error al archivar la partición {name}: {e}")
+            raise
+        finally:
+            raw.close()
+
+        logger.info(f"Partición {name} archivada en {path}")
+        archived.append(path)
+
+    return archived
+
+
+def _has_unverified_checkpoints(cursor, start, end):
+    cursor.execute("SELECT to_regclass('audit_checkpoints') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return False
+
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM audit_checkpoints
+            WHERE verified_at IS NULL
+            AND first_created_at < %s
+            AND last_created_at >= %s
+        )
+    """, (end, start))
+    return cursor.fetchone()[0]
+
+
+def run_audit_maintenance(engine, config):
+    """
+    Tarea periódica: crea particiones futuras y aplica la política de retención.
+
+    Pensada para ejecutarse a diario desde el planificador de la aplicación o cron.
+    """
+    ensure_future_partitions(engine, config.get('AUDIT_PARTITIONS_AHEAD', 3))
+    return archive_old_partitions(
+        engine,
+        config.get('AUDIT_RETENTION_MONTHS', 24),
+        config['AUDIT_ARCHIVE_DIR']
+    )
@@ -0,0 +1,218 @@
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from models.config import SystemConfig
+
+logger = logging.getLogger(__name__)
+
+# Ubicación de la política en system_config (value_type json)
+POLICY_CATEGORY = 'audit'
+POLICY_KEY = 'policy'
+
+MODE_FULL = 'full'            # fila completa por evento (comportamiento por defecto)
+MODE_SAMPLE = 'sample'        # se escribe una fracción ``rate`` de los eventos
+MODE_AGGREGATE = 'aggregate'  # contador por usuario y minuto, una fila por ventana
+
+POLICY_MODES = (MODE_FULL, MODE_SAMPLE, MODE_AGGREGATE)
+
+# Acciones que siempre se registran completas, sin importar la política
+SECURITY_ACTION_KEYWORDS = (
+    'login', 'logout', 'password', '2fa', 'two_factor', 'permission', 'role',
+    'delete', 'sign', 'config', 'certificate', 'export'
+)
+
+
+class AuditPolicy:
+    """
+    Política de muestreo y agregación de eventos de auditoría.
+
+    Se guarda en ``system_config`` (categoría ``audit``, clave ``policy``) como:
+
+        {
+            "actions": {
+                "view_document": {"mode": "sample", "rate": 0.1},
+                "list_*": {"mode": "aggregate"}
+            },
+            "security_actions": ["download_report"]
+        }
+
+    Las acciones relevantes para la seguridad (SECURITY_ACTION_KEYWORDS y
+    ``security_actions``) y los eventos con estado distinto de success se
+    escriben siempre completos. La política se relee de la base de datos cada
+    ``reload_interval`` segundos o tras ``invalidate()``.
+
+    Las filas muestreadas llevan ``sample_rate`` en details_json y las agregadas
+    ``event_count``, para que las estadísticas sigan contando eventos.
+    """
+
+    def __init__(self, reload_interval=30.0, aggregate_window=60):
+        """
+        Args:
+            reload_interval: Segundos entre lecturas de la política
+            aggregate_window: Segundos de cada ventana de agregación
+        """
+        self.reload_interval = reload_interval
+        self.aggregate_window = aggregate_window
+
+        self._rules = {}
+        self._prefix_rules = []
+        self._security_actions = set()
+        self._loaded_at = None
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            reload_interval=config.get('AUDIT_POLICY_RELOAD_INTERVAL', 30.0),
+            aggregate_window=config.get('AUDIT_AGGREGATE_WINDOW', 60)
+        )
+
+    def invalidate(self):
+        """
+        Fuerza la relectura de la política en el siguiente evento.
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, policy):
+        """
+        Valida y activa una política (diccionario con el formato de la clase).
+        """
+        rules, prefix_rules = {}, []
+
+        for action, rule in (policy or {}).get('actions', {}).items():
+            mode = rule.get('mode', MODE_FULL)
+            if mode not in POLICY_MODES:
+                logger.warning(f"Modo de auditoría no válido para {action}: {mode}")
+                continue
+
+            rule = {'mode': mode, 'rate': min(max(float(rule.get('rate', 1.0)), 0.0), 1.0)}
+            if mode == MODE_SAMPLE and rule['rate'] <= 0:
+                logger.warning(f"Tasa de muestreo no válida para {action}, se registra completa")
+                rule['mode'] = MODE_FULL
+
+            if action.endswith('*'):
+                prefix_rules.append((action[:-1], rule))
+            else:
+                rules[action] = rule
+
+        with self._lock:
+            self._rules = rules
+            # Los prefijos más largos tienen prioridad
+            self._prefix_rules = sorted(prefix_rules, key=lambda item: len(item[0]), reverse=True)
+            self._security_actions = set((policy or {}).get('security_actions', []))
+            self._loaded_at = time.monotonic()
+
+    def is_security_relevant(self, action):
+        action = action.lower()
+        return action in self._security_actions or any(
+            keyword in action for keyword in SECURITY_ACTION_KEYWORDS
+        )
+
+    def rule_for(self, action):
+        rule = self._rules.get(action)
+        if rule is not None:
+            return rule
+        for prefix, prefix_rule in self._prefix_rules:
+            if action.startswith(prefix):
+                return prefix_rule
+        return None
+
+    def apply(self, session, row):
+        """
+        Decide qué filas escribir para un evento.
+
+        Args:
+            session: Sesión de SQLAlchemy (para releer la política)
+            row: Evento como diccionario con las columnas de audit_logs
+
+        Returns:
+            Lista de filas a escribir: el propio evento (posiblemente marcado como
+            muestra) y/o los contadores de ventanas ya cerradas
+        """
+        self._maybe_reload(session)
+        rows = self.flush(now=row['created_at'])
+
+        rule = None
+        if row['status'] == 'success' and not self.is_security_relevant(row['action']):
+            rule = self.rule_for(row['action'])
+
+        if rule is None or rule['mode'] == MODE_FULL:
+            rows.append(row)
+        elif rule['mode'] == MODE_SAMPLE:
+            if rule['rate'] >= 1.0 or random.random() < rule['rate']:
+                if rule['rate'] < 1.0:
+                    row['details_json'] = dict(row['details_json'] or {}, sample_rate=rule['rate'])
+                rows.append(row)
+        else:
+            self._count(row)
+
+        return rows
+
+    def flush(self, now=None, force=False):
+        """
+        Devuelve las filas de los contadores cuya ventana ya terminó
+        (o todos con ``force``, p. ej. al detener la aplicación).
+        """
+        with self._lock:
+            closed = [
+                key for key in self._counters
+                if force or now is None or key[0] + timedelta(seconds=self.aggregate_window) <= now
+            ]
+            counters = [(key, self._counters.pop(key)) for key in closed]
+
+        return [self._aggregate_row(key, count) for key, count in counters]
+
+    def _count(self, row):
+        created_at = row['created_at']
+        seconds = (created_at.hour * 3600 + created_at.minute * 60 + created_at.second) % self.aggregate_window
+        window_start = created_at.replace(microsecond=0) - timedelta(seconds=seconds)
+        key = (window_start, row['user_id'], row['user_email'], row['user_role'], row['action'])
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def _aggregate_row(self, key, count):
+        window_start, user_id, user_email, user_role, action = key
+        window_end = window_start + timedelta(seconds=self.aggregate_window)
+        summary = {
+            'aggregated': True,
+            'event_count': count,
+            'window_start': window_start.isoformat(),
+            'window_end': window_end.isoformat()
+        }
+        return {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'user_email': user_email,
+            'user_role': user_role,
+            'action': action,
+            'details': json.dumps(summary),
+            'details_json': summary,
+            'ip_address': None,
+            'user_agent': None,
+            'status': 'success',
+            'created_at': window_start
+        }
+
+    def _maybe_reload(self, session):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.reload_interval:
+            return
+
+        try:
+            policy = SystemConfig.get_value(session, POLICY_CATEGORY, POLICY_KEY, {})
+        except Exception as e:
+            # Mantener la política anterior si la lectura falla
+            logger.error(f"Error al cargar la política de auditoría: {e}")
+            with self._lock:
+                self._loaded_at = time.monotonic()
+            return
+
+        self.load(policy if isinstance(policy, dict) else {})
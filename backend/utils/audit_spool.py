@@ -0,0 +1,306 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Nombre de los segmentos: audit-000000000001.seg
+SEGMENT_PREFIX = 'audit-'
+SEGMENT_SUFFIX = '.seg'
+# Eventos que la base de datos rechaza por su contenido; se revisan a mano
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+
+class AuditSpool:
+    """
+    Spool en disco local, de solo anexado, para eventos de auditoría.
+
+    Cuando la base de datos está saturada o caída los eventos se escriben como
+    líneas JSON en archivos de segmento. Las escrituras se sincronizan con
+    fsync por grupos (cada ``fsync_batch`` eventos o ``fsync_interval``
+    segundos), de modo que el costo de fsync no se paga por evento.
+
+    Un hilo de reproducción cierra el segmento activo, inserta los segmentos
+    cerrados en ``audit_logs`` por lotes con INSERT ... ON CONFLICT DO NOTHING
+    y elimina cada segmento solo después de confirmar la transacción; si el
+    proceso termina a mitad de un segmento, al reintentarlo no se duplican filas.
+    Las filas que la base de datos rechaza por su contenido (p. ej. DataError)
+    se apartan en ``dead-letter.jsonl`` para que no bloqueen los segmentos
+    siguientes.
+
+    Uso:
+        spool = AuditSpool.from_config(app.config).start_replayer(db.engine)
+        writer = AuditWriter.from_config(db.engine, app.config, spool=spool).start()
+    """
+
+    def __init__(self, directory, segment_max_bytes=16 * 1024 * 1024, fsync_batch=100,
+                 fsync_interval=0.2, replay_batch_size=1000, replay_interval=5.0):
+        """
+        Args:
+            directory: Directorio donde se guardan los segmentos
+            segment_max_bytes: Tamaño a partir del cual se abre un segmento nuevo
+            fsync_batch: Eventos escritos entre dos fsync
+            fsync_interval: Segundos máximos sin sincronizar eventos escritos
+            replay_batch_size: Filas por inserción al reproducir un segmento
+            replay_interval: Segundos entre intentos de reproducción
+        """
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.replay_batch_size = replay_batch_size
+        self.replay_interval = replay_interval
+
+        self.spooled = 0
+        self.replayed = 0
+        self.rejected = 0
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment_seq = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._thread = None
+        self._stop = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        existing = self._segments()
+        if existing:
+            self._segment_seq = self._segment_number(existing[-1])
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Crea el spool a partir de la configuración de la aplicación.
+        """
+        return cls(
+            config['AUDIT_SPOOL_DIR'],
+            segment_max_bytes=config.get('AUDIT_SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024),
+            fsync_batch=config.get('AUDIT_SPOOL_FSYNC_BATCH', 100),
+            fsync_interval=config.get('AUDIT_SPOOL_FSYNC_INTERVAL', 0.2),
+            replay_interval=config.get('AUDIT_SPOOL_REPLAY_INTERVAL', 5.0)
+        )
+
+    # Escritura
+
+    def append(self, rows):
+        """
+        Anexa eventos (diccionarios con las columnas de audit_logs) al segmento activo.
+        """
+        if not rows:
+            return
+
+        data = ''.join(json.dumps(row, default=_encode_value, ensure_ascii=False) + '\n' for row in rows)
+
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+
+            self._file.write(data.encode('utf-8'))
+            self._file.flush()
+            self._unsynced += len(rows)
+            self.spooled += len(rows)
+
+            if (self._unsynced >= self.fsync_batch
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+            if self._file.tell() >= self.segment_max_bytes:
+                self._close_segment()
+
+    def sync(self):
+        """
+        Fuerza el fsync de los eventos escritos y aún no sincronizados.
+        """
+        with self._lock:
+            self._sync()
+
+    def dead_letter(self, rows, error):
+        """
+        Aparta eventos que no se pueden insertar por su contenido, con el error.
+        """
+        data = ''.join(
+            json.dumps({'error': str(error), 'row': row}, default=_encode_value, ensure_ascii=False) + '\n'
+            for row in rows
+        )
+        with self._lock:
+            with open(os.path.join(self.directory, DEAD_LETTER_FILE), 'ab') as dead_letter:
+                dead_letter.write(data.encode('utf-8'))
+                dead_letter.flush()
+                os.fsync(dead_letter.fileno())
+            self.rejected += len(rows)
+        logger.error(f"{len(rows)} eventos de auditoría apartados en {DEAD_LETTER_FILE}: {error}")
+
+    @property
+    def pending_segments(self):
+        return len(self._segments())
+
+    def _open_segment(self):
+        self._segment_seq += 1
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._segment_seq:012d}{SEGMENT_SUFFIX}")
+        self._file = open(path, 'ab')
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._sync()
+        self._file.close()
+        self._file = None
+
+    def _segments(self):
+        names = [
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        ]
+        return sorted(names, key=self._segment_number)
+
+    @staticmethod
+    def _segment_number(name):
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    # Reproducción
+
+    def start_replayer(self, engine, integrity=None):
+        """
+        Inicia el hilo que vacía los segmentos en la base de datos.
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self
+
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run_replayer, args=(engine, integrity),
+                name='audit-spool-replayer', daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        """
+        Detiene el hilo de reproducción y sincroniza el segmento activo.
+        """
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        with self._lock:
+            self._close_segment()
+
+    def replay(self, engine, integrity=None):
+        """
+        Inserta en la base de datos todos los segmentos cerrados.
+
+        El segmento activo se cierra primero para incluir los eventos recientes.
+        Solo se reproducen los segmentos cerrados hasta ese momento: los que se
+        abran mientras tanto siguen recibiendo escrituras y esperan a la
+        siguiente pasada.
+
+        Returns:
+            Número de filas insertadas (sin contar duplicados ya presentes)
+        """
+        with self._lock:
+            if self._file is not None and self._file.tell() > 0:
+                self._close_segment()
+            last_closed = self._segment_seq if self._file is None else self._segment_seq - 1
+
+        inserted = 0
+        for name in self._segments():
+            if self._segment_number(name) > last_closed:
+                break
+
+            path = os.path.join(self.directory, name)
+            for batch in self._read_batches(path):
+                inserted += self._replay_batch(engine, batch, integrity)
+
+            os.remove(path)
+            logger.info(f"Segmento de auditoría {name} reproducido")
+
+        with self._lock:
+            self.replayed += inserted
+        return inserted
+
+    def _replay_batch(self, engine, batch, integrity):
+        from utils.audit_writer import TRANSIENT_ERRORS, write_audit_rows
+
+        try:
+            with engine.begin() as conn:
+                return len(write_audit_rows(conn, batch, integrity, skip_duplicates=True))
+        except TRANSIENT_ERRORS:
+            # Base de datos no disponible: el segmento se reintenta completo más tarde
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                self.dead_letter(batch, e)
+                return 0
+
+        # Lote rechazado por su contenido: reintentar fila por fila para aislar las inválidas
+        return sum(self._replay_batch(engine, [row], integrity) for row in batch)
+
+    def _read_batches(self, path):
+        batch = []
+        with open(path, 'rb') as segment:
+            for number, line in enumerate(segment, 1):
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # Última línea incompleta por una caída durante la escritura
+                    logger.warning(f"Línea {number} inválida en {path}, se omite")
+                    continue
+
+                row['created_at'] = datetime.fromisoformat(row['created_at'])
+                batch.append(row)
+                if len(batch) >= self.replay_batch_size:
+                    yield batch
+                    batch = []
+
+        if batch:
+            yield batch
+
+    def _run_replayer(self, engine, integrity):
+        delay = self.replay_interval
+        next_replay = time.monotonic() + delay
+
+        # Se despierta al menos cada fsync_interval para que ningún evento escrito
+        # quede sin sincronizar más de ese tiempo, aunque no lleguen más escrituras
+        while not self._stop.wait(self._replayer_wait(next_replay)):
+            with self._lock:
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+
+            if time.monotonic() < next_replay:
+                continue
+
+            try:
+                if self._segments():
+                    inserted = self.replay(engine, integrity)
+                    if inserted:
+                        logger.info(f"Reproducidos {inserted} eventos de auditoría desde el spool")
+                delay = self.replay_interval
+            except Exception as e:
+                # Base de datos aún no disponible: reintentar con espera creciente
+                delay = min(delay * 2, 60.0)
+                logger.warning(f"No se pudo reproducir el spool de auditoría: {e}")
+            next_replay = time.monotonic() + delay
+
+    def _replayer_wait(self, next_replay):
+        now = time.monotonic()
+        wait = min(self.fsync_interval, next_replay - now)
+        with self._lock:
+            if self._unsynced:
+                wait = min(wait, self._last_sync + self.fsync_interval - now)
+        return max(wait, 0)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
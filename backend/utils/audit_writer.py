@@ -0,0 +1,320 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from models.audit_log import AuditLog, AuditStatsDaily
+
+logger = logging.getLogger(__name__)
+
+# Políticas cuando la cola de auditoría está llena
+OVERFLOW_BLOCK = 'block'  # esperar hasta block_timeout y después escribir de forma síncrona
+OVERFLOW_DROP = 'drop'    # descartar el evento (se contabiliza en dropped)
+OVERFLOW_SYNC = 'sync'    # el llamador escribe el evento de inmediato en su transacción
+OVERFLOW_SPOOL = 'spool'  # escribir el evento en el spool en disco (utils.audit_spool)
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_SYNC, OVERFLOW_SPOOL)
+
+# Errores de conexión o disponibilidad: el lote se puede reintentar más tarde.
+# Cualquier otro error (DataError, IntegrityError...) se repetiría en cada intento.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+_STOP = object()
+
+
+def write_audit_rows(conn, rows, integrity=None, skip_duplicates=False):
+    """
+    Inserta un lote de eventos y actualiza los contadores diarios y el checkpoint
+    de integridad dentro de la transacción de ``conn``.
+
+    Args:
+        conn: Conexión con una transacción abierta
+        rows: Diccionarios con las columnas de audit_logs
+        integrity: AuditIntegrity para sellar el lote (opcional)
+        skip_duplicates: Omitir filas ya existentes (reproducción del spool)
+
+    Returns:
+        Lista de las filas efectivamente insertadas
+    """
+    checkpoint = None
+    if integrity is not None:
+        checkpoint = integrity.begin(conn)
+        rows = [dict(row, checkpoint_seq=checkpoint.seq) for row in rows]
+
+    table = AuditLog.__table__
+    if skip_duplicates:
+        statement = insert(table).values(rows).on_conflict_do_nothing(
+            index_elements=['id', 'created_at']
+        ).returning(table.c.id)
+        inserted_ids = set(conn.execute(statement).scalars())
+        rows = [row for row in rows if row['id'] in inserted_ids]
+    else:
+        conn.execute(table.insert(), rows)
+
+    if rows:
+        AuditStatsDaily.increment(conn, rows)
+        if checkpoint is not None:
+            integrity.commit(conn, checkpoint, rows)
+    return rows
+
+
+class AuditWriter:
+    """
+    Escritor de auditoría con búfer en memoria y escritura por lotes.
+
+    Los eventos se encolan en una cola acotada y un hilo en segundo plano los
+    inserta en ``audit_logs`` con un único INSERT de varias filas por lote, al
+    alcanzar ``batch_size`` eventos o pasados ``flush_interval`` segundos desde
+    el primer evento pendiente. Al terminar el proceso se vacía la cola.
+
+    Con un ``spool`` configurado, los lotes que no se pueden escribir por un
+    error de conexión (y los eventos que no caben en la cola con la política
+    spool) se guardan en disco y se reproducen cuando la base de datos se
+    recupera. Si la base de datos rechaza un lote por su contenido, se
+    reintenta fila por fila y solo las filas inválidas se apartan.
+
+    Si ``AuditLog`` tiene una política de agregación (``policy``), el hilo
+    escribe cada ``flush_interval`` segundos los contadores cuya ventana ya
+    terminó, aunque no lleguen más eventos, y todos los pendientes al detenerse.
+
+    Uso:
+        writer = AuditWriter.from_config(db.engine, app.config).start()
+        AuditLog.set_writer(writer)
+    """
+
+    def __init__(self, engine, max_queue_size=10000, batch_size=500, flush_interval=1.0,
+                 overflow_policy=OVERFLOW_BLOCK, block_timeout=1.0, integrity=None, spool=None):
+        """
+        Args:
+            engine: Engine de SQLAlchemy usado para las inserciones
+            max_queue_size: Número máximo de eventos pendientes en memoria
+            batch_size: Número de eventos por inserción
+            flush_interval: Segundos máximos que un evento espera en la cola
+            overflow_policy: Qué hacer con la cola llena (block, drop, sync)
+            block_timeout: Segundos de espera con la política block
+            integrity: AuditIntegrity para sellar cada lote con un checkpoint (opcional)
+            spool: AuditSpool para los eventos que no se pueden escribir (opcional)
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desbordamiento no válida: {overflow_policy}")
+        if overflow_policy == OVERFLOW_SPOOL and spool is None:
+            raise ValueError("La política spool requiere un AuditSpool")
+
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.integrity = integrity
+        self.spool = spool
+        # Política de utils.audit_policy; la asigna AuditLog.set_policy/set_writer
+        self.policy = None
+
+        self.dropped = 0
+        self.written = 0
+        self.spooled = 0
+        self.rejected = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, engine, config, integrity=None, spool=None):
+        """
+        Crea el escritor a partir de la configuración de la aplicación.
+        """
+        return cls(
+            engine,
+            max_queue_size=config.get('AUDIT_QUEUE_SIZE', 10000),
+            batch_size=config.get('AUDIT_BATCH_SIZE', 500),
+            flush_interval=config.get('AUDIT_FLUSH_INTERVAL', 1.0),
+            overflow_policy=config.get('AUDIT_OVERFLOW_POLICY', OVERFLOW_BLOCK),
+            block_timeout=config.get('AUDIT_BLOCK_TIMEOUT', 1.0),
+            integrity=integrity,
+            spool=spool
+        )
+
+    def start(self):
+        """
+        Inicia el hilo de escritura y registra el vaciado de la cola al salir.
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self
+
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def enqueue(self, row):
+        """
+        Encola un evento de auditoría (diccionario con las columnas de audit_logs).
+
+        Returns:
+            bool: True si el evento se encoló o se escribió. False si no se aceptó:
+            con la política sync el llamador debe escribirlo (ver sync_fallback);
+            con las demás se descartó y se contabilizó en dropped o rejected
+        """
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            try:
+                self._queue.put(row, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                logger.warning("Cola de auditoría llena, escribiendo el evento de forma síncrona")
+                return self._write_batch([row])
+
+        if self.overflow_policy == OVERFLOW_SYNC:
+            return False
+
+        if self.overflow_policy == OVERFLOW_SPOOL:
+            return self._spool([row])
+
+        with self._lock:
+            self.dropped += 1
+        logger.warning("Cola de auditoría llena, evento descartado")
+        return False
+
+    def flush(self, timeout=None):
+        """
+        Espera a que se escriban los eventos encolados hasta el momento.
+        """
+        done = threading.Event()
+        self._queue.put(done, timeout=timeout)
+        return done.wait(timeout)
+
+    def stop(self, timeout=10.0):
+        """
+        Escribe los eventos pendientes y detiene el hilo de escritura.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+
+        if not thread or not thread.is_alive():
+            return
+
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error("El escritor de auditoría no terminó de vaciar la cola a tiempo")
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    @property
+    def sync_fallback(self):
+        """
+        Si los eventos que enqueue() no acepta deben escribirse en la
+        transacción del llamador (solo con la política sync).
+        """
+        return self.overflow_policy == OVERFLOW_SYNC
+
+    def _run(self):
+        batch = []
+        deadline = None
+        next_policy_flush = time.monotonic() + self.flush_interval
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if self.policy is not None:
+                # Despertar también para emitir las ventanas de agregación cerradas
+                policy_timeout = max(next_policy_flush - time.monotonic(), 0)
+                timeout = policy_timeout if timeout is None else min(timeout, policy_timeout)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                if self.policy is not None:
+                    batch.extend(self.policy.flush(force=True))
+                self._write_batch(batch)
+                return
+
+            if self.policy is not None and time.monotonic() >= next_policy_flush:
+                next_policy_flush = time.monotonic() + self.flush_interval
+                closed = self.policy.flush(now=datetime.utcnow())
+                if closed:
+                    batch.extend(closed)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+            if isinstance(item, threading.Event):
+                self._write_batch(batch)
+                batch, deadline = [], None
+                item.set()
+                continue
+
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if len(batch) >= self.batch_size or (deadline is not None and time.monotonic() >= deadline):
+                self._write_batch(batch)
+                batch, deadline = [], None
+
+    def _write_batch(self, rows):
+        if not rows:
+            return True
+
+        try:
+            with self.engine.begin() as conn:
+                write_audit_rows(conn, rows, self.integrity)
+        except TRANSIENT_ERRORS as e:
+            logger.error(f"Error al escribir lote de auditoría ({len(rows)} eventos): {e}")
+            if self.spool is not None:
+                return self._spool(rows)
+            with self._lock:
+                self.dropped += len(rows)
+            return False
+        except Exception as e:
+            if len(rows) == 1:
+                self._reject(rows, e)
+                return False
+            # Lote rechazado por su contenido: aislar las filas inválidas
+            logger.warning(f"Lote de auditoría rechazado ({len(rows)} eventos), reintentando fila por fila: {e}")
+            results = [self._write_batch([row]) for row in rows]
+            return all(results)
+
+        with self._lock:
+            self.written += len(rows)
+        return True
+
+    def _reject(self, rows, error):
+        with self._lock:
+            self.rejected += len(rows)
+        if self.spool is not None:
+            try:
+                self.spool.dead_letter(rows, error)
+                return
+            except OSError as e:
+                logger.error(f"Error al escribir en el archivo de eventos rechazados: {e}")
+        logger.error(f"Evento de auditoría rechazado por la base de datos ({error}): {rows}")
+
+    def _spool(self, rows):
+        try:
+            self.spool.append(rows)
+        except OSError as e:
+            logger.error(f"Error al escribir {len(rows)} eventos en el spool de auditoría: {e}")
+            with self._lock:
+                self.dropped += len(rows)
+            return False
+
+        with self._lock:
+            self.spooled += len(rows)
+        return True
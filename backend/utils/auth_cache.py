@@ -0,0 +1,200 @@
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Mapper
+
+# Configuración de la caché de tokens verificados
+AUTH_CACHE_MAX_SIZE = int(os.environ.get('AUTH_CACHE_MAX_SIZE') or 1024)
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL') or 300)  # segundos
+# Margen para no servir desde la caché un token a punto de expirar
+AUTH_CACHE_EXPIRY_MARGIN = 5
+# Modelo cuyos cambios de rol o estado invalidan la caché (se importa de forma diferida)
+USER_MODEL = 'models.user.User'
+
+
+class AuthenticatedUser:
+    """
+    Copia inmutable de los datos del usuario necesarios para autorizar peticiones.
+
+    Se usa en lugar de la instancia ORM para que pueda compartirse entre
+    peticiones sin depender de una sesión de SQLAlchemy.
+    """
+    __slots__ = ('id', 'email', 'name', 'role', 'area', 'status')
+
+    def __init__(self, id, email=None, name=None, role=None, area=None, status=None):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.role = role
+        self.area = area
+        self.status = status
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            email=getattr(user, 'email', None),
+            name=getattr(user, 'name', None),
+            role=getattr(user, 'role', None),
+            area=getattr(user, 'area', None),
+            status=getattr(user, 'status', None)
+        )
+
+
+class PrincipalCache:
+    """
+    Caché LRU acotada de tokens ya verificados y el usuario al que pertenecen.
+
+    La clave es la firma del JWT; cada entrada guarda el token completo para
+    compararlo y expira a los ``ttl`` segundos o al expirar el token, lo que
+    ocurra primero.
+
+    Al cambiar el rol o el estado de un usuario (o eliminarlo) se invalidan
+    sus entradas en el proceso que hace el cambio y se publica un NOTIFY en el
+    canal de permisos; los demás procesos lo aplican si tienen activo
+    ``start_permission_listener()``. Sin él, un usuario desactivado o con otro
+    rol puede seguir autenticándose en otros procesos hasta ``ttl`` segundos.
+    """
+
+    def __init__(self, max_size=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return token.rsplit('.', 1)[-1]
+
+    def get(self, token):
+        """
+        Devuelve (payload, usuario) si el token está en caché y vigente, o None.
+        """
+        key = self._key(token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry['expires_at'] <= now or not hmac.compare_digest(entry['token'], token):
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry['payload'], entry['principal']
+
+    def put(self, token, payload, principal):
+        expires_at = time.time() + self.ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, float(payload['exp']) - AUTH_CACHE_EXPIRY_MARGIN)
+
+        with self._lock:
+            self._entries[self._key(token)] = {
+                'token': token,
+                'payload': payload,
+                'principal': principal,
+                'expires_at': expires_at
+            }
+            self._entries.move_to_end(self._key(token))
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """
+        Descarta todas las entradas de un usuario (p. ej. al cambiar su rol o estado).
+        """
+        # Las notificaciones de otros procesos traen el id como texto
+        user_id = str(user_id)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if str(entry['principal'].id) == user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Caché compartida por los blueprints que autentican con JWT
+principal_cache = PrincipalCache()
+
+
+def authenticate(token):
+    """
+    Verifica un JWT y obtiene el usuario autenticado, usando la caché compartida.
+
+    Args:
+        token: JWT recibido en la cabecera Authorization
+
+    Returns:
+        tuple: (payload del token, AuthenticatedUser)
+
+    Raises:
+        jwt.InvalidTokenError: si el token no es válido o el usuario no existe
+    """
+    cached = principal_cache.get(token)
+    if cached:
+        return cached
+
+    data = jwt.decode(token, os.environ.get('SECRET_KEY', 'casamonarca_secret_key'), algorithms=["HS256"])
+
+    from models.user import User
+
+    user = User.query.filter_by(id=data['user_id']).first()
+    if not user:
+        raise jwt.InvalidTokenError('User not found')
+
+    principal = AuthenticatedUser.from_user(user)
+    principal_cache.put(token, data, principal)
+    return data, principal
+
+
+def invalidate_user(user_id):
+    """
+    Invalida las credenciales en caché de un usuario.
+    """
+    principal_cache.invalidate_user(user_id)
+
+
+def _is_user_mapper(mapper):
+    model = mapper.class_
+    return f"{model.__module__}.{model.__qualname__}" == USER_MODEL
+
+
+def _user_changed(connection, user_id):
+    """
+    Invalida la caché local y avisa a los demás procesos. El NOTIFY forma parte
+    de la transacción del cambio, por lo que solo se entrega si se confirma.
+    """
+    from models.permissions import PERMISSIONS_CHANNEL, USER_CHANGED_PREFIX
+
+    invalidate_user(user_id)
+    connection.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {'channel': PERMISSIONS_CHANNEL, 'payload': f"{USER_CHANGED_PREFIX}{user_id}"}
+    )
+
+
+# Los listeners se registran sobre todos los mappers al importar el módulo, sin
+# esperar a la primera autenticación, y filtran por el modelo de usuario
+@event.listens_for(Mapper, 'after_update')
+def _after_user_update(mapper, connection, target):
+    if not _is_user_mapper(mapper):
+        return
+    state = inspect(target)
+    if state.attrs.role.history.has_changes() or state.attrs.status.history.has_changes():
+        _user_changed(connection, target.id)
+
+
+@event.listens_for(Mapper, 'after_delete')
+def _after_user_delete(mapper, connection, target):
+    if _is_user_mapper(mapper):
+        _user_changed(connection, target.id)
@@ -0,0 +1,357 @@
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+from utils.email_service import EmailService
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de entrega (mayor primero)
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10  # códigos de verificación y otros correos que bloquean al usuario
+
+DEFAULT_MAX_ATTEMPTS = 8
+
+# Despierta a los workers de este proceso al encolar un mensaje
+_wakeup = threading.Event()
+
+
+def queue_email(dsn, to, subject, html, text=None, priority=PRIORITY_NORMAL, expires_at=None,
+                max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Encola un correo en email_outbox para que lo entreguen los workers.
+
+    Args:
+        dsn: Cadena de conexión a PostgreSQL
+        to: Destinatario
+        subject: Asunto
+        html: Cuerpo HTML ya renderizado
+        text: Alternativa en texto plano (opcional)
+        priority: Prioridad de entrega
+        expires_at: Momento tras el cual el correo ya no se envía (opcional)
+        max_attempts: Intentos antes de pasar el mensaje a 'dead'
+
+    Returns:
+        int: ID del mensaje encolado
+    """
+    # Las fechas de la bandeja se guardan en UTC, igual que el resto del sistema
+    now = datetime.utcnow()
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO email_outbox
+                    (recipient, subject, body_html, body_text, priority, expires_at, max_attempts,
+                     next_attempt_at, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (to, subject, html, text, priority, expires_at, max_attempts, now, now))
+            message_id = cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+    _wakeup.set()
+    return message_id
+
+
+def queue_emails(dsn, messages, priority=PRIORITY_NORMAL, expires_at=None,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Encola varios correos en una sola transacción (envíos masivos).
+
+    Args:
+        dsn: Cadena de conexión a PostgreSQL
+        messages: Lista de tuplas (destinatario, asunto, HTML, texto plano)
+        priority: Prioridad de entrega
+        expires_at: Momento tras el cual los correos ya no se envían (opcional)
+        max_attempts: Intentos antes de pasar un mensaje a 'dead'
+
+    Returns:
+        int: Número de mensajes encolados
+    """
+    if not messages:
+        return 0
+
+    now = datetime.utcnow()
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn, conn.cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO email_outbox
+                    (recipient, subject, body_html, body_text, priority, expires_at, max_attempts,
+                     next_attempt_at, created_at)
+                VALUES %s
+            """, [
+                (to, subject, html, text, priority, expires_at, max_attempts, now, now)
+                for to, subject, html, text in messages
+            ], page_size=500)
+    finally:
+        conn.close()
+
+    _wakeup.set()
+    return len(messages)
+
+
+def retry_dead_emails(dsn, ids=None):
+    """
+    Devuelve a la cola los mensajes en 'dead' (todos o los indicados).
+
+    Returns:
+        int: Número de mensajes reencolados
+    """
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE email_outbox
+                SET status = 'pending', attempts = 0, next_attempt_at = %(now)s, expires_at = NULL
+                WHERE status = 'dead'
+                AND (%(ids)s IS NULL OR id = ANY(%(ids)s))
+            """, {'ids': list(ids) if ids is not None else None, 'now': datetime.utcnow()})
+            count = cursor.rowcount
+    finally:
+        conn.close()
+
+    _wakeup.set()
+    return count
+
+
+class EmailOutboxWorker:
+    """
+    Workers que entregan los correos de email_outbox.
+
+    Cada hilo reserva lotes con FOR UPDATE SKIP LOCKED, de modo que varios
+    hilos y procesos entregan en paralelo sin tomar el mismo mensaje. Un envío
+    fallido se reprograma con espera exponencial (con jitter) y, al agotar los
+    intentos o pasar ``expires_at``, el mensaje queda en 'dead'. Si un worker
+    muere con mensajes reservados, se liberan al vencer ``lease_seconds``.
+
+    La reserva se renueva justo antes de enviar cada mensaje del lote y solo
+    el hilo que la tiene (``locked_by``) puede enviarlo y cerrarlo, de modo
+    que un mensaje cuya reserva venció y retomó otro worker no se envía dos
+    veces.
+
+    Con MAIL_USE_OUTBOX activo lo inicia init_email(app) de utils/email_service.py:
+        EmailOutboxWorker.from_config(app.config).start()
+    """
+
+    def __init__(self, dsn, mail_config, concurrency=4, batch_size=10, poll_interval=5.0,
+                 lease_seconds=120, base_delay=30, max_delay=3600):
+        """
+        Args:
+            dsn: Cadena de conexión a PostgreSQL
+            mail_config: Configuración de correo (MAIL_*) usada para el envío
+            concurrency: Número de hilos de entrega
+            batch_size: Mensajes reservados por cada hilo en cada consulta
+            poll_interval: Segundos entre consultas cuando la cola está vacía
+            lease_seconds: Segundos que un mensaje queda reservado por un worker
+            base_delay: Espera antes del primer reintento en segundos
+            max_delay: Espera máxima entre reintentos en segundos
+        """
+        self.dsn = dsn
+        self.mail_config = mail_config
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.sent = 0
+        self.failed = 0
+
+        # Identificador de esta instancia; cada hilo añade su índice
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Crea los workers a partir de la configuración de la aplicación.
+        """
+        return cls(
+            config['SQLALCHEMY_DATABASE_URI'],
+            {key: value for key, value in config.items() if key.startswith('MAIL_')},
+            concurrency=config.get('EMAIL_OUTBOX_WORKERS', 4),
+            batch_size=config.get('EMAIL_OUTBOX_BATCH_SIZE', 10),
+            poll_interval=config.get('EMAIL_OUTBOX_POLL_INTERVAL', 5.0),
+            base_delay=config.get('EMAIL_OUTBOX_RETRY_DELAY', 30),
+            max_delay=config.get('EMAIL_OUTBOX_MAX_RETRY_DELAY', 3600)
+        )
+
+    def start(self):
+        """
+        Inicia los hilos de entrega.
+        """
+        with self._lock:
+            if any(thread.is_alive() for thread in self._threads):
+                return self
+
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(
+                    target=self._run, args=(f"{self.worker_id}/{index}",),
+                    name=f'email-outbox-{index}', daemon=True
+                )
+                for index in range(self.concurrency)
+            ]
+            for thread in self._threads:
+                thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        """
+        Detiene los hilos tras terminar el lote en curso.
+        """
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_once(self, conn, owner=None):
+        """
+        Reserva y entrega un lote de mensajes.
+
+        Args:
+            conn: Conexión a PostgreSQL
+            owner: Identificador con el que se reservan los mensajes
+
+        Returns:
+            int: Número de mensajes procesados
+        """
+        owner = owner or self.worker_id
+        messages = self._claim(conn, owner)
+        for message in messages:
+            self._deliver(conn, message, owner)
+        return len(messages)
+
+    def retry_delay(self, attempts):
+        """
+        Segundos de espera antes del siguiente intento (exponencial con jitter).
+        """
+        delay = min(self.base_delay * (2 ** max(attempts - 1, 0)), self.max_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    def _run(self, owner):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(self.dsn)
+
+                if self.run_once(conn, owner):
+                    continue
+            except Exception:
+                # Cualquier error se registra y el hilo sigue vivo con una conexión nueva
+                logger.exception("Error en el worker de correo")
+                if conn is not None:
+                    conn.close()
+                conn = None
+
+            # Cola vacía o error: esperar al siguiente mensaje encolado o al intervalo
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
+
+        if conn is not None:
+            conn.close()
+
+    def _claim(self, conn, owner):
+        now = datetime.utcnow()
+        with conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                UPDATE email_outbox
+                SET status = 'sending',
+                    attempts = attempts + 1,
+                    locked_until = %(locked_until)s,
+                    locked_by = %(owner)s
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= %(now)s)
+                    OR (status = 'sending' AND locked_until < %(now)s)
+                    ORDER BY priority DESC, next_attempt_at
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, recipient, subject, body_html, body_text, attempts, max_attempts, expires_at
+            """, {
+                'now': now,
+                'locked_until': now + timedelta(seconds=self.lease_seconds),
+                'owner': owner,
+                'limit': self.batch_size
+            })
+            return cursor.fetchall()
+
+    def _renew_lease(self, conn, message_id, owner):
+        """
+        Extiende la reserva de un mensaje antes de enviarlo. Devuelve False si
+        la reserva ya venció y el mensaje lo tomó otro worker.
+        """
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE email_outbox
+                SET locked_until = %s
+                WHERE id = %s AND status = 'sending' AND locked_by = %s
+            """, (datetime.utcnow() + timedelta(seconds=self.lease_seconds), message_id, owner))
+            return cursor.rowcount == 1
+
+    def _deliver(self, conn, message, owner):
+        if message['expires_at'] is not None and message['expires_at'] <= datetime.utcnow():
+            self._mark_dead(conn, message['id'], owner, 'El mensaje expiró antes de entregarse')
+            return
+
+        if not self._renew_lease(conn, message['id'], owner):
+            logger.warning(f"La reserva del correo {message['id']} venció antes del envío; lo entrega otro worker")
+            return
+
+        try:
+            EmailService.deliver(
+                self.mail_config, message['recipient'], message['subject'],
+                message['body_html'], message['body_text']
+            )
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+
+            if message['attempts'] >= message['max_attempts']:
+                logger.error(f"Correo {message['id']} descartado tras {message['attempts']} intentos: {e}")
+                self._mark_dead(conn, message['id'], owner, str(e))
+                return
+
+            next_attempt = datetime.utcnow() + timedelta(seconds=self.retry_delay(message['attempts']))
+            logger.warning(f"Error al enviar el correo {message['id']} (intento {message['attempts']}): {e}")
+            with conn, conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE email_outbox
+                    SET status = 'pending', locked_until = NULL, locked_by = NULL,
+                        next_attempt_at = %s, last_error = %s
+                    WHERE id = %s AND locked_by = %s
+                """, (next_attempt, str(e), message['id'], owner))
+            return
+
+        with self._lock:
+            self.sent += 1
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE email_outbox
+                SET status = 'sent', locked_until = NULL, locked_by = NULL, sent_at = %s, last_error = NULL
+                WHERE id = %s AND locked_by = %s
+            """, (datetime.utcnow(), message['id'], owner))
+
+    @staticmethod
+    def _mark_dead(conn, message_id, owner, error):
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE email_outbox
+                SET status = 'dead', locked_until = NULL, locked_by = NULL, last_error = %s
+                WHERE id = %s AND locked_by = %s
+            """, (error, message_id, owner))
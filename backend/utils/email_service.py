@@ -1,56 +1,354 @@
+import atexit
 import smtplib
+import logging
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import os
 from flask import current_app
 
+from utils.email_templates import email_templates, load_email_templates
+
+logger = logging.getLogger(__name__)
+
+# Errores tras los que la conexión se descarta y el envío se reintenta con otra
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SMTPConnectionPool:
+    """
+    Pool de conexiones SMTP autenticadas y reutilizables.
+    
+    Cada conexión hace STARTTLS y LOGIN una sola vez y se reutiliza para varios
+    mensajes. Antes de reutilizar una conexión inactiva más de ``noop_after``
+    segundos se comprueba con NOOP; las conexiones caídas se reemplazan y el
+    envío se reintenta una vez con una conexión nueva. Es seguro usarlo desde
+    varios hilos: cada conexión la usa un solo hilo a la vez.
+    """
+    
+    def __init__(self, host, port, username=None, password=None, use_tls=True, max_size=4,
+                 max_idle=240, noop_after=10, max_messages=100, timeout=30):
+        """
+        Args:
+            host: Servidor SMTP
+            port: Puerto SMTP
+            username: Usuario para LOGIN (None para no autenticar)
+            password: Contraseña para LOGIN
+            use_tls: Usar STARTTLS
+            max_size: Número máximo de conexiones abiertas a la vez
+            max_idle: Segundos de inactividad tras los que una conexión se cierra
+            noop_after: Segundos de inactividad tras los que se verifica con NOOP
+            max_messages: Mensajes enviados por conexión antes de renovarla
+            timeout: Timeout de red en segundos
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.max_idle = max_idle
+        self.noop_after = noop_after
+        self.max_messages = max_messages
+        self.timeout = timeout
+        
+        self.connections_opened = 0
+        self.messages_sent = 0
+        
+        self._idle = []  # [(servidor, último uso, mensajes enviados)]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+    
+    def send(self, sender, recipients, message):
+        """
+        Envía un mensaje ya serializado usando una conexión del pool.
+        
+        Raises:
+            smtplib.SMTPException: si el servidor rechaza el mensaje
+        """
+        with self._slots:
+            server, sent = self._acquire()
+            try:
+                server.sendmail(sender, recipients, message)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # El servidor respondió con un rechazo del mensaje: la conexión sigue siendo válida
+                self._release(server, sent)
+                raise
+            except RECONNECT_ERRORS as e:
+                # La conexión se cerró del lado del servidor: reintentar con una nueva
+                logger.warning(f"Conexión SMTP perdida, reintentando con una nueva: {e}")
+                self._close(server)
+                server, sent = self._connect(), 0
+                try:
+                    server.sendmail(sender, recipients, message)
+                except Exception:
+                    self._close(server)
+                    raise
+            except Exception:
+                self._close(server)
+                raise
+            
+            self._release(server, sent + 1)
+            with self._lock:
+                self.messages_sent += 1
+    
+    def close_all(self):
+        """
+        Cierra las conexiones inactivas (p. ej. al detener la aplicación).
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _, _ in idle:
+            self._close(server)
+    
+    def _acquire(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used, sent = self._idle.pop()
+            
+            if now - last_used > self.max_idle:
+                self._close(server)
+                continue
+            if now - last_used > self.noop_after and not self._is_alive(server):
+                self._close(server)
+                continue
+            return server, sent
+        
+        return self._connect(), 0
+    
+    def _release(self, server, sent):
+        if sent >= self.max_messages:
+            self._close(server)
+            return
+        with self._lock:
+            self._idle.append((server, time.monotonic(), sent))
+    
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        
+        with self._lock:
+            self.connections_opened += 1
+        return server
+    
+    @staticmethod
+    def _is_alive(server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+    
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_pool(config):
+    """
+    Obtiene el pool SMTP compartido para la configuración de correo indicada.
+    """
+    key = (config['MAIL_SERVER'], config['MAIL_PORT'], config['MAIL_USERNAME'])
+    
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SMTPConnectionPool(
+                config['MAIL_SERVER'],
+                config['MAIL_PORT'],
+                config['MAIL_USERNAME'],
+                config['MAIL_PASSWORD'],
+                max_size=config.get('MAIL_POOL_SIZE', 4),
+                max_idle=config.get('MAIL_POOL_MAX_IDLE', 240),
+                max_messages=config.get('MAIL_POOL_MAX_MESSAGES', 100)
+            )
+            _pools[key] = pool
+            atexit.register(pool.close_all)
+        return pool
+
+
+def init_email(app):
+    """
+    Prepara el envío de correo al iniciar la aplicación (llamar una vez por proceso).
+    
+    Compila las plantillas de templates/email según MAIL_INLINE_CSS, para que
+    ninguna petición pague la compilación, y con MAIL_USE_OUTBOX activo inicia
+    los workers de la bandeja de salida; sin ellos los correos encolados,
+    incluidos los códigos 2FA, nunca se envían.
+    
+    Returns:
+        EmailOutboxWorker iniciado, o None si la bandeja de salida está desactivada
+    """
+    load_email_templates(inline_css=app.config.get('MAIL_INLINE_CSS', True))
+    
+    worker = None
+    if app.config.get('MAIL_USE_OUTBOX', False):
+        from utils.email_outbox import EmailOutboxWorker
+        worker = EmailOutboxWorker.from_config(app.config).start()
+        atexit.register(worker.stop)
+    
+    app.extensions['email_outbox'] = worker
+    return worker
+
+
 class EmailService:
     @staticmethod
-    def send_email(to, subject, template, **kwargs):
+    def send_email(to, subject, template, priority=0, expires_at=None, **kwargs):
         """
         Envía un correo electrónico utilizando la configuración de la aplicación.
         
+        Con MAIL_USE_OUTBOX activo el correo solo se encola en email_outbox y lo
+        entregan los workers de utils/email_outbox.py (iniciados por
+        init_email(app)); la petición no espera al servidor SMTP. Sin él
+        (por defecto) el correo se envía de inmediato.
+        
         Args:
             to: Destinatario del correo
             subject: Asunto del correo
             template: Plantilla HTML del correo
+            priority: Prioridad de entrega en la bandeja de salida
+            expires_at: Momento tras el cual ya no tiene sentido entregarlo (UTC)
             **kwargs: Variables para la plantilla
         
         Returns:
-            bool: True si el correo se envió correctamente, False en caso contrario
+            bool: True si el correo se encoló o envió correctamente, False en caso contrario
         """
         try:
-            # Configuración del servidor SMTP
-            mail_server = current_app.config['MAIL_SERVER']
-            mail_port = current_app.config['MAIL_PORT']
-            mail_username = current_app.config['MAIL_USERNAME']
-            mail_password = current_app.config['MAIL_PASSWORD']
-            mail_sender = current_app.config['MAIL_DEFAULT_SENDER']
-            
-            # Crear mensaje
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = mail_sender
-            msg['To'] = to
-            
             # Renderizar plantilla con variables
             html = template.format(**kwargs)
-            
-            # Adjuntar contenido HTML
-            part = MIMEText(html, 'html')
-            msg.attach(part)
-            
-            # Conectar al servidor SMTP y enviar correo
-            with smtplib.SMTP(mail_server, mail_port) as server:
-                server.starttls()
-                server.login(mail_username, mail_password)
-                server.sendmail(mail_sender, to, msg.as_string())
-            
+            EmailService._dispatch(to, subject, html, None, priority, expires_at)
+            return True
+        except Exception:
+            logger.exception(f"Error al enviar correo a {to}")
+            return False
+    
+    @staticmethod
+    def send_template(to, template_name, priority=0, expires_at=None, **variables):
+        """
+        Envía un correo a partir de una plantilla precompilada de templates/email.
+        
+        Args:
+            to: Destinatario del correo
+            template_name: Nombre de la plantilla (sin extensión)
+            priority: Prioridad de entrega en la bandeja de salida
+            expires_at: Momento tras el cual ya no tiene sentido entregarlo (UTC)
+            **variables: Variables de la plantilla
+        
+        Returns:
+            bool: True si el correo se encoló o envió correctamente, False en caso contrario
+        """
+        try:
+            subject, html, text = email_templates.render(template_name, **variables)
+            EmailService._dispatch(to, subject, html, text, priority, expires_at)
             return True
         except Exception as e:
-            print(f"Error al enviar correo: {str(e)}")
+            logger.error(f"Error al enviar correo con la plantilla {template_name}: {e}")
             return False
     
+    @staticmethod
+    def send_template_bulk(template_name, recipients, priority=0, expires_at=None):
+        """
+        Envía la misma plantilla a varios destinatarios.
+        
+        La plantilla se resuelve una sola vez y cada destinatario solo cuesta
+        sustituir sus variables; con la bandeja de salida activa todos los
+        mensajes se encolan en una única transacción.
+        
+        Args:
+            template_name: Nombre de la plantilla (sin extensión)
+            recipients: Lista de tuplas (correo, dict de variables)
+            priority: Prioridad de entrega en la bandeja de salida
+            expires_at: Momento tras el cual ya no tiene sentido entregarlos (UTC)
+        
+        Returns:
+            int: Número de correos encolados o enviados
+        """
+        try:
+            template = email_templates.get(template_name)
+            messages = [(to, *template.render(**variables)) for to, variables in recipients]
+        except Exception as e:
+            logger.error(f"Error al renderizar la plantilla {template_name}: {e}")
+            return 0
+        
+        if current_app.config.get('MAIL_USE_OUTBOX', False):
+            from utils.email_outbox import queue_emails
+            try:
+                queue_emails(
+                    current_app.config['SQLALCHEMY_DATABASE_URI'], messages,
+                    priority=priority, expires_at=expires_at
+                )
+                return len(messages)
+            except Exception as e:
+                logger.error(f"Error al encolar correos con la plantilla {template_name}: {e}")
+                return 0
+        
+        sent = 0
+        for to, subject, html, text in messages:
+            try:
+                EmailService.deliver(current_app.config, to, subject, html, text)
+                sent += 1
+            except Exception as e:
+                logger.error(f"Error al enviar correo a {to}: {e}")
+        return sent
+    
+    @staticmethod
+    def _dispatch(to, subject, html, text, priority, expires_at):
+        if current_app.config.get('MAIL_USE_OUTBOX', False):
+            from utils.email_outbox import queue_email
+            queue_email(
+                current_app.config['SQLALCHEMY_DATABASE_URI'], to, subject, html,
+                text=text, priority=priority, expires_at=expires_at
+            )
+        else:
+            EmailService.deliver(current_app.config, to, subject, html, text)
+    
+    @staticmethod
+    def deliver(mail_config, to, subject, html, text=None):
+        """
+        Envía de inmediato un correo ya renderizado por el pool SMTP.
+        
+        Args:
+            mail_config: Configuración de correo (MAIL_*)
+            to: Destinatario del correo
+            subject: Asunto del correo
+            html: Cuerpo HTML
+            text: Alternativa en texto plano (opcional)
+        
+        Raises:
+            smtplib.SMTPException, OSError: si el envío falla
+        """
+        # Configuración del servidor SMTP
+        mail_sender = mail_config['MAIL_DEFAULT_SENDER']
+        
+        # Crear mensaje
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = mail_sender
+        msg['To'] = to
+        
+        # La parte preferida va al final: primero el texto plano, después el HTML
+        if text:
+            msg.attach(MIMEText(text, 'plain'))
+        msg.attach(MIMEText(html, 'html'))
+        
+        # Enviar por una conexión ya autenticada del pool
+        get_smtp_pool(mail_config).send(mail_sender, to, msg.as_string())
+    
     @staticmethod
     def send_notification_email(user_email, user_name, notification_title, notification_message):
         """
@@ -65,48 +363,9 @@ class EmailService:
         Returns:
             bool: True si el correo se envió correctamente, False en caso contrario
         """
-        subject = f"CasaMonarca - {notification_title}"
-        
-        # Plantilla HTML para notificaciones
-        template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>CasaMonarca - Notificación</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #4a6da7; color: white; padding: 10px 20px; text-align: center; }}
-                .content {{ padding: 20px; border: 1px solid #ddd; }}
-                .footer {{ text-align: center; margin-top: 20px; font-size: 12px; color: #777; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h2>CasaMonarca - Sistema de Firma Digital</h2>
-                </div>
-                <div class="content">
-                    <p>Hola {user_name},</p>
-                    <p>Tienes una nueva notificación en el sistema de CasaMonarca:</p>
-                    <h3>{notification_title}</h3>
-                    <p>{notification_message}</p>
-                    <p>Por favor, inicia sesión en el sistema para ver más detalles.</p>
-                    <p>Saludos,<br>Equipo de CasaMonarca</p>
-                </div>
-                <div class="footer">
-                    <p>Este es un correo automático, por favor no responda a este mensaje.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return EmailService.send_email(
-            to=user_email,
-            subject=subject,
-            template=template,
+        return EmailService.send_template(
+            user_email,
+            'notification',
             user_name=user_name,
             notification_title=notification_title,
             notification_message=notification_message
@@ -126,51 +385,9 @@ class EmailService:
         Returns:
             bool: True si el correo se envió correctamente, False en caso contrario
         """
-        subject = f"CasaMonarca - Solicitud de firma para documento: {document_name}"
-        
-        # Plantilla HTML para solicitud de firma
-        template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>CasaMonarca - Solicitud de Firma</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #4a6da7; color: white; padding: 10px 20px; text-align: center; }}
-                .content {{ padding: 20px; border: 1px solid #ddd; }}
-                .button {{ display: inline-block; background-color: #4a6da7; color: white; padding: 10px 20px; text-decoration: none; border-radius: 4px; }}
-                .footer {{ text-align: center; margin-top: 20px; font-size: 12px; color: #777; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h2>CasaMonarca - Sistema de Firma Digital</h2>
-                </div>
-                <div class="content">
-                    <p>Hola {user_name},</p>
-                    <p>{requester_name} ha solicitado tu firma para el documento:</p>
-                    <h3>{document_name}</h3>
-                    <p>Por favor, inicia sesión en el sistema para revisar y firmar el documento.</p>
-                    <p style="text-align: center; margin: 30px 0;">
-                        <a href="#" class="button">Ir al Sistema</a>
-                    </p>
-                    <p>Saludos,<br>Equipo de CasaMonarca</p>
-                </div>
-                <div class="footer">
-                    <p>Este es un correo automático, por favor no responda a este mensaje.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return EmailService.send_email(
-            to=user_email,
-            subject=subject,
-            template=template,
+        return EmailService.send_template(
+            user_email,
+            'signature_request',
             user_name=user_name,
             document_name=document_name,
             requester_name=requester_name
@@ -0,0 +1,241 @@
+import html
+import os
+import re
+import threading
+
+# Directorio por defecto de las plantillas (backend/templates/email)
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates', 'email')
+LAYOUT_FILE = 'layout.html'
+STYLES_FILE = 'styles.css'
+
+VARIABLE_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+METADATA_PATTERN = re.compile(r'^\s*<!--\s*(\w+):\s*(.*?)\s*-->\s*$', re.MULTILINE)
+CSS_RULE_PATTERN = re.compile(r'([^{}]+)\{([^{}]*)\}')
+START_TAG_PATTERN = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(/?)>')
+CLASS_PATTERN = re.compile(r'\sclass="([^"]*)"')
+STYLE_PATTERN = re.compile(r'\sstyle="([^"]*)"')
+
+
+class TemplateError(Exception):
+    """Plantilla de correo inexistente o con variables faltantes."""
+
+
+class CompiledText:
+    """
+    Texto con variables ``{{ nombre }}`` dividido una sola vez en partes fijas
+    y variables; renderizar solo une las partes con los valores.
+    """
+
+    def __init__(self, source, escape=False):
+        self.escape = escape
+        self.literals = []
+        self.variables = []
+
+        position = 0
+        for match in VARIABLE_PATTERN.finditer(source):
+            self.literals.append(source[position:match.start()])
+            self.variables.append(match.group(1))
+            position = match.end()
+        self.literals.append(source[position:])
+
+        self.names = frozenset(self.variables)
+
+    def render(self, values):
+        parts = [self.literals[0]]
+        for name, literal in zip(self.variables, self.literals[1:]):
+            value = values[name]
+            value = '' if value is None else str(value)
+            parts.append(html.escape(value) if self.escape else value)
+            parts.append(literal)
+        return ''.join(parts)
+
+
+class EmailTemplate:
+    """
+    Plantilla compilada: asunto, cuerpo HTML (con layout y CSS ya aplicados)
+    y alternativa en texto plano.
+    """
+
+    def __init__(self, name, subject, body_html, body_text):
+        self.name = name
+        self.subject = CompiledText(subject)
+        self.html = CompiledText(body_html, escape=True)
+        self.text = CompiledText(body_text)
+        self.variables = self.subject.names | self.html.names | self.text.names
+
+    def render(self, **values):
+        """
+        Renderiza la plantilla para un destinatario.
+
+        Returns:
+            Tupla (asunto, HTML, texto plano)
+
+        Raises:
+            TemplateError: si falta alguna variable
+        """
+        missing = self.variables - values.keys()
+        if missing:
+            raise TemplateError(f"Faltan variables para la plantilla {self.name}: {', '.join(sorted(missing))}")
+
+        return self.subject.render(values), self.html.render(values), self.text.render(values)
+
+
+class EmailTemplateRegistry:
+    """
+    Registro de plantillas de correo compiladas al iniciar la aplicación.
+
+    Cada ``<nombre>.html`` del directorio se inserta en ``layout.html``, se le
+    aplica en línea el CSS de ``styles.css`` (opcional) y se divide en partes
+    fijas y variables. Si existe ``<nombre>.txt`` se usa como alternativa en
+    texto plano; si no, se deriva del HTML. El asunto y el título se declaran
+    en comentarios al inicio de la plantilla:
+
+        <!-- title: CasaMonarca - Notificación -->
+        <!-- subject: CasaMonarca - {{ notification_title }} -->
+
+    Las variables del HTML se escapan; las del asunto y el texto no.
+    """
+
+    def __init__(self, directory=TEMPLATE_DIR, inline_css=True):
+        self.directory = directory
+        self.inline_css = inline_css
+        self._templates = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Lee y compila todas las plantillas del directorio.
+
+        Returns:
+            Número de plantillas cargadas
+        """
+        templates = self._compile_all()
+        self._templates = templates
+        return len(templates)
+
+    def get(self, name):
+        """
+        Obtiene una plantilla compilada (compila el registro la primera vez).
+
+        Raises:
+            TemplateError: si la plantilla no existe
+        """
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    self._templates = self._compile_all()
+
+        template = self._templates.get(name)
+        if template is None:
+            raise TemplateError(f"Plantilla de correo no encontrada: {name}")
+        return template
+
+    def render(self, name, **values):
+        """
+        Renderiza una plantilla. Devuelve (asunto, HTML, texto plano).
+        """
+        return self.get(name).render(**values)
+
+    def _compile_all(self):
+        layout = self._read(LAYOUT_FILE)
+        styles_path = os.path.join(self.directory, STYLES_FILE)
+        rules = _parse_css(self._read(STYLES_FILE)) if os.path.exists(styles_path) else []
+
+        templates = {}
+        for filename in sorted(os.listdir(self.directory)):
+            name, extension = os.path.splitext(filename)
+            if extension != '.html' or filename == LAYOUT_FILE:
+                continue
+            templates[name] = self._compile(name, self._read(filename), layout, rules)
+        return templates
+
+    def _compile(self, name, source, layout, rules):
+        metadata = dict(METADATA_PATTERN.findall(source))
+        content = METADATA_PATTERN.sub('', source).strip('\n')
+
+        page = layout.replace('{{ title }}', metadata.get('title', '')).replace('{{ content }}', content)
+        if rules:
+            page = _inline_css(page, rules) if self.inline_css else _embed_css(page, rules)
+
+        text_path = os.path.join(self.directory, f"{name}.txt")
+        if os.path.exists(text_path):
+            text = self._read(f"{name}.txt")
+        else:
+            text = _html_to_text(layout.replace('{{ title }}', '').replace('{{ content }}', content))
+
+        return EmailTemplate(name, metadata.get('subject', ''), page, text)
+
+    def _read(self, filename):
+        with open(os.path.join(self.directory, filename), encoding='utf-8') as template_file:
+            return template_file.read()
+
+
+def _parse_css(source):
+    """
+    Convierte reglas simples (etiqueta, .clase o listas separadas por coma) en
+    una lista [(selector, declaraciones)] en orden de aparición.
+    """
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.DOTALL)
+    rules = []
+    for selectors, declarations in CSS_RULE_PATTERN.findall(source):
+        declarations = '; '.join(part.strip() for part in declarations.split(';') if part.strip())
+        for selector in selectors.split(','):
+            rules.append((selector.strip(), declarations))
+    return rules
+
+
+def _inline_css(page, rules):
+    """
+    Copia las declaraciones CSS al atributo style de cada elemento; los estilos
+    en línea ya presentes conservan la prioridad.
+    """
+    def apply(match):
+        tag, attributes, closing = match.group(1), match.group(2) or '', match.group(3)
+        class_match = CLASS_PATTERN.search(attributes)
+        classes = set(class_match.group(1).split()) if class_match else set()
+
+        declarations = [
+            css for selector, css in rules
+            if selector == tag.lower() or (selector.startswith('.') and selector[1:] in classes)
+        ]
+        if not declarations:
+            return match.group(0)
+
+        style_match = STYLE_PATTERN.search(attributes)
+        if style_match:
+            declarations.append(style_match.group(1).strip().rstrip(';'))
+            attributes = STYLE_PATTERN.sub('', attributes)
+
+        style = '; '.join(declarations)
+        return f'<{tag}{attributes} style="{style}"{closing}>'
+
+    return START_TAG_PATTERN.sub(apply, page)
+
+
+def _embed_css(page, rules):
+    styles = '\n'.join(f"        {selector} {{ {css} }}" for selector, css in rules)
+    return page.replace('</head>', f"    <style>\n{styles}\n    </style>\n</head>", 1)
+
+
+def _html_to_text(page):
+    page = re.sub(r'<(head|style)[^>]*>.*?</\1>', '', page, flags=re.DOTALL | re.IGNORECASE)
+    page = re.sub(r'<br\s*/?>', '\n', page, flags=re.IGNORECASE)
+    page = re.sub(r'</(p|div|h\d)>', '\n\n', page, flags=re.IGNORECASE)
+    page = re.sub(r'<[^>]+>', '', page)
+    lines = [line.strip() for line in html.unescape(page).splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip() + '\n'
+
+
+# Registro compartido; init_email(app) lo compila al iniciar (si no, en el primer uso)
+email_templates = EmailTemplateRegistry()
+
+
+def load_email_templates(directory=TEMPLATE_DIR, inline_css=True):
+    """
+    Compila las plantillas del registro compartido. La llama init_email(app)
+    de utils/email_service.py con MAIL_INLINE_CSS.
+    """
+    email_templates.directory = directory
+    email_templates.inline_css = inline_css
+    email_templates.load()
+    return email_templates
@@ -186,6 +186,64 @@ class PDFSigner:
                     pass
             return None
     
+    def sign_bytes(self, data: bytes) -> bytes:
+        """
+        Firma datos arbitrarios con la clave privada del firmante (SHA-256).
+        
+        Se usa para firmar los checkpoints del registro de auditoría con la misma
+        clave que los documentos PDF.
+        
+        Args:
+            data: Datos a firmar
+            
+        Returns:
+            La firma (PKCS#1 v1.5 para claves RSA, ECDSA para claves EC)
+        """
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+        
+        with open(self.key_path, 'rb') as key_file:
+            private_key = serialization.load_pem_private_key(
+                key_file.read(),
+                password=self.passphrase.encode() if self.passphrase else None
+            )
+        
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            return private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        if isinstance(private_key, ec.EllipticCurvePrivateKey):
+            return private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+        raise ValueError("Tipo de clave privada no soportado para firmar datos")
+    
+    def verify_bytes(self, data: bytes, signature: bytes) -> bool:
+        """
+        Verifica una firma generada con sign_bytes usando el certificado del firmante.
+        
+        Args:
+            data: Datos firmados
+            signature: Firma a verificar
+            
+        Returns:
+            True si la firma es válida, False en caso contrario
+        """
+        from cryptography import x509
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+        
+        with open(self.cert_path, 'rb') as cert_file:
+            public_key = x509.load_pem_x509_certificate(cert_file.read()).public_key()
+        
+        try:
+            if isinstance(public_key, rsa.RSAPublicKey):
+                public_key.verify(signature, data, padding.PKCS1v15(), hashes.SHA256())
+            elif isinstance(public_key, ec.EllipticCurvePublicKey):
+                public_key.verify(signature, data, ec.ECDSA(hashes.SHA256()))
+            else:
+                return False
+            return True
+        except InvalidSignature:
+            return False
+    
     @staticmethod
     def check_signatures(pdf_path: str) -> List[Dict[str, Any]]:
         """
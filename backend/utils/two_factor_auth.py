@@ -3,6 +3,7 @@ import string
 from datetime import datetime, timedelta
 from flask import current_app
 from .email_service import EmailService
+from .email_outbox import PRIORITY_HIGH
 
 class TwoFactorAuth:
     @staticmethod
@@ -36,50 +37,12 @@ class TwoFactorAuth:
         # Establecer tiempo de expiración (5 minutos)
         expiry_time = datetime.utcnow() + timedelta(minutes=5)
         
-        # Enviar correo con el código
-        subject = "CasaMonarca - Código de verificación"
-        
-        # Plantilla HTML para el correo de verificación
-        template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>CasaMonarca - Código de Verificación</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #4a6da7; color: white; padding: 10px 20px; text-align: center; }}
-                .content {{ padding: 20px; border: 1px solid #ddd; }}
-                .code {{ font-size: 24px; font-weight: bold; text-align: center; padding: 10px; margin: 20px 0; background-color: #f5f5f5; letter-spacing: 5px; }}
-                .footer {{ text-align: center; margin-top: 20px; font-size: 12px; color: #777; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h2>CasaMonarca - Sistema de Firma Digital</h2>
-                </div>
-                <div class="content">
-                    <p>Hola {user_name},</p>
-                    <p>Has solicitado iniciar sesión en el sistema de CasaMonarca. Para completar el proceso, utiliza el siguiente código de verificación:</p>
-                    <div class="code">{code}</div>
-                    <p>Este código expirará en 5 minutos.</p>
-                    <p>Si no has solicitado este código, por favor ignora este correo o contacta al administrador del sistema.</p>
-                    <p>Saludos,<br>Equipo de CasaMonarca</p>
-                </div>
-                <div class="footer">
-                    <p>Este es un correo automático, por favor no responda a este mensaje.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        EmailService.send_email(
-            to=user_email,
-            subject=subject,
-            template=template,
+        # Se encola con prioridad alta y deja de reintentarse cuando el código expira
+        EmailService.send_template(
+            user_email,
+            'verification_code',
+            priority=PRIORITY_HIGH,
+            expires_at=expiry_time,
             user_name=user_name,
             code=code
         )